@@ -1,9 +1,25 @@
 import threading
+import time
+import queue
 import tkinter as tk
+from tkinter import filedialog, messagebox
 import cv2
 from PIL import Image, ImageTk
 
+from ..capture import capture
+
+def get_display_size(img_w, img_h, label_w, label_h):
+    """Largest size of an image that fits the label keeping its aspect ratio"""
+    scale = min(label_w / img_w, label_h / img_h)
+    return max(1, int(img_w * scale)), max(1, int(img_h * scale))
+
+
 class GUI:
+    # Upper bound of display refreshes per second
+    DISPLAY_FPS = 30
+    # Milliseconds between checks for errors reported by the worker threads
+    ERROR_POLL_MS = 250
+
     def __init__(self, backend):
         self.main_options_logic = {
             "start": [
@@ -23,8 +39,17 @@ class GUI:
         self.raw_view = True
         self.tracking_view = False
         self.can_open_settings = True
-        self.webcam_queue = []
+        # newest tracked frames, the GUI never falls behind the tracker by more than this
+        self.display_buffer = capture.LatestFrameBuffer(pool_consumers=1)
         self.backend = backend
+        self.display_job = None
+        self.raw_sequence = 0
+        self.tracking_sequence = 0
+        self.photo_image = None
+        self.scaled = None
+        self.flipped = None
+        self.display_size = None
+        self.label_size = None
 
         self.root = tk.Tk()
         self.root.title("RoadSense AI")
@@ -47,8 +72,21 @@ class GUI:
 
         self.video_label = tk.Label(self.main_content)
         self.video_label.pack(fill=tk.BOTH, expand=True)
+        self.video_label.bind("<Configure>", self.on_video_label_resize)
+        # Display refreshes stop while the window is minimized and start again when it is shown
+        self.root.bind("<Map>", lambda event: self.start_display())
 
         self.create_sidebar("start")
+        self.root.after(self.ERROR_POLL_MS, self.show_errors)
+
+    def show_errors(self):
+        """Show the errors the worker threads reported, Tk may only be used from its own thread"""
+        try:
+            while True:
+                messagebox.showerror("RoadSense AI", self.backend.errors.get_nowait(), parent=self.root)
+        except queue.Empty:
+            pass
+        self.root.after(self.ERROR_POLL_MS, self.show_errors)
 
     def create_sidebar(self, state):
         """Setup the sidebar based on the state, (start, tracking, paused)"""
@@ -67,6 +105,8 @@ class GUI:
         settings_button.pack(pady=10)
         help_btn = tk.Button(self.sidebar, text="Help", command=self.open_help)
         help_btn.pack(pady=10)
+        performance_btn = tk.Button(self.sidebar, text="Performance", command=self.open_performance)
+        performance_btn.pack(pady=10)
 
 
     #* Improve
@@ -132,39 +172,76 @@ class GUI:
 
         Important Notes:
 
-        1. There is a problem that before starting tracking, the camera is a bit slow (bug)
-        2. The Tracker button will only work if the Start Tracking button is pressed
-        3. Full explanation on how the program works soon
-        4. All of the directions will be defined based on the forward direction, which must be callibrated
+        1. The Tracker button will only work if the Start Tracking button is pressed
+        2. Full explanation on how the program works soon
+        3. All of the directions will be defined based on the forward direction, which must be callibrated
         """
 
         help_text = tk.Text(help_window, font=("Arial", 12))
         help_text.insert(tk.END, help_str)
         help_text.pack()
 
+    def open_performance(self):
+        """Show per-stage latency percentiles and FPS of the tracking loop"""
+        performance_window = tk.Toplevel(self.root)
+        performance_window.geometry("700x400")
+        performance_window.title("Performance")
+
+        report_text = tk.Text(performance_window, font=("Courier", 10))
+        report_text.pack(fill=tk.BOTH, expand=True)
+        # The UI thread's CPU use since the last refresh, this runs on the Tk thread as well
+        last_times = [time.perf_counter(), time.thread_time()]
+
+        def refresh():
+            now, cpu = time.perf_counter(), time.thread_time()
+            ui_cpu = (cpu - last_times[1]) / (now - last_times[0]) if now > last_times[0] else 0.0
+            last_times[:] = now, cpu
+
+            report_text.delete("1.0", tk.END)
+            report_text.insert(tk.END, "Latencies in ms, display_latency is from capture to screen\n\n"
+                                       + self.backend.profiler.report())
+            report_text.insert(tk.END, f"\n\nDropped frames: capture {self.backend.frame_buffer.dropped}, "
+                                       f"display {self.display_buffer.dropped}")
+            report_text.insert(tk.END, f"\nUI thread CPU: {ui_cpu:.1%}")
+            if self.backend.governor is not None:
+                report_text.insert(tk.END, f"\n{self.backend.governor.report()}")
+            startup = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.backend.startup_times.items())
+            report_text.insert(tk.END, f"\nStartup: {startup}")
+
+        def export(method, extension):
+            path = filedialog.asksaveasfilename(parent=performance_window, defaultextension=extension)
+            if path:
+                method(path)
+
+        tk.Button(performance_window, text="Refresh", command=refresh).pack(side=tk.LEFT, padx=10, pady=10)
+        tk.Button(performance_window, text="Export CSV",
+                  command=lambda: export(self.backend.profiler.export_csv, ".csv")).pack(side=tk.LEFT, padx=10)
+        tk.Button(performance_window, text="Export Trace",
+                  command=lambda: export(self.backend.profiler.export_chrome_trace, ".json")).pack(side=tk.LEFT, padx=10)
+        refresh()
+
     def on_start_tracking_click(self):
         self.tracking_view = True
         self.raw_view = False
-        self.backend.start_tracking = True
-        self.backend.start_webcam = True
+        self.backend.run_state.start()
         self.create_sidebar("tracking")
+        self.start_display()
 
     def on_stop_tracking_click(self):
         self.tracking_view = False
         self.raw_view = True
-        self.backend.start_tracking = False
-        self.backend.start_webcam = True
+        self.backend.run_state.stop()
         self.create_sidebar("start")
+        self.start_display()
 
     def on_pause_tracking_click(self):
-        self.backend.start_tracking = False
-        self.backend.start_webcam = False
+        self.backend.run_state.pause()
         self.create_sidebar("paused")
 
     def on_resume_tracking_click(self):
-        self.backend.start_tracking = True
-        self.backend.start_webcam = True
+        self.backend.run_state.resume()
         self.create_sidebar("tracking")
+        self.start_display()
 
     def on_callibrate_click(self):
         callibration_thread = threading.Thread(target=self.backend.callibrate, daemon=True)
@@ -181,32 +258,83 @@ class GUI:
         self.can_open_settings = True
 
     def on_close_program(self):
+        # Hide the window right away, the model may still be loading
+        self.root.withdraw()
+        self.backend.run_state.shutdown()
+        self.close_program()
+
+    def close_program(self):
+        """Stop the backend once its initialization finished, without blocking the Tk thread until then"""
+        if self.backend.initializing:
+            self.root.after(100, self.close_program)
+            return
         self.backend.terminate_threads()
         self.root.destroy()
 
 
-    def update_webcam_feed(self, cap):
-        while True:
-            if not self.tracking_view and self.webcam_queue:
-                self.webcam_queue.clear()
+    def on_video_label_resize(self, event):
+        self.label_size = (event.width, event.height)
 
-            if self.backend.start_webcam:
+    def start_display(self):
+        """Schedule display refreshes on the Tk main loop, if they are not running already"""
+        if self.display_job is None:
+            self.display_job = self.root.after(0, self.update_webcam_feed)
 
-                if self.raw_view:
-                    _, frame = cap.read()
-                    frame = cv2.flip(frame, 1)
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    def update_webcam_feed(self):
+        """Show the newest frame of the current view, then schedule the next refresh.
 
-                elif self.tracking_view:
-                    if self.webcam_queue:
-                        frame = self.webcam_queue[0]
-                        self.webcam_queue.pop(0)
-
-                # Convert to PIL format to display in Tkinter Label
-                image = Image.fromarray(frame)
-                image = ImageTk.PhotoImage(image=image)
-                self.video_label.configure(image=image)
-                self.video_label.image = image
+        Runs on the Tk main loop and never waits for frames. Refreshes stop while the webcam is
+        paused or the window is minimized, start_display() starts them again.
+        """
+        self.display_job = None
+        if not self.backend.run_state.webcam or not self.root.winfo_viewable() or self.backend.frame_buffer.closed:
+            return
+
+        start = time.perf_counter_ns()
+        frame = None
+        frame_buffer = None
+        if self.raw_view:
+            # Camera frames, still unflipped and in BGR
+            frame_buffer = self.backend.frame_buffer
+            frame = frame_buffer.get_latest(self.raw_sequence, timeout=0)
+            if frame is not None:
+                self.raw_sequence = frame.sequence
+        elif self.tracking_view:
+            frame_buffer = self.display_buffer
+            frame = frame_buffer.get_latest(self.tracking_sequence, timeout=0)
+            if frame is not None:
+                self.tracking_sequence = frame.sequence
+
+        if frame is not None:
+            if self.label_size is not None:
+                self.show(frame.image, rgb=not self.raw_view)
+                end = self.backend.profiler.record("display", start)
+                self.backend.profiler.record("display_latency", int(frame.timestamp * 1e9), end)
+            frame_buffer.release(frame)
+
+        delay = 1.0 / self.DISPLAY_FPS - (time.perf_counter_ns() - start) / 1e9
+        self.display_job = self.root.after(max(1, int(delay * 1000)), self.update_webcam_feed)
+
+    def show(self, image, rgb):
+        """Draw a frame into the video label, scaled to fit it"""
+        start = time.perf_counter_ns()
+        img_h, img_w = image.shape[:2]
+        display_size = get_display_size(img_w, img_h, *self.label_size)
+        # Scale first so the flip and the color conversion only touch the displayed pixels,
+        # each into an array kept for the next frame of the same size
+        image = self.scaled = cv2.resize(image, display_size, self.scaled, interpolation=cv2.INTER_LINEAR)
+        if not rgb:
+            self.flipped = cv2.flip(image, 1, self.flipped)
+            image = cv2.cvtColor(self.flipped, cv2.COLOR_BGR2RGB, self.scaled)
+        start = self.backend.profiler.record("scale", start)
+
+        if self.photo_image is None or self.display_size != display_size:
+            self.photo_image = ImageTk.PhotoImage(Image.fromarray(image))
+            self.display_size = display_size
+            self.video_label.configure(image=self.photo_image)
+        else:
+            self.photo_image.paste(Image.fromarray(image))
+        self.backend.profiler.record("tk_image", start)
 
     def clear_frame(self, frame):
         """delete all widgets of a frame"""
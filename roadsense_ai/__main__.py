@@ -1,6 +1,50 @@
-from . import app
+import argparse
 
-def main():
-    driver_aid_system = app.DriverAidSystem()
-    driver_aid_system.start()
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="roadsense_ai")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("live", help="track the webcam with the GUI and voice alerts (default)")
+
+    from .replay import replay
+    replay.add_arguments(commands.add_parser("replay", help="analyse a recorded video headless"))
+    from .fleet import fleet
+    fleet.add_arguments(commands.add_parser("fleet", help="analyse many recordings or cameras at once headless"))
+    from .sweep import sweep
+    sweep.add_arguments(commands.add_parser("sweep", help="score grids of detector settings on a replay timeline"))
+    from .telemetry import telemetry
+    telemetry.add_arguments(commands.add_parser("telemetry", help="summarize the trips of a telemetry database"))
+    from .service import service
+    service.add_arguments(commands.add_parser("serve", help="track a camera headless and publish the detections "
+                                                            "on a Unix socket"))
+    service.add_listen_arguments(commands.add_parser("listen", help="print the detections published by serve"))
+    voice_cache = commands.add_parser("voice-cache", help="pre-render every spoken phrase, e.g. at install")
+    voice_cache.add_argument("--cache-dir", help="clip directory (default the per-user cache)")
+
+    args = parser.parse_args(argv)
+    if args.command == "replay":
+        replay.main(args)
+    elif args.command == "fleet":
+        fleet.main(args)
+    elif args.command == "sweep":
+        sweep.main(args)
+    elif args.command == "telemetry":
+        telemetry.main(args)
+    elif args.command == "serve":
+        service.main(args)
+    elif args.command == "listen":
+        service.listen(args)
+    elif args.command == "voice-cache":
+        from .alerts import alerts
+        from .voice_engine import voice_engine
+        clip_voice_engine = voice_engine.ClipVoiceEngine(voice_engine.VoiceEngine(), cache_dir=args.cache_dir)
+        phrases = alerts.get_phrases()
+        cached = clip_voice_engine.preload(phrases)
+        print(f"{len(phrases)} phrases, {cached} already cached -> {clip_voice_engine.cache_dir}")
+    else:
+        from . import app
+        driver_aid_system = app.DriverAidSystem()
+        driver_aid_system.start()
+
+if __name__ == "__main__":
+    main()
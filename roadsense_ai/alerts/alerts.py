@@ -0,0 +1,157 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from .. import responses
+from ..profiler import profiler
+
+
+# Lower is more urgent, announcements like the callibration prompts go first
+ANNOUNCEMENT = 0
+PRIORITIES = {
+    "drowsiness_detect": 1,
+    "driver_not_visible": 2,
+    "head_pose_detect": 3,
+    "sleep_reminder_detect": 4,
+}
+# Seconds after an alert was spoken before the same alert is spoken again
+COOLDOWNS = {
+    "drowsiness_detect": 2.0,
+    "driver_not_visible": 4.0,
+    "head_pose_detect": 3.0,
+    "sleep_reminder_detect": 300.0,
+}
+
+
+def get_phrase(alert_type):
+    return random.choice(responses.responses[alert_type])
+
+def get_phrases():
+    """Every phrase the scheduler can be asked to say, to pre-render them"""
+    return [phrase for phrases in responses.responses.values() for phrase in phrases] + list(responses.prompts.values())
+
+
+class Alert:
+    """A queued phrase; done is set once it was spoken, preempted or dropped.
+
+    preempted is set when a more urgent alert asked to stop it, it stays set only when the
+    backend confirms the phrase was cut short.
+    """
+    __slots__ = ("priority", "alert_type", "text", "raised", "raised_ns", "done", "preempted")
+
+    def __init__(self, priority, alert_type, text, raised):
+        self.priority = priority
+        self.alert_type = alert_type
+        self.text = text
+        self.raised = raised
+        self.raised_ns = time.perf_counter_ns()
+        self.done = threading.Event()
+        self.preempted = False
+
+
+class AlertScheduler:
+    """The single consumer of a voice backend, speaking queued alerts by priority on its own thread.
+
+    raise_alert() never blocks on speech, so the tracking loop can call it on every frame an
+    alert is active: an alert that is already queued, being spoken or was spoken within its
+    cooldown is dropped. A more urgent alert stops a less urgent one that is being spoken. The time from
+    raising an alert to its sound starting is recorded as the "alert_latency" stage.
+    """
+    def __init__(self, backend, cooldowns=None, priorities=None, clock=time.monotonic, stage_profiler=None):
+        self.backend = backend
+        self.profiler = stage_profiler or profiler.StageProfiler()
+        self.cooldowns = {**COOLDOWNS, **(cooldowns or {})}
+        self.priorities = {**PRIORITIES, **(priorities or {})}
+        self.clock = clock
+
+        self.queue = []
+        self.order = itertools.count()
+        self.pending = set()
+        self.last_spoken = {}
+        self.speaking = None
+        self.running = False
+        self.condition = threading.Condition()
+        self.thread = None
+        self.counts = {"raised": 0, "deduplicated": 0, "cooling_down": 0, "spoken": 0, "preempted": 0}
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="alert-scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Stop speaking, drop the queued alerts and wait for the worker to exit"""
+        with self.condition:
+            self.running = False
+            for _, _, alert in self.queue:
+                alert.done.set()
+            self.queue.clear()
+            self.pending.clear()
+            self.condition.notify_all()
+        self.backend.stop()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def raise_alert(self, alert_type):
+        """Queue an alert of a type from responses.responses, returns the Alert or None when dropped"""
+        with self.condition:
+            self.counts["raised"] += 1
+            if alert_type in self.pending:
+                self.counts["deduplicated"] += 1
+                return None
+            last_spoken = self.last_spoken.get(alert_type)
+            if last_spoken is not None and self.clock() - last_spoken < self.cooldowns.get(alert_type, 0.0):
+                self.counts["cooling_down"] += 1
+                return None
+
+            self.pending.add(alert_type)
+            return self.push(Alert(self.priorities.get(alert_type, max(self.priorities.values()) + 1),
+                                   alert_type, get_phrase(alert_type), self.clock()))
+
+    def announce(self, text, priority=ANNOUNCEMENT):
+        """Queue a phrase that is never deduplicated, wait on the returned Alert's done event if needed"""
+        with self.condition:
+            return self.push(Alert(priority, None, text, self.clock()))
+
+    def push(self, alert):
+        heapq.heappush(self.queue, (alert.priority, next(self.order), alert))
+        speaking = self.speaking
+        if speaking is not None and alert.priority < speaking.priority and not speaking.preempted:
+            speaking.preempted = True
+            self.backend.stop()
+        self.condition.notify()
+        return alert
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or not self.running)
+                if not self.running:
+                    return
+                _, _, alert = heapq.heappop(self.queue)
+                self.speaking = alert
+                # Under the lock, so a stop from push() can only be meant for this alert
+                self.backend.reset()
+
+            interrupted = False
+            try:
+                interrupted = self.backend.speak(alert.text,
+                                                 lambda: self.profiler.record("alert_latency", alert.raised_ns))
+            finally:
+                with self.condition:
+                    self.speaking = None
+                    # The type stays pending while it is spoken, so it is not queued again before
+                    # its cooldown starts
+                    self.pending.discard(alert.alert_type)
+                    # A preempted alert gets no cooldown, it is spoken again if it is raised again.
+                    # A phrase that still played to the end was not preempted.
+                    alert.preempted = alert.preempted and bool(interrupted)
+                    if alert.preempted:
+                        self.counts["preempted"] += 1
+                    else:
+                        self.counts["spoken"] += 1
+                        if alert.alert_type is not None:
+                            self.last_spoken[alert.alert_type] = self.clock()
+                alert.done.set()
@@ -1,151 +1,299 @@
-import sys
-import random
+import queue
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
-import mediapipe as mp
-import winsound
 
 from .GUI import GUI
+from .alerts import alerts
+from .capture import capture
 from .voice_engine import voice_engine
-from .drowsiness_detection import drowsiness_detection
-from .head_pose_estimation import head_pose_estimation
+from .frame_analysis import frame_analysis
+from .inference import inference
+from .landmark_provider import landmark_provider
+from .pipeline import pipeline
+from .qos import qos
+from .profiler import profiler
+from .run_state import run_state
+from .telemetry import telemetry
+from .tracking import tracking
 from . import responses
 
 
-def get_audio(detection_type: str):
-    return random.choice(responses.responses[detection_type])
-
-def get_face_mesh(max_num_faces=1, refine_landmarks=True, min_detection_confidence=0.5, min_tracking_confidence=0.5):
-    return mp.solutions.face_mesh.FaceMesh(
-        max_num_faces=max_num_faces,
-        refine_landmarks=refine_landmarks,
-        min_detection_confidence=min_detection_confidence,
-        min_tracking_confidence=min_tracking_confidence,)
-
-
 class DriverAidSystem:
-    EAR_THRESH = 0.24
-    DROWSINESS_WAIT_TIME = 0.9
-    HEAD_POSE_WAIT_TIME = 0.7
-    HEAD_POSE_OFFSET = 10
+    EAR_THRESH = pipeline.DetectionPipeline.EAR_THRESH
+    DROWSINESS_WAIT_TIME = pipeline.DetectionPipeline.DROWSINESS_WAIT_TIME
+    HEAD_POSE_WAIT_TIME = pipeline.DetectionPipeline.HEAD_POSE_WAIT_TIME
+    HEAD_POSE_OFFSET = pipeline.DetectionPipeline.HEAD_POSE_OFFSET
+    # Run the landmark model on the area around the driver's face, and cap its input size
+    FACE_ROI = False
+    MAX_INFERENCE_SIZE = None
+    # Run the landmark model on every n-th frame only, tracking the landmarks in between
+    KEYFRAME_INTERVAL = None
+    # OpenCV calibration file of the webcam for the head pose, None for a default pinhole camera
+    CAMERA_CALIBRATION = None
+    # MediaPipe Tasks FaceLandmarker .task file to find the landmarks with, None for the bundled
+    # FaceMesh. "live_stream" mode returns the newest finished result without waiting for the
+    # model, landmarks may then lag the frame and FACE_ROI cannot be used.
+    LANDMARK_MODEL = None
+    LANDMARK_RUNNING_MODE = "video"
+    # Run the landmark model and the measurements in a worker process, keeping them off the GIL
+    # of the capture, GUI and alert threads. Pays off with a spare CPU core, keyframes are not
+    # used in the worker. A worker that dies is replaced up to MAX_WORKER_RESTARTS times.
+    INFERENCE_PROCESS = False
+    MAX_WORKER_RESTARTS = 3
+    # Record every frame's measurements and the alerts of a trip, into a SQLite database for a
+    # .db path or into compressed JSONL files for a directory. None records nothing.
+    TELEMETRY_PATH = None
+    # Per-frame latency budget in seconds, e.g. 0.033. Overlay, input size, keyframes and the
+    # FaceMesh variant are then stepped down while tracking is slower and back up once it
+    # is fast again. Not used with INFERENCE_PROCESS.
+    QOS_BUDGET = None
 
 
-    def __init__(self) -> None:
-        self.alpha = 0.5
-        self.start_tracking = False
-        self.start_webcam = True
+    def __init__(self, camera=0) -> None:
+        # Seconds from construction to each startup milestone: window, camera, model, voice, ready, first_frame
+        self.startup_start = time.perf_counter()
+        self.startup_times = {}
+        self.camera = camera
+        self.run_state = run_state.RunState()
+        self.ready = threading.Event()
         self.driver_not_visible = False
-        self.drowsiness_detect_bool = False
-        self.head_pose_detect_bool = False
-        self.audio_lock = threading.Lock()
-        self.audio_list = []
 
-        self.frame1 = None
-        self.frame2 = None
-        self.bool_1 = False
-        self.bool_2 = False
+        self.profiler = profiler.StageProfiler()
+        # Camera frames are read into recycled arrays, held by the tracking thread and the raw view
+        self.frame_buffer = capture.LatestFrameBuffer(pool_consumers=2)
+        # The detectors exist from the start for the settings window, the frame analyzer
+        # is attached once the model is loaded
+        self.pipeline = pipeline.DetectionPipeline(None, self.profiler)
+        self.drowsiness_detector = self.pipeline.drowsiness_detector
+        self.head_pose_detector = self.pipeline.head_pose_detector
+        if self.CAMERA_CALIBRATION:
+            self.head_pose_detector.load_calibration(self.CAMERA_CALIBRATION)
 
-        self.cap = cv2.VideoCapture(0)
-        self.face_mesh = get_face_mesh()
+        # The camera, model and voice engine are set up by initialize() in the background
+        self.cap = None
+        self.capture_thread = None
+        self.face_mesh = None
+        self.frame_analyzer = None
+        self.inference_worker = None
+        self.worker_restarts = 0
+        self.governor = None
+        self.voice_engine = None
+        self.clip_voice_engine = None
+        self.alert_scheduler = None
+        self.tracking_thread = None
+        self.telemetry = None
+        self.init_thread = None
+        # Messages for the user from the worker threads, shown by the GUI
+        self.errors = queue.SimpleQueue()
 
         self.gui = GUI.GUI(self)
-        self.voice_engine = voice_engine.VoiceEngine()
-        self.drowsiness_detector = drowsiness_detection.DrowsinessDetector(self.face_mesh)
-        self.head_pose_detector = head_pose_estimation.HeadPoseEstimator(self.face_mesh)
-
-        self.drowsiness_detector.EAR_THRESH = DriverAidSystem.EAR_THRESH
-        self.drowsiness_detector.WAIT_TIME = DriverAidSystem.DROWSINESS_WAIT_TIME
-        self.head_pose_detector.WAIT_TIME = DriverAidSystem.HEAD_POSE_WAIT_TIME
-        self.head_pose_detector.OFFSET = DriverAidSystem.HEAD_POSE_OFFSET
+        # Overlays are drawn into the arrays the display hands back
+        self.pipeline.overlay_pool = self.gui.display_buffer.pool
 
 
     def start(self):
-        self.tracking_thread = threading.Thread(target=self.track, daemon=True)
-        self.webcam_thread = threading.Thread(target=self.gui.update_webcam_feed, args=(self.cap,), daemon=True)
-        self.tracking_thread.start()
-        self.webcam_thread.start()
+        """Show the window right away and initialize everything else in the background"""
+        self.init_thread = threading.Thread(target=self.initialize, name="initialize")
+        self.init_thread.start()
+        self.gui.root.after(0, self.mark_startup, "window")
+        self.gui.start_display()
         self.gui.run()
 
+    def mark_startup(self, milestone):
+        self.startup_times[milestone] = time.perf_counter() - self.startup_start
+
+    @property
+    def initializing(self):
+        return self.init_thread is not None and self.init_thread.is_alive()
+
+    def report_error(self, message):
+        """Show a message to the user, from any thread"""
+        self.errors.put(message)
+
+    def initialize(self):
+        """Open the camera, load the model and the voice engine in parallel, then start the worker threads.
+
+        When any of them fails the app shuts down tracking and the GUI shows why.
+        """
+        try:
+            with ThreadPoolExecutor(max_workers=3, thread_name_prefix="initialize") as executor:
+                tasks = [executor.submit(task) for task in (self.open_camera, self.load_model, self.load_voice)]
+            for task in tasks:
+                task.result()
+            if self.run_state.is_shutdown:
+                return
+
+            self.capture_thread = capture.CaptureThread(self.cap, self.frame_buffer, self.profiler, self.run_state,
+                                                        live=isinstance(self.camera, int))
+            self.capture_thread.start()
+            self.alert_scheduler.start()
+            if DriverAidSystem.TELEMETRY_PATH:
+                self.telemetry = telemetry.TelemetryRecorder(telemetry.get_writer(DriverAidSystem.TELEMETRY_PATH))
+                self.telemetry.start()
+            self.tracking_thread = threading.Thread(target=self.track, name="tracking")
+            self.tracking_thread.start()
+            self.mark_startup("ready")
+        except Exception as error:
+            self.run_state.shutdown()
+            self.report_error(f"RoadSense AI could not start: {error!r}")
+        finally:
+            # wakes a callibration waiting for the initialization
+            self.ready.set()
+
+    def open_camera(self):
+        self.cap = cv2.VideoCapture(self.camera)
+        self.mark_startup("camera")
+
+    def load_model(self):
+        if DriverAidSystem.INFERENCE_PROCESS:
+            self.inference_worker = inference.InferenceWorker(
+                self.profiler, roi=DriverAidSystem.FACE_ROI, max_input_size=DriverAidSystem.MAX_INFERENCE_SIZE,
+                landmark_model=DriverAidSystem.LANDMARK_MODEL, running_mode=DriverAidSystem.LANDMARK_RUNNING_MODE)
+            self.inference_worker.start()
+            self.mark_startup("model")
+            return
+
+        self.face_mesh = landmark_provider.get_landmark_provider(
+            DriverAidSystem.LANDMARK_MODEL, DriverAidSystem.LANDMARK_RUNNING_MODE)
+        self.frame_analyzer = frame_analysis.FrameAnalyzer(
+            self.face_mesh, self.profiler, roi=DriverAidSystem.FACE_ROI, max_input_size=DriverAidSystem.MAX_INFERENCE_SIZE)
+        self.frame_analyzer.warm_up()
+        self.pipeline.frame_analyzer = self.frame_analyzer
+        if DriverAidSystem.KEYFRAME_INTERVAL:
+            tracking.use_keyframes(self.pipeline, DriverAidSystem.KEYFRAME_INTERVAL)
+        if DriverAidSystem.QOS_BUDGET:
+            self.governor = qos.QosGovernor(self.pipeline, DriverAidSystem.QOS_BUDGET)
+        self.mark_startup("model")
+
+    def load_voice(self):
+        self.voice_engine = voice_engine.VoiceEngine()
+        # Every phrase is played from a pre-rendered clip, only missing clips are synthesized
+        self.clip_voice_engine = voice_engine.ClipVoiceEngine(self.voice_engine)
+        self.clip_voice_engine.preload(alerts.get_phrases())
+        self.alert_scheduler = alerts.AlertScheduler(self.clip_voice_engine, stage_profiler=self.profiler)
+        self.mark_startup("voice")
+
     def track(self):
-        counter = 0
-        max_counter_limit = 10  # Adjust this value to set the time limit
-        
-        while True:
-            if self.start_tracking:
-                try:
-                    _, inp_frame = self.cap.read()
-
-                    frame_start_time = time.time()
-
-                    # run detections on inp_frame
-                    self.frame1, self.bool_1 = self.drowsiness_detector.run(inp_frame)
-                    try:
-                        self.frame2, self.bool_2 = self.head_pose_detector.run(inp_frame)
-                        counter = 0
-                        self.driver_not_visible = False
-                    
-                    except TypeError:
-                        counter += 1
-                        if counter >= max_counter_limit:
-                            self.driver_not_visible = True
-    
-                except AttributeError:
+        last_sequence = 0
+        # sleeps while tracking is stopped or paused, returns on shutdown
+        while self.run_state.wait_for_tracking():
+            # always take the newest captured frame, frames that came in meanwhile are skipped.
+            # The timeout lets a pause or shutdown through while the camera delivers nothing.
+            frame = self.frame_buffer.get_latest(last_sequence, timeout=0.5)
+            if frame is None:
+                if self.frame_buffer.closed:
                     return None
+                continue
+            last_sequence = frame.sequence
 
-                try:
-                    if self.gui.tracking_view:    
-                        # Combine the two frames using alpha blending            
-                        combined_frame = cv2.addWeighted(self.frame1, 1 - self.alpha, self.frame2, self.alpha, 0)
-                        combined_frame = cv2.cvtColor(combined_frame, cv2.COLOR_BGR2RGB)
-                        self.gui.webcam_queue.append(combined_frame)
-                except cv2.error:
-                    pass
-
-                # check for detections
-                if self.bool_1:
-                    self.add_audio("drowsiness_detect")
-                if self.bool_2:
-                    self.add_audio("head_pose_detect")  
-                if self.driver_not_visible:
-                    self.add_audio("driver_not_visible")               
-
-                if self.audio_list:
-                    # define audio and speak
-                    audio = " and ".join(self.audio_list)
-                    voice_thread = threading.Thread(target=self.speak, args=(audio,), daemon=True)
-                    voice_thread.start()
-                    
-                    
-                frame_end_time = time.time()
-                fps = 1.0 / (frame_end_time - frame_start_time)
-                print(fps)
-                
-
-    def speak(self, audio):  
-        self.voice_engine.speak(audio)
-        self.audio_list.clear()
-        return None
-    
-    def add_audio(self, detection_type: str):
-        with self.audio_lock:
-            self.audio_list.append(get_audio(detection_type))
+            try:
+                frame_start = time.perf_counter_ns()
 
-    def callibrate(self):
-        self.voice_engine.speak("The callibration is starting, please look forward.")
+                # run the landmark model once and share the result with every detector,
+                # timing the detectors with the capture time of the frame. The overlay
+                # is only drawn while the tracking view shows it, and the governor allows it.
+                annotate = self.gui.tracking_view and (self.governor is None or self.governor.render_overlay())
+                if self.inference_worker is not None:
+                    result = self.inference_worker.process_frame(frame.image, frame.timestamp, self.pipeline,
+                                                                 annotate=annotate)
+                else:
+                    result = self.pipeline.process_frame(frame.image, frame.timestamp, annotate=annotate)
+                self.driver_not_visible = result.driver_not_visible
+                self.frame_buffer.release(frame)
 
-        try:
-            self.voice_engine.engine.endLoop()
-        except RuntimeError:
-            pass
-
-        self.voice_engine.speak("In 3,, 2,, 1")
-        _, c_frame = self.cap.read()
-        self.head_pose_detector.callibrate(c_frame)
-        self.voice_engine.speak("The calibration was successful, you can now start tracking.")
+            except (EOFError, BrokenPipeError, ConnectionResetError) as error:
+                # The inference worker died
+                self.frame_buffer.release(frame)
+                if not self.restart_inference_worker(error):
+                    return None
+                continue
+            except (AttributeError, cv2.error):
+                return None
+
+            if annotate:
+                self.gui.display_buffer.publish(self.pipeline.overlay, frame.timestamp)
+
+            # check for detections, the scheduler drops repeats of alerts it is already handling
+            for alert in result.alerts:
+                self.alert_scheduler.raise_alert(alert)
+            if self.telemetry is not None:
+                self.telemetry.record(result)
+
+            end = self.profiler.record("frame", frame_start)
+            if self.governor is not None:
+                self.governor.observe((end - frame_start) / 1e9)
+            if "first_frame" not in self.startup_times:
+                self.mark_startup("first_frame")
+
+    def restart_inference_worker(self, error):
+        """Replace a crashed inference worker, telling the driver when tracking cannot go on"""
+        self.worker_restarts += 1
+        if self.worker_restarts <= DriverAidSystem.MAX_WORKER_RESTARTS and not self.run_state.is_shutdown:
+            start = time.perf_counter_ns()
+            try:
+                self.inference_worker.restart()
+                self.profiler.record("worker_restart", start)
+                return True
+            except (RuntimeError, OSError) as restart_error:
+                error = restart_error
+        if self.run_state.is_shutdown:
+            return False
+        self.report_error(f"Tracking stopped, the inference worker failed: {error!r}")
+        self.alert_scheduler.announce(responses.prompts["tracking_failed"])
+        return False
+
+    def callibrate(self):
+        self.ready.wait()
+        if self.run_state.is_shutdown:
+            return None
+        self.alert_scheduler.announce(responses.prompts["callibration_start"])
+        self.alert_scheduler.announce(responses.prompts["callibration_countdown"]).done.wait()
+        frame = self.frame_buffer.get_latest(self.frame_buffer.sequence)
+        if frame is None:
+            return None
+        if self.inference_worker is not None:
+            _, measurement = self.inference_worker.analyze(frame.image, frame.timestamp, self.pipeline)
+            # Without a face the previous forward direction is kept
+            if measurement.pitch is not None and measurement.yaw is not None:
+                self.head_pose_detector.forward_x, self.head_pose_detector.forward_y = measurement.pitch, measurement.yaw
+        else:
+            self.pipeline.callibrate(frame.image, frame.timestamp)
+        self.frame_buffer.release(frame)
+        self.alert_scheduler.announce(responses.prompts["callibration_done"])
     
 
     def terminate_threads(self):
-        self.cap.release()
-        cv2.destroyAllWindows()
-        sys.exit()
\ No newline at end of file
+        """Stop every thread and wait for them, the GUI main loop returns afterwards.
+
+        The GUI only calls this once the initialization finished, see GUI.close_program().
+        """
+        self.run_state.shutdown()
+        if self.init_thread is not None:
+            self.init_thread.join(timeout=1.0)
+        # wakes a callibration waiting for the initialization
+        self.ready.set()
+        if self.alert_scheduler is not None:
+            self.alert_scheduler.stop(timeout=1.0)
+        if self.capture_thread is not None:
+            self.capture_thread.stop()
+            self.capture_thread.thread.join(timeout=1.0)
+        # wakes the tracking thread if it is waiting for a frame
+        self.frame_buffer.close()
+        tracking_stopped = True
+        if self.tracking_thread is not None:
+            self.tracking_thread.join(timeout=2.0)
+            tracking_stopped = not self.tracking_thread.is_alive()
+        if self.telemetry is not None:
+            self.telemetry.stop()
+        if self.cap is not None:
+            self.cap.release()
+        # A tracking thread still in the model keeps it, the process exit frees it
+        if self.governor is not None and tracking_stopped:
+            self.governor.close()
+        if self.frame_analyzer is not None and tracking_stopped:
+            self.frame_analyzer.close()
+        if self.inference_worker is not None:
+            self.inference_worker.close()
+        cv2.destroyAllWindows()
\ No newline at end of file
@@ -0,0 +1,972 @@
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+from ..alerts import alerts
+from ..capture import capture
+from ..drowsiness_detection import drowsiness_detection
+from ..fatigue import fatigue
+from ..head_pose_estimation import head_pose_estimation
+from ..frame_analysis import frame_analysis
+from ..inference import inference
+from ..landmark_provider import landmark_provider
+from ..pipeline import pipeline
+from ..profiler import profiler
+from ..qos import qos
+from ..replay import parallel, replay
+from ..service import service
+from ..sweep import sweep
+from ..telemetry import telemetry
+from ..voice_engine import voice_engine
+
+
+NUM_LANDMARKS = 478
+LEFT_EYE = [362, 385, 387, 263, 373, 380]
+RIGHT_EYE = [33, 160, 158, 133, 153, 144]
+TARGET_LANDMARKS = [33, 263, 1, 61, 291, 199]
+
+
+def synthetic_landmarks(seed=0):
+    """Random landmarks inside the image, shaped like a FaceMesh result"""
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0.3, 0.7, (NUM_LANDMARKS, 3)).astype(np.float32)
+
+def to_landmark_list(landmarks):
+    landmark_list = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z in landmarks.tolist():
+        landmark_list.landmark.add(x=x, y=y, z=z)
+    return landmark_list
+
+def time_per_call(func, iterations):
+    func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+def report(name, seconds):
+    print(f"{name:<40} {seconds * 1e6:10.2f} us")
+
+
+# Reference implementation of the per-landmark Python loops used before
+# the (N, 3) array representation, kept to measure against.
+def legacy_postprocess(landmarks, img_w, img_h):
+    def distance(point_1, point_2):
+        return sum([(i - j) ** 2 for i, j in zip(point_1, point_2)]) ** 0.5
+
+    def get_ear(refer_idxs):
+        coords = [(min(int(landmarks[i].x * img_w), img_w - 1), min(int(landmarks[i].y * img_h), img_h - 1)) for i in refer_idxs]
+        return (distance(coords[1], coords[5]) + distance(coords[2], coords[4])) / (2.0 * distance(coords[0], coords[3]))
+
+    ear = (get_ear(LEFT_EYE) + get_ear(RIGHT_EYE)) / 2.0
+
+    face_2d = []
+    face_3d = []
+    for idx, lm in enumerate(landmarks):
+        if idx in TARGET_LANDMARKS:
+            x, y = int(lm.x * img_w), int(lm.y * img_h)
+            face_2d.append([x, y])
+            face_3d.append([x, y, lm.z])
+    face_2d = np.array(face_2d, dtype=np.float64)
+    face_3d = np.array(face_3d, dtype=np.float64)
+
+    box = (int(min(lm.x for lm in landmarks) * img_w), int(min(lm.y for lm in landmarks) * img_h),
+           int(max(lm.x for lm in landmarks) * img_w), int(max(lm.y for lm in landmarks) * img_h))
+    return ear, face_2d, face_3d, box
+
+def get_face_points(landmarks, target_idxs, img_w, img_h):
+    """The 2D/3D point sets solvePnP was given before the sub-pixel image points, from an (N, 3) landmark array"""
+    points = landmarks[target_idxs].astype(np.float64)
+    face_2d = np.trunc(points[:, :2] * (img_w, img_h))
+    face_3d = np.column_stack((face_2d, points[:, 2]))
+    return face_2d, face_3d
+
+def vectorized_postprocess(landmark_list, img_w, img_h, eye_idxs, target_idxs):
+    landmarks = landmark_provider.landmarks_to_array(landmark_list)
+    ear, _ = drowsiness_detection.calculate_avg_ear(landmarks, eye_idxs, img_w, img_h)
+    face_2d, face_3d = get_face_points(landmarks, target_idxs, img_w, img_h)
+    box = head_pose_estimation.get_face_box(landmarks, img_w, img_h)
+    nose_2d = head_pose_estimation.get_nose_2d(landmarks, img_w, img_h)
+    return ear, face_2d, face_3d, box, nose_2d
+
+
+def bench_postprocess(iterations=2000):
+    """Per-frame landmark post-processing: Python loops vs (N, 3) array geometry"""
+    img_w, img_h = 1280, 720
+    array = synthetic_landmarks()
+    landmark_list = to_landmark_list(array)
+    eye_idxs = np.array([LEFT_EYE, RIGHT_EYE])
+    target_idxs = np.sort(TARGET_LANDMARKS)
+
+    legacy = legacy_postprocess(landmark_list.landmark, img_w, img_h)
+    vectorized = vectorized_postprocess(landmark_list, img_w, img_h, eye_idxs, target_idxs)
+    assert abs(legacy[0] - vectorized[0]) < 1e-9
+    assert np.array_equal(legacy[1], vectorized[1]) and np.allclose(legacy[2], vectorized[2])
+    assert legacy[3] == vectorized[3]
+
+    report("legacy loops", time_per_call(lambda: legacy_postprocess(landmark_list.landmark, img_w, img_h), iterations))
+    report("array conversion + vectorized geometry", time_per_call(
+        lambda: vectorized_postprocess(landmark_list, img_w, img_h, eye_idxs, target_idxs), iterations))
+    report("vectorized geometry only", time_per_call(lambda: (
+        drowsiness_detection.calculate_avg_ear(array, eye_idxs, img_w, img_h),
+        get_face_points(array, target_idxs, img_w, img_h),
+        head_pose_estimation.get_face_box(array, img_w, img_h),
+        head_pose_estimation.get_nose_2d(array, img_w, img_h)), iterations))
+
+
+# Reference implementation of the overlay before the single-pass renderer: an annotated copy
+# per detector, alpha blended and converted to RGB for display.
+def legacy_overlay(image, drowsiness_detector, head_pose_detector, alpha=0.5):
+    frame1 = image.copy()
+    drowsiness_detector.draw(frame1)
+    frame2 = image.copy()
+    head_pose_detector.draw(frame2)
+    combined_frame = cv2.addWeighted(frame1, 1 - alpha, frame2, alpha, 0)
+    return cv2.cvtColor(combined_frame, cv2.COLOR_BGR2RGB)
+
+def bench_overlay(iterations=500):
+    """Per-frame cost of the tracking view overlay: blended copies vs one pass, and of skipping it"""
+    for img_w, img_h in ((1280, 720), (1920, 1080)):
+        image = np.random.default_rng(0).integers(0, 256, (img_h, img_w, 3), dtype=np.uint8)
+        analysis = frame_analysis.FrameAnalysis(image, synthetic_landmarks(), 0.0)
+        detection_pipeline = pipeline.DetectionPipeline(None)
+        result = detection_pipeline.update(detection_pipeline.measure(analysis))
+        assert result.direction is not None
+
+        report(f"{img_h}p legacy blend + cvtColor", time_per_call(lambda: legacy_overlay(
+            image, detection_pipeline.drowsiness_detector, detection_pipeline.head_pose_detector), iterations))
+        report(f"{img_h}p single pass", time_per_call(
+            lambda: detection_pipeline.render_overlay(analysis, result), iterations))
+        report(f"{img_h}p detectors + overlay", time_per_call(
+            lambda: detection_pipeline.process(analysis, annotate=True), iterations))
+        report(f"{img_h}p detectors, view hidden", time_per_call(
+            lambda: detection_pipeline.process(analysis, annotate=False), iterations))
+
+
+def bench_display(iterations=200, label_size=(500, 500)):
+    """Per-frame cost of showing a 720p frame: a new full-size PhotoImage vs scaled into a reused one"""
+    import tkinter as tk
+    from PIL import Image, ImageTk
+    from ..GUI import GUI
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as error:
+        print(f"skipped, needs a display ({error})")
+        return
+
+    try:
+        frame = np.random.default_rng(0).integers(0, 256, (720, 1280, 3), dtype=np.uint8)
+        display_size = GUI.get_display_size(1280, 720, *label_size)
+        photo_image = ImageTk.PhotoImage(Image.fromarray(cv2.resize(frame, display_size)))
+
+        def legacy():
+            image = cv2.cvtColor(cv2.flip(frame, 1), cv2.COLOR_BGR2RGB)
+            return ImageTk.PhotoImage(image=Image.fromarray(image))
+
+        def reused():
+            image = cv2.resize(frame, display_size, interpolation=cv2.INTER_LINEAR)
+            image = cv2.cvtColor(cv2.flip(image, 1), cv2.COLOR_BGR2RGB)
+            photo_image.paste(Image.fromarray(image))
+
+        report("new full-size PhotoImage", time_per_call(legacy, iterations))
+        report(f"scaled to {display_size[0]}x{display_size[1]}, reused PhotoImage", time_per_call(reused, iterations))
+    finally:
+        root.destroy()
+
+
+def get_import_time(module):
+    """Seconds to import a module in a fresh interpreter"""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    return float(output.stdout.split()[-1])
+
+def run_app(video, timeout=60.0):
+    """Startup milestones of the app with a recording standing in for the camera, tracking from the start"""
+    from .. import app
+
+    driver_aid_system = app.DriverAidSystem(camera=video)
+    driver_aid_system.run_state.start()
+    deadline = time.perf_counter() + timeout
+
+    def check():
+        if "first_frame" in driver_aid_system.startup_times or time.perf_counter() > deadline:
+            driver_aid_system.gui.on_close_program()
+        else:
+            driver_aid_system.gui.root.after(10, check)
+
+    driver_aid_system.gui.root.after(10, check)
+    driver_aid_system.start()
+    return driver_aid_system.startup_times
+
+def bench_startup(video=None):
+    """Import time, model load and first-frame cost, and with a display time-to-window and to first tracked frame"""
+    for module in ("roadsense_ai.app", "mediapipe"):
+        print(f"import {module:<28} {get_import_time(module) * 1e3:8.0f} ms")
+
+    if video is None:
+        frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+    else:
+        frame = next(replay.iter_frames(video))[1]
+    for warm_up in (False, True):
+        start = time.perf_counter()
+        face_mesh = frame_analysis.get_face_mesh()
+        frame_analyzer = frame_analysis.FrameAnalyzer(face_mesh)
+        if warm_up:
+            frame_analyzer.warm_up()
+        loaded = time.perf_counter()
+        frame_analyzer.analyze(frame)
+        first = time.perf_counter()
+        face_mesh.close()
+        print(f"model load{' + warm-up' if warm_up else '':<10} {(loaded - start) * 1e3:8.0f} ms  "
+              f"first frame {(first - loaded) * 1e3:6.1f} ms")
+
+    if video is None:
+        print("app startup skipped, needs --video")
+        return
+    try:
+        startup_times = run_app(video)
+    except Exception as error:
+        print(f"app startup skipped, needs a display and the voice engine ({error!r})")
+        return
+    print("app startup " + ", ".join(f"{name} {seconds * 1e3:.0f} ms" for name, seconds in startup_times.items()))
+
+
+def bench_sharding(video=None, segment_seconds=10.0):
+    """Offline analysis throughput of a recording against the number of worker processes"""
+    if video is None:
+        print("skipped, needs --video")
+        return
+
+    counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    base_fps = None
+    for workers in counts:
+        start = time.perf_counter()
+        frames = sum(1 for _ in parallel.measure_frames_parallel(video, workers, segment_seconds))
+        fps = frames / (time.perf_counter() - start)
+        base_fps = base_fps or fps
+        print(f"{workers:>3} workers {fps:10.1f} frames/s {fps / base_fps:6.2f}x")
+
+
+# p95 deviation from full-frame inference accepted for the face ROI modes
+ROI_TOLERANCE = {"ear": 0.03, "pitch": 1.0, "yaw": 1.0}
+
+def bench_roi(video=None, max_input_size=480):
+    """Landmark inference time and measurement drift of face-ROI / downscaled inference vs the full frame"""
+    if video is None:
+        print("skipped, needs --video")
+        return
+
+    modes = {
+        "full frame": {},
+        "face roi": {"roi": True},
+        f"face roi, max {max_input_size}px": {"roi": True, "max_input_size": max_input_size},
+    }
+    baseline = None
+    for name, options in modes.items():
+        stage_profiler = profiler.StageProfiler(capacity=1 << 16)
+        measurements = [measurement.to_tuple() for measurement in
+                        replay.measure_frames(video, stage_profiler=stage_profiler, **options)]
+        inference = stage_profiler.stats("inference")
+        # ear, pitch, yaw; nan where no face was measured
+        values = np.array([measurement[1:] for measurement in measurements], dtype=np.float64)
+        if baseline is None:
+            baseline = values
+            print(f"{name:<28} {inference['mean_ms']:7.2f} ms/frame")
+            continue
+
+        both = ~np.isnan(baseline).any(axis=1) & ~np.isnan(values).any(axis=1)
+        missed = int((~np.isnan(baseline).any(axis=1) & np.isnan(values).any(axis=1)).sum())
+        deviation = np.abs(values[both] - baseline[both])
+        p95 = np.percentile(deviation, 95, axis=0) if len(deviation) else np.full(3, np.nan)
+        within = all(p95[i] <= ROI_TOLERANCE[key] for i, key in enumerate(("ear", "pitch", "yaw")))
+        print(f"{name:<28} {inference['mean_ms']:7.2f} ms/frame  p95 deviation ear {p95[0]:.3f} "
+              f"pitch {p95[1]:.2f} yaw {p95[2]:.2f}  missed {missed}  {'ok' if within else 'OUT OF TOLERANCE'}")
+
+
+def get_alert_events(timeline):
+    with open(timeline) as lines:
+        return [(record["frame"], event["type"], event["state"])
+                for record in map(json.loads, lines) for event in record["events"]]
+
+def bench_keyframes(video=None, keyframe_interval=5):
+    """Landmark cost per frame and alert timing of keyframe inference with optical-flow tracking vs every frame"""
+    if video is None:
+        print("skipped, needs --video")
+        return
+
+    events = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for interval in (None, keyframe_interval):
+            stage_profiler = profiler.StageProfiler(capacity=1 << 16)
+            timeline = os.path.join(directory, f"{interval}.jsonl")
+            measurements = replay.measure_frames(video, stage_profiler=stage_profiler, keyframe_interval=interval,
+                                                 callibrate=True)
+            summary = replay.write_timeline(measurements, timeline, callibrate=True)
+
+            # Every stage that finds the landmarks of a frame, summed over the recording
+            cost = sum(stage_profiler.stats(stage)["mean_ms"] * stage_profiler.stats(stage)["count"]
+                       for stage in ("inference", "tracking") if stage in stage_profiler.stages)
+            inference_count = stage_profiler.stats("inference")["count"]
+            events[interval] = get_alert_events(timeline)
+            name = f"keyframe every {interval} frames" if interval else "model on every frame"
+            print(f"{name:<28} {cost / summary['frames']:7.2f} ms/frame  "
+                  f"model on {inference_count / summary['frames']:6.1%} of frames")
+
+    baseline, tracked = events[None], events[keyframe_interval]
+    print(f"alert events: {len(baseline)} vs {len(tracked)}, "
+          f"{'same frames' if baseline == tracked else 'DIFFERENT: ' + str(sorted(set(baseline) ^ set(tracked)))}")
+
+
+def bench_alerts(frames=3000, speech_seconds=0.5):
+    """Cost of raising alerts on every frame of a sustained alert while a phrase is being spoken"""
+    backend = voice_engine.RecordingVoiceEngine(duration=speech_seconds)
+    scheduler = alerts.AlertScheduler(backend)
+    scheduler.start()
+    try:
+        scheduler.raise_alert("head_pose_detect")
+        durations = []
+        for _ in range(frames):
+            start = time.perf_counter_ns()
+            scheduler.raise_alert("head_pose_detect")
+            scheduler.raise_alert("driver_not_visible")
+            durations.append(time.perf_counter_ns() - start)
+    finally:
+        scheduler.stop()
+
+    p50, p99 = np.percentile(durations, (50, 99)) / 1e3
+    print(f"raise_alert x2 per frame  p50 {p50:.1f} us  p99 {p99:.1f} us")
+    print(f"{len(backend.spoken)} phrases spoken for {frames} frames, {scheduler.counts}")
+
+
+def bench_voice(iterations=5):
+    """Alert-to-sound latency of live speech synthesis vs pre-rendered clips played from memory"""
+    try:
+        live_engine = voice_engine.VoiceEngine()
+        clip_engine = voice_engine.ClipVoiceEngine(live_engine)
+    except ImportError as error:
+        print(f"skipped, needs pyttsx3 and winsound ({error})")
+        return
+
+    phrases = alerts.get_phrases()
+    clip_engine.preload(phrases)
+    for name, backend in (("live synthesis", live_engine), ("pre-rendered clips", clip_engine)):
+        stage_profiler = profiler.StageProfiler()
+        scheduler = alerts.AlertScheduler(backend, stage_profiler=stage_profiler)
+        scheduler.start()
+        try:
+            for phrase in phrases[:iterations]:
+                scheduler.announce(phrase).done.wait()
+        finally:
+            scheduler.stop()
+        latency = stage_profiler.stats("alert_latency")
+        print(f"{name:<20} p50 {latency['p50_ms']:8.1f} ms  p95 {latency['p95_ms']:8.1f} ms")
+
+
+def bench_cache(video=None):
+    """Time to re-analyse a recording from the landmark cache against the first run that fills it"""
+    if video is None:
+        print("skipped, needs --video")
+        return
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for dtype in ("float32", "float16"):
+            timelines, ear = [], []
+            for run in ("first run", "cached"):
+                output = os.path.join(cache_dir, f"{dtype}-{len(timelines)}.jsonl")
+                measurements = replay.measure_frames_cached(video, cache_dir=cache_dir, dtype=dtype)
+                summary = replay.write_timeline(measurements, output)
+                with open(output) as timeline:
+                    ear.append([json.loads(line)["ear"] for line in timeline])
+                timelines.append(output)
+                print(f"{dtype} {run:<10} {summary['seconds']:7.2f} s  {summary['fps']:9.1f} frames/s")
+
+            ear = np.array(ear, dtype=np.float64)
+            deviation = np.nanmax(np.abs(ear[0] - ear[1])) if len(ear[0]) else 0.0
+            same = get_alert_events(timelines[0]) == get_alert_events(timelines[1])
+            print(f"{dtype} max ear deviation {deviation:.4f}  alert events {'identical' if same else 'DIFFER'}")
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(cache_dir)
+                   for name in names if name.endswith(".bin"))
+        print(f"cache entries {size / 2 ** 20:.1f} MiB")
+
+
+# Reference implementation of the head pose before cached intrinsics and the canonical face
+# model: the 2D points with the landmark z as the 3D model, solved from scratch every frame
+def legacy_head_pose(landmarks, target_idxs, img_w, img_h):
+    face_2d, face_3d = get_face_points(landmarks, target_idxs, img_w, img_h)
+    cam_matrix = np.array([[img_w, 0, img_h / 2], [0, img_w, img_w / 2], [0, 0, 1]])
+    dist_matrix = np.zeros((4, 1), dtype=np.float64)
+    _, rot_vec, _ = cv2.solvePnP(face_3d, face_2d, cam_matrix, dist_matrix)
+    rmat, _ = cv2.Rodrigues(rot_vec)
+    angles = cv2.RQDecomp3x3(rmat)[0]
+    return angles[0] * 360, angles[1] * 360
+
+def synthetic_head_poses(frames=600, img_w=1280, img_h=720, noise_px=0.4, seed=0):
+    """Landmark arrays of a face slowly turning in front of the camera, and the true (pitch, yaw)"""
+    rng = np.random.default_rng(seed)
+    head_pose_detector = head_pose_estimation.HeadPoseEstimator()
+    cam_matrix = head_pose_estimation.get_camera_matrix(img_h, img_w)
+    t = np.arange(frames) / 30.0
+    truth = np.column_stack((8 * np.sin(t * 0.7), 25 * np.sin(t * 0.4)))
+    landmarks = np.tile(synthetic_landmarks(), (frames, 1, 1))
+    for frame, (pitch, yaw) in enumerate(truth):
+        # to_head_angles flips the signs of the model rotation
+        rot_vec, _ = cv2.Rodrigues(rotation_matrix(-pitch, -yaw))
+        points, _ = cv2.projectPoints(head_pose_detector.model_points, rot_vec, np.array([0.0, 0.0, 600.0]),
+                                      cam_matrix, None)
+        points = points[:, 0] + rng.normal(0, noise_px, (len(points), 2))
+        landmarks[frame, head_pose_detector.target_idxs, :2] = points / (img_w, img_h)
+        landmarks[frame, head_pose_detector.target_idxs, 2] = head_pose_detector.model_points[:, 2] / img_w
+    return landmarks, truth
+
+def rotation_matrix(x, y):
+    """Rotation by x degrees about the x axis, then y degrees about the y axis, as RQDecomp3x3 decomposes"""
+    x, y = np.radians(x), np.radians(y)
+    rot_x = np.array([[1, 0, 0], [0, np.cos(x), -np.sin(x)], [0, np.sin(x), np.cos(x)]])
+    rot_y = np.array([[np.cos(y), 0, np.sin(y)], [0, 1, 0], [-np.sin(y), 0, np.cos(y)]])
+    return rot_y @ rot_x
+
+def iterative_solvers(model_points):
+    """Iterative solvePnP on the face model, solved from scratch and warm-started from the previous frame"""
+    pose = []
+
+    def cold(face_2d, cam_matrix, dist_coeffs):
+        return cv2.solvePnP(model_points, face_2d, cam_matrix, dist_coeffs)[1]
+
+    def warm(face_2d, cam_matrix, dist_coeffs):
+        if pose:
+            _, rot_vec, trans_vec = cv2.solvePnP(model_points, face_2d, cam_matrix, dist_coeffs, *pose,
+                                                 useExtrinsicGuess=True)
+        else:
+            _, rot_vec, trans_vec = cv2.solvePnP(model_points, face_2d, cam_matrix, dist_coeffs)
+        pose[:] = rot_vec, trans_vec
+        return rot_vec
+
+    return {"iterative": cold, "iterative warm-started": warm}
+
+def bench_head_pose(frames=600, img_w=1280, img_h=720):
+    """Per-frame head pose latency and jitter of the PnP solvers, and the offline batch path"""
+    landmarks, truth = synthetic_head_poses(frames, img_w, img_h)
+    target_idxs = np.sort(TARGET_LANDMARKS)
+
+    start = time.perf_counter()
+    for frame_landmarks in landmarks:
+        legacy_head_pose(frame_landmarks, target_idxs, img_w, img_h)
+    print(f"{'legacy (other units)':<24} {(time.perf_counter() - start) / frames * 1e6:8.1f} us/frame")
+
+    head_pose_detector = head_pose_estimation.HeadPoseEstimator()
+    solvers = {**iterative_solvers(head_pose_detector.model_points),
+               "sqpnp": lambda *args: head_pose_estimation.solve_pnp(head_pose_detector.model_points, *args)}
+    for name, solver in solvers.items():
+        durations, angles = [], []
+        for frame_landmarks in landmarks:
+            begin = time.perf_counter_ns()
+            face_2d = head_pose_estimation.get_image_points(frame_landmarks, head_pose_detector.target_idxs, img_w, img_h)
+            cam_matrix, dist_coeffs = head_pose_detector.get_intrinsics(img_w, img_h)
+            rmat, _ = cv2.Rodrigues(solver(face_2d, cam_matrix, dist_coeffs))
+            angles.append(head_pose_estimation.to_head_angles(*cv2.RQDecomp3x3(rmat)[0][:2]))
+            durations.append(time.perf_counter_ns() - begin)
+        error = np.array(angles) - truth
+        # Jitter: frame to frame changes of the error, the true motion cancels out
+        jitter = np.diff(error, axis=0).std(axis=0)
+        p50, p99 = np.percentile(durations, (50, 99)) / 1e3
+        print(f"{name:<24} {p50:8.1f} us p50 {p99:8.1f} us p99  jitter pitch {jitter[0]:.3f} yaw {jitter[1]:.3f} deg  "
+              f"max error {np.abs(error).max():.2f} deg")
+
+    start = time.perf_counter()
+    for frame, frame_landmarks in enumerate(landmarks):
+        head_pose_detector.measure(frame_analysis.FrameAnalysis(None, frame_landmarks, frame / 30.0,
+                                                                image_size=(img_w, img_h)))
+    print(f"{'measure()':<24} {(time.perf_counter() - start) / frames * 1e6:8.1f} us/frame")
+
+    sizes = np.tile((img_w, img_h), (frames, 1))
+    start = time.perf_counter()
+    pitch, yaw = head_pose_detector.measure_batch(landmarks, np.ones(frames, dtype=bool), sizes)
+    print(f"{'batch':<24} {(time.perf_counter() - start) / frames * 1e6:8.1f} us/frame  "
+          f"max error {np.abs(np.column_stack((pitch, yaw)) - truth).max():.2f} deg")
+
+
+def feed_frames(frames, frame_buffer, stop, fps=30.0):
+    """Publish frames in a loop at a camera's frame rate, like CaptureThread"""
+    next_time = time.perf_counter()
+    index = 0
+    while not stop.is_set():
+        frame_buffer.publish(frames[index % len(frames)], time.perf_counter())
+        index += 1
+        next_time += 1.0 / fps
+        time.sleep(max(0.0, next_time - time.perf_counter()))
+    frame_buffer.close()
+
+def track_frames(frame_buffer, process_frame, latencies):
+    """The live tracking loop: always the newest frame, until the buffer is closed"""
+    last_sequence = 0
+    while True:
+        frame = frame_buffer.get_latest(last_sequence, timeout=0.5)
+        if frame is None:
+            if frame_buffer.closed:
+                return
+            continue
+        last_sequence = frame.sequence
+        process_frame(frame)
+        latencies.append(time.perf_counter() - frame.timestamp)
+
+def simulate_ui(seconds, tick=1 / 60, work=2000):
+    """Tk main loop stand-in: a timer tick with some Python work, returns how late each tick ran in ms"""
+    lateness = []
+    end = time.perf_counter() + seconds
+    next_tick = time.perf_counter() + tick
+    while next_tick < end:
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+        lateness.append((time.perf_counter() - next_tick) * 1e3)
+        sum(i * i for i in range(work))
+        next_tick += tick
+    return np.array(lateness)
+
+def bench_inference(video=None, seconds=10.0):
+    """Live mode with the landmark model in the tracking thread vs in a shared memory worker process"""
+    import threading
+
+    if video is None:
+        print("skipped, needs --video")
+        return
+    frames = [frame for _, frame in replay.iter_frames(video, stop=300)]
+
+    for name in ("tracking thread", "worker process"):
+        detection_pipeline = pipeline.DetectionPipeline(None)
+        worker = None
+        face_mesh = None
+        if name == "worker process":
+            worker = inference.InferenceWorker()
+            worker.start(frames[0].shape[1], frames[0].shape[0])
+            process_frame = lambda frame: worker.process_frame(frame.image, frame.timestamp, detection_pipeline)
+        else:
+            face_mesh = frame_analysis.get_face_mesh()
+            detection_pipeline.frame_analyzer = frame_analysis.FrameAnalyzer(face_mesh)
+            detection_pipeline.frame_analyzer.warm_up(frames[0].shape[1], frames[0].shape[0])
+            process_frame = lambda frame: detection_pipeline.process_frame(frame.image, frame.timestamp)
+
+        frame_buffer = capture.LatestFrameBuffer()
+        stop = threading.Event()
+        latencies = []
+        threads = [threading.Thread(target=feed_frames, args=(frames, frame_buffer, stop)),
+                   threading.Thread(target=track_frames, args=(frame_buffer, process_frame, latencies))]
+        for thread in threads:
+            thread.start()
+        try:
+            lateness = simulate_ui(seconds)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            if worker is not None:
+                worker.close()
+            if face_mesh is not None:
+                face_mesh.close()
+
+        latency = np.percentile(latencies, (50, 95)) * 1e3
+        ui = np.percentile(lateness, (50, 95, 99))
+        print(f"{name:<16} {len(latencies) / seconds:6.1f} fps  latency p50 {latency[0]:6.1f} p95 {latency[1]:6.1f} ms  "
+              f"UI tick late p50 {ui[0]:5.2f} p95 {ui[1]:5.2f} p99 {ui[2]:5.2f} ms  dropped {frame_buffer.dropped}")
+
+
+def synthetic_ear(frames, fps=30.0, blink_every=4.0, blink_seconds=0.15, seed=0):
+    """EAR of a driver who blinks regularly, with noise and some frames without a face"""
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(frames) / fps
+    ear = 0.3 + rng.normal(0, 0.01, frames)
+    ear[timestamps % blink_every < blink_seconds] = 0.15
+    missing = rng.random(frames) < 0.01
+    return timestamps, [None if gone else float(value) for gone, value in zip(missing, ear)]
+
+
+def rescan_perclos(timestamps, ear, window, closed_thresh, max_gap):
+    """PERCLOS of the last window seconds, recomputed from the whole history"""
+    last = None
+    observed = closed = 0.0
+    for timestamp, value in zip(timestamps, ear):
+        gap = 0.0 if last is None else timestamp - last
+        last = timestamp
+        if value is None or timestamp < timestamps[-1] - window or not 0.0 < gap <= max_gap:
+            continue
+        observed += gap
+        closed += gap * (value < closed_thresh)
+    return closed / observed
+
+
+def bench_fatigue(hours=1.0, fps=30.0):
+    """Per-frame cost and memory of the PERCLOS and blink statistics over a long drive"""
+    frames = int(hours * 3600 * fps)
+    timestamps, ear = synthetic_ear(frames, fps)
+    monitor = fatigue.FatigueMonitor()
+    ring_bytes = sum(values.nbytes for ring in (monitor.frames, monitor.blinks) for values in ring.fields.values())
+
+    durations = np.empty(frames)
+    for i, (timestamp, value) in enumerate(zip(timestamps, ear)):
+        start = time.perf_counter_ns()
+        monitor.update(timestamp, value, 0.0, 0.0, 0.24)
+        durations[i] = time.perf_counter_ns() - start
+
+    minute = int(60 * fps)
+    first, last = np.median(durations[:minute]) / 1e3, np.median(durations[-minute:]) / 1e3
+    print(f"update p50 first minute {first:.1f} us  last minute {last:.1f} us  ({frames} frames)")
+    print(f"ring buffers {ring_bytes / 1024:.0f} KiB, {len(monitor.frames)} frames in the window")
+    stats = monitor.stats()
+    print(", ".join(f"{name} {value:.3f}" for name, value in stats.items()))
+    expected = rescan_perclos(timestamps, ear, monitor.window, 0.24, monitor.MAX_FRAME_GAP)
+    print(f"PERCLOS rescanned from history {expected:.4f}, incremental {stats['perclos']:.4f}")
+
+
+def bench_detectors(frames=3000, img_w=640, img_h=480):
+    """Detector throughput on recorded landmarks from the replay provider, with no landmark model"""
+    landmarks, _ = synthetic_head_poses(600, img_w, img_h)
+    present = np.arange(len(landmarks)) % 50 < 45
+    provider = landmark_provider.ReplayProvider(landmarks, present, loop=True)
+    stage_profiler = profiler.StageProfiler(capacity=frames)
+    frame_analyzer = frame_analysis.FrameAnalyzer(provider, stage_profiler)
+    detection_pipeline = pipeline.DetectionPipeline(frame_analyzer, stage_profiler)
+    frame = np.zeros((img_h, img_w, 3), dtype=np.uint8)
+
+    for annotate in (False, True):
+        provider.index = 0
+        stage_profiler.reset()
+        start = time.perf_counter()
+        for index in range(frames):
+            detection_pipeline.process_frame(frame, index / 30.0, annotate=annotate)
+        elapsed = time.perf_counter() - start
+        print(f"process_frame(annotate={annotate}): {frames / elapsed:.0f} fps, {elapsed / frames * 1e6:.1f} us/frame")
+    print(stage_profiler.report())
+
+
+def run_frame_path(cap, frame_buffer, display_buffer, detection_pipeline, frames):
+    """The live loop on one thread: capture, track, publish the overlay and display it.
+
+    Returns the largest transient allocation of a frame and how much traced memory grew, in bytes.
+    """
+    peaks = []
+    tracemalloc.start()
+    begin = tracemalloc.get_traced_memory()[0]
+    for index in range(frames):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        dst = frame_buffer.acquire()
+        ok, image = cap.read(dst)
+        if not ok:
+            # A failed read returns no image, the recording starts over in the same array
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, image = cap.read(dst)
+        frame_buffer.publish(image, index / 30.0)
+        frame = frame_buffer.get_latest(frame_buffer.sequence - 1)
+        detection_pipeline.process_frame(frame.image, frame.timestamp, annotate=True)
+        frame_buffer.release(frame)
+        display_buffer.publish(detection_pipeline.overlay, frame.timestamp)
+        shown = display_buffer.get_latest(display_buffer.sequence - 1)
+        display_buffer.release(shown)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    growth = tracemalloc.get_traced_memory()[0] - begin
+    tracemalloc.stop()
+    return max(peaks), growth
+
+def bench_frame_path(video=None, frames=200, warm_up=20):
+    """Per-frame allocations of capture, flip and overlay with and without recycled frame buffers"""
+    if video is None:
+        print("skipped, needs --video")
+        return
+
+    for pooled in (False, True):
+        cap = cv2.VideoCapture(video)
+        img_w, img_h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        landmarks, _ = synthetic_head_poses(600, img_w, img_h)
+        provider = landmark_provider.ReplayProvider(landmarks, loop=True)
+        detection_pipeline = pipeline.DetectionPipeline(frame_analysis.FrameAnalyzer(provider))
+        frame_buffer = capture.LatestFrameBuffer(pool_consumers=1 if pooled else 0)
+        display_buffer = capture.LatestFrameBuffer(pool_consumers=1 if pooled else 0)
+        detection_pipeline.overlay_pool = display_buffer.pool
+
+        run_frame_path(cap, frame_buffer, display_buffer, detection_pipeline, warm_up)
+        start = time.perf_counter()
+        peak, growth = run_frame_path(cap, frame_buffer, display_buffer, detection_pipeline, frames)
+        elapsed = time.perf_counter() - start
+        cap.release()
+        misses = "" if not pooled else (f", pool misses {frame_buffer.pool.misses} capture "
+                                        f"{display_buffer.pool.misses} overlay")
+        print(f"{'pooled' if pooled else 'allocating':<11} {img_w}x{img_h}: largest per-frame allocation "
+              f"{peak / 1e6:6.2f} MB, traced memory grew {growth / 1e3:7.1f} kB over {frames} frames, "
+              f"{elapsed / frames * 1e3:5.1f} ms/frame{misses}")
+
+    # Flat: no frame-sized allocation on any frame once the pools are filled, and no growth
+    frame_size = img_w * img_h * 3
+    print(f"pooled frame path {'flat' if peak < frame_size / 8 and growth < frame_size / 8 else 'NOT FLAT'}")
+
+
+def run_governed(video, budget=None, rounds=3):
+    """Per-frame latencies in seconds, alert events and governor of the pipeline over a recording"""
+    face_mesh = frame_analysis.get_face_mesh()
+    detection_pipeline = pipeline.DetectionPipeline(frame_analysis.FrameAnalyzer(face_mesh))
+    governor = None if budget is None else qos.QosGovernor(detection_pipeline, budget, cpu_load=lambda: None)
+    latencies, levels, events, previous_alerts = [], [], [], []
+    frames = list(replay.iter_video_frames(video))
+    try:
+        # The recording is played several times, so the governor settles
+        for round_index in range(rounds):
+            for index, (timestamp, frame) in enumerate(frames):
+                start = time.perf_counter_ns()
+                annotate = governor is None or governor.render_overlay()
+                result = detection_pipeline.process_frame(frame, round_index * 1000.0 + timestamp, annotate=annotate)
+                latency = (time.perf_counter_ns() - start) / 1e9
+                latencies.append(latency)
+                if governor is not None:
+                    levels.append(governor.index)
+                    governor.observe(latency)
+                if round_index == rounds - 1:
+                    events += [(index, event["type"], event["state"])
+                               for event in replay.get_events(previous_alerts, result.alerts)]
+                previous_alerts = result.alerts
+    finally:
+        if governor is not None:
+            governor.close()
+        face_mesh.close()
+    return np.array(latencies), np.array(levels), events, governor
+
+def bench_qos(video=None, budget_ratio=0.8):
+    """Levels the quality governor settles on for a latency budget below the full-quality cost, and the alerts kept"""
+    if video is None:
+        print("skipped, needs --video")
+        return
+
+    latencies, _, full_events, _ = run_governed(video)
+    full_p90 = np.percentile(latencies, 90)
+    print(f"full quality: p90 {full_p90 * 1e3:.1f} ms, {len(full_events)} alert events")
+
+    budget = full_p90 * budget_ratio
+    latencies, levels, events, governor = run_governed(video, budget)
+    print(f"budget {budget * 1e3:.1f} ms:")
+    for index, level in enumerate(governor.levels):
+        at_level = latencies[levels == index]
+        if len(at_level):
+            print(f"  {level.name:<14} {len(at_level):5d} frames, p90 {np.percentile(at_level, 90) * 1e3:5.1f} ms")
+    tail = latencies[-len(latencies) // 3:]
+    print(f"last round p90 {np.percentile(tail, 90) * 1e3:.1f} ms; {governor.report()}")
+    print(f"alert events {len(events)}, {len(set(events) ^ set(full_events))} differ from full quality: "
+          f"{sorted(set(events) ^ set(full_events))}")
+
+
+def synthetic_session(minutes=30.0, seed=0):
+    """timestamp, ear, pitch, yaw arrays of a drive with jittery frame times and face losses"""
+    rng = np.random.default_rng(seed)
+    frames = int(minutes * 60 * 30)
+    index = np.arange(frames)
+    timestamps = np.cumsum(rng.uniform(0.02, 0.045, frames))
+    ear = 0.27 + 0.08 * np.sin(index / 200) + rng.normal(0, 0.02, frames)
+    pitch = 12 * np.sin(index / 300) + rng.normal(0, 2, frames)
+    yaw = 15 * np.sin(index / 450 + 1) + rng.normal(0, 2, frames)
+    missing = index // 100 % 37 == 5
+    for values in (ear, pitch, yaw):
+        values[missing] = np.nan
+    return timestamps, ear, pitch, yaw
+
+def run_pipeline(timestamps, ear, pitch, yaw, forward, settings):
+    """Per-frame drowsiness and head pose alarms of DetectionPipeline with one set of settings"""
+    detection_pipeline = pipeline.DetectionPipeline(None)
+    replay.apply_settings(detection_pipeline, settings)
+    detection_pipeline.head_pose_detector.forward_x, detection_pipeline.head_pose_detector.forward_y = forward
+    drowsy, head_pose = [], []
+    for row in zip(timestamps.tolist(), ear.tolist(), pitch.tolist(), yaw.tolist()):
+        result = detection_pipeline.update(pipeline.FrameMeasurement(*(None if np.isnan(value) else value
+                                                                       for value in row)))
+        drowsy.append(result.drowsy)
+        head_pose.append(result.head_pose)
+    return np.array(drowsy), np.array(head_pose)
+
+def bench_sweep(minutes=30.0, checks=5):
+    """Time to score the default settings grid on a long session, checked against DetectionPipeline"""
+    timestamps, ear, pitch, yaw = synthetic_session(minutes)
+    labels = [{"type": sweep.DROWSINESS, "start": float(timestamps[i]), "end": float(timestamps[i]) + 1.0}
+              for i in range(500, len(timestamps), 1500)]
+    forward = (1.0, -2.0)
+    threshold_sweep = sweep.ThresholdSweep(timestamps, ear, pitch, yaw, forward, labels)
+    grid = [sweep.get_range(0.15, 0.35, 0.01), sweep.get_range(0.3, 2.0, 0.1),
+            sweep.get_range(5, 25, 1), sweep.get_range(0.3, 2.0, 0.1)]
+
+    start = time.perf_counter()
+    columns = threshold_sweep.run(*grid)
+    elapsed = time.perf_counter() - start
+    print(f"{len(columns['f1'])} combinations over {len(timestamps)} frames in {elapsed:.2f} s")
+
+    rng = np.random.default_rng(0)
+    names = ("ear_thresh", "drowsiness_wait_time", "head_pose_offset", "head_pose_wait_time")
+    mismatches = 0
+    start = time.perf_counter()
+    for _ in range(checks):
+        settings = {name: float(rng.choice(values)) for name, values in zip(names, grid)}
+        timeline = threshold_sweep.timeline(*settings.values())
+        drowsy, head_pose = run_pipeline(timestamps, ear, pitch, yaw, forward, settings)
+        mismatches += int((drowsy != timeline[sweep.DROWSINESS]).sum() + (head_pose != timeline[sweep.HEAD_POSE]).sum())
+    per_setting = (time.perf_counter() - start) / checks
+    print(f"DetectionPipeline {per_setting:.2f} s per combination, {mismatches} mismatching frames "
+          f"over {checks} random combinations")
+
+
+def record_trip(recorder, results, fps):
+    """Feed a trip's results to a TelemetryRecorder at fps frames a second, returns the record() latencies in us"""
+    durations = np.empty(len(results))
+    recorder.start()
+    begin = time.perf_counter()
+    for index, result in enumerate(results):
+        delay = begin + index / fps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        start = time.perf_counter_ns()
+        recorder.record(result)
+        durations[index] = (time.perf_counter_ns() - start) / 1e3
+    recorder.stop()
+    return durations
+
+def bench_telemetry(minutes=5.0, fps=1000.0, naive_frames=2000):
+    """Per-frame cost of recording telemetry on the tracking thread, and of per-trip summary queries"""
+    timestamps, ear, pitch, yaw = synthetic_session(minutes)
+    detection_pipeline = pipeline.DetectionPipeline(None)
+    results = [detection_pipeline.update(pipeline.FrameMeasurement(*(None if np.isnan(value) else value
+                                                                     for value in row)))
+               for row in zip(timestamps.tolist(), ear.tolist(), pitch.tolist(), yaw.tolist())]
+
+    with tempfile.TemporaryDirectory() as directory:
+        # One INSERT and commit per frame on the tracking thread
+        connection = sqlite3.connect(os.path.join(directory, "naive.db"))
+        connection.executescript(telemetry.SCHEMA)
+        durations = np.empty(naive_frames)
+        for index, result in enumerate(results[:naive_frames]):
+            start = time.perf_counter_ns()
+            with connection:
+                connection.execute(f"INSERT INTO frames VALUES (1, {', '.join('?' * len(telemetry.FRAME_FIELDS))})",
+                                   telemetry.frame_row(result))
+            durations[index] = (time.perf_counter_ns() - start) / 1e3
+        connection.close()
+        p50, p99 = np.percentile(durations, (50, 99))
+        print(f"{'insert per frame':<18} {p50:8.1f} us p50 {p99:8.1f} us p99 {durations.max():8.1f} us max")
+
+        path = os.path.join(directory, "telemetry.db")
+        for name, writer in (("sqlite batches", telemetry.SqliteTelemetryWriter(path)),
+                             ("jsonl.gz batches", telemetry.JsonlTelemetryWriter(os.path.join(directory, "jsonl")))):
+            recorder = telemetry.TelemetryRecorder(writer)
+            durations = record_trip(recorder, results, fps)
+            p50, p99 = np.percentile(durations, (50, 99))
+            print(f"{name:<18} {p50:8.1f} us p50 {p99:8.1f} us p99 {durations.max():8.1f} us max  "
+                  f"at {fps:.0f} fps, {recorder.counts['batches']} batches, {recorder.counts['dropped']} dropped")
+
+        sizes = {name: os.path.getsize(os.path.join(directory, name)) for name in ("telemetry.db", "telemetry.db-wal")
+                 if os.path.exists(os.path.join(directory, name))}
+        jsonl_size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(directory, "jsonl")))
+        print(f"{len(results)} frames: sqlite {sum(sizes.values()) / 1024:.0f} KiB, jsonl.gz {jsonl_size / 1024:.0f} KiB")
+
+        database = telemetry.TelemetryDatabase(path)
+        start = time.perf_counter()
+        summary = database.summary(database.trips()[-1]["id"])
+        print(f"trip summary in {(time.perf_counter() - start) * 1e3:.1f} ms: {json.dumps(summary)}")
+        database.close()
+
+
+def count_bytes(subscriber, received, index):
+    """Reader thread of a subscriber that only counts the bytes it gets, its buffer starts with the HELLO message"""
+    received[index] += len(subscriber.buffer)
+    while data := subscriber.connection.recv(1 << 16):
+        received[index] += len(data)
+
+def bench_service(frames=20000, subscriber_counts=(1, 4, 16)):
+    """Publish latency of the event socket and its fan-out throughput, with a stalled client in the mix"""
+    detection_pipeline = pipeline.DetectionPipeline(None)
+    timestamps, ear, pitch, yaw = synthetic_session(frames / 1800)
+    results = [detection_pipeline.update(pipeline.FrameMeasurement(*(None if np.isnan(value) else value
+                                                                     for value in row)))
+               for row in zip(timestamps.tolist(), ear.tolist(), pitch.tolist(), yaw.tolist())]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for count in subscriber_counts:
+            publisher = service.EventPublisher(os.path.join(directory, "events.sock"))
+            publisher.start()
+            subscribers = [service.EventSubscriber(publisher.path) for _ in range(count)]
+            # Connected but never reads, it has to be dropped without slowing the others
+            stalled = service.EventSubscriber(publisher.path)
+            while publisher.subscriber_count < count + 1:
+                time.sleep(0.01)
+            received = [0] * count
+            readers = [threading.Thread(target=count_bytes, args=(subscriber, received, index))
+                       for index, subscriber in enumerate(subscribers)]
+            for reader in readers:
+                reader.start()
+
+            durations = np.empty(len(results))
+            start = time.perf_counter()
+            for index, result in enumerate(results):
+                begin = time.perf_counter_ns()
+                publisher.publish_result(result)
+                durations[index] = (time.perf_counter_ns() - begin) / 1e3
+            published = time.perf_counter() - start
+            publisher.stop()
+            for reader in readers:
+                reader.join()
+            elapsed = time.perf_counter() - start
+            stalled.close()
+            for subscriber in subscribers:
+                subscriber.close()
+
+            messages = service.MESSAGES
+            stream_size = (messages[service.HELLO].size + publisher.counts["frames"] * messages[service.FRAME].size
+                           + publisher.counts["events"] * messages[service.EVENT].size)
+            complete = sum(size == stream_size for size in received)
+            p50, p99 = np.percentile(durations, (50, 99))
+            print(f"{count:>2} subscribers: publish {p50:6.1f} us p50 {p99:7.1f} us p99, {len(results) / published:6.0f} "
+                  f"frames/s, {sum(received) / elapsed / 1e6:5.1f} MB/s delivered, {complete}/{count} got every "
+                  f"message, {publisher.counts['dropped']} dropped")
+
+
+BENCHMARKS = {
+    "postprocess": bench_postprocess,
+    "overlay": bench_overlay,
+    "display": bench_display,
+    "startup": bench_startup,
+    "sharding": bench_sharding,
+    "roi": bench_roi,
+    "keyframes": bench_keyframes,
+    "alerts": bench_alerts,
+    "voice": bench_voice,
+    "fatigue": bench_fatigue,
+    "cache": bench_cache,
+    "sweep": bench_sweep,
+    "head_pose": bench_head_pose,
+    "inference": bench_inference,
+    "detectors": bench_detectors,
+    "telemetry": bench_telemetry,
+    "service": bench_service,
+    "frame_path": bench_frame_path,
+    "qos": bench_qos,
+}
+# Benchmarks that run on a recording passed with --video
+VIDEO_BENCHMARKS = {"sharding", "roi", "keyframes", "startup", "cache", "inference", "frame_path", "qos"}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="roadsense_ai.benchmark")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default all)")
+    parser.add_argument("--video", help="recording for the benchmarks that need one")
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+
+    for name in args.names or list(BENCHMARKS):
+        print(f"== {name}: {BENCHMARKS[name].__doc__}")
+        if name in VIDEO_BENCHMARKS:
+            BENCHMARKS[name](video=args.video)
+        else:
+            BENCHMARKS[name]()
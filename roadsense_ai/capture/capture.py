@@ -0,0 +1,173 @@
+import threading
+import time
+
+
+class Frame:
+    """A published frame: its sequence number, capture time in seconds and image.
+
+    refs counts the ring slot and the consumers holding the frame, its image goes back to
+    the buffer's pool once all of them let go.
+    """
+    __slots__ = ("sequence", "timestamp", "image", "taken", "refs")
+
+    def __init__(self, sequence, timestamp, image):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.image = image
+        self.taken = False
+        self.refs = 1
+
+
+class FramePool:
+    """Spare frame arrays to write new frames into through OpenCV's dst arguments.
+
+    acquire() returns None when no array is free, the caller then lets OpenCV allocate one,
+    which joins the pool once it is released. Only arrays of the latest released shape are kept.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.free = []
+        self.shape = None
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+            self.misses += 1
+            return None
+
+    def release(self, image):
+        with self.lock:
+            if image.shape != self.shape:
+                self.shape = image.shape
+                self.free.clear()
+            if len(self.free) < self.size:
+                self.free.append(image)
+
+
+class LatestFrameBuffer:
+    """Fixed-size ring of timestamped frames where consumers always take the newest frame.
+
+    The producer never waits for consumers: when the ring is full the oldest frame is
+    overwritten, and counted as dropped if no consumer took it. Memory use and the age
+    of the frame a consumer gets are bounded however slow the consumer is.
+
+    With pool_consumers set, frame images are recycled through a FramePool sized for the
+    ring, that many consumers each holding a frame and the producer writing the next one.
+    Consumers then hand frames back with release() once they are done with the image.
+    """
+    def __init__(self, size=2, pool_consumers=0):
+        self.slots = [None] * size
+        self.sequence = 0
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.pool = FramePool(size + pool_consumers + 1) if pool_consumers else None
+
+    def publish(self, image, timestamp=None):
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        with self.condition:
+            self.sequence += 1
+            index = self.sequence % len(self.slots)
+            overwritten = self.slots[index]
+            if overwritten is not None:
+                if not overwritten.taken:
+                    self.dropped += 1
+                self.unref(overwritten)
+            self.slots[index] = Frame(self.sequence, timestamp, image)
+            self.condition.notify_all()
+
+    def get_latest(self, after=0, timeout=None):
+        """Newest frame with a sequence number above `after`, waiting for one up to timeout seconds.
+
+        Returns None on timeout or once the buffer is closed.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.sequence > after or self.closed, timeout):
+                return None
+            if self.sequence <= after:
+                return None
+            frame = self.slots[self.sequence % len(self.slots)]
+            frame.taken = True
+            frame.refs += 1
+            return frame
+
+    def acquire(self):
+        """A free image array for the next frame, None to let OpenCV allocate one"""
+        return None if self.pool is None else self.pool.acquire()
+
+    def discard(self, image):
+        """Hand back an array from acquire() that no frame was published in"""
+        if self.pool is not None and image is not None:
+            self.pool.release(image)
+
+    def release(self, frame):
+        """A consumer is done with a frame from get_latest()"""
+        with self.condition:
+            self.unref(frame)
+
+    def unref(self, frame):
+        frame.refs -= 1
+        if frame.refs == 0 and self.pool is not None:
+            self.pool.release(frame.image)
+
+    def close(self):
+        """Wake up every waiting consumer, used when the producer stops for good"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class CaptureThread:
+    """The only reader of a cv2.VideoCapture, publishing every frame into a LatestFrameBuffer.
+
+    With a run_state, the camera is not read while frames are not wanted (paused). A failed
+    read ends a recording, while a live camera is read again after a delay growing from
+    RETRY_DELAY to MAX_RETRY_DELAY seconds, so a USB or driver glitch does not end capture.
+    """
+    RETRY_DELAY = 0.05
+    MAX_RETRY_DELAY = 0.5
+
+    def __init__(self, cap, frame_buffer, stage_profiler=None, run_state=None, live=False):
+        self.cap = cap
+        self.frame_buffer = frame_buffer
+        self.profiler = stage_profiler
+        self.run_state = run_state
+        self.live = live
+        self.running = False
+        self.thread = None
+        self.failures = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        delay = self.RETRY_DELAY
+        while self.running:
+            if self.run_state is not None and not self.run_state.wait_for_webcam():
+                break
+            start = time.perf_counter_ns()
+            # Into a recycled array when the frame buffer has a pool
+            dst = self.frame_buffer.acquire()
+            ok, image = self.cap.read(dst)
+            if not ok:
+                self.frame_buffer.discard(dst)
+                if not self.live:
+                    break
+                self.failures += 1
+                time.sleep(delay)
+                delay = min(delay * 2, self.MAX_RETRY_DELAY)
+                continue
+            delay = self.RETRY_DELAY
+            if self.profiler is not None:
+                self.profiler.record("capture", start)
+            self.frame_buffer.publish(image, time.perf_counter())
+        self.frame_buffer.close()
+
+    def stop(self):
+        self.running = False
@@ -1,71 +1,49 @@
 import cv2
-import time
 import numpy as np
-import mediapipe as mp
-from mediapipe.python.solutions.drawing_utils import _normalized_to_pixel_coordinates as denormalize_coordinates
 
 
-def get_face_mesh(max_num_faces=1, refine_landmarks=True, min_detection_confidence=0.5, min_tracking_confidence=0.5):
-    return mp.solutions.face_mesh.FaceMesh(
-        max_num_faces=max_num_faces,
-        refine_landmarks=refine_landmarks,
-        min_detection_confidence=min_detection_confidence,
-        min_tracking_confidence=min_tracking_confidence,)
+def denormalize_coordinates(points, img_w, img_h):
+    """Convert normalized (..., 2) points to pixel coordinates, rounding like mediapipe's drawing utils"""
+    coords = np.floor(points * (img_w, img_h))
+    return np.minimum(coords, (img_w - 1, img_h - 1))
 
-def process_image(image):
-    # Flip the image horizontally for a selfie-view display.
-    image = cv2.flip(image, 1)
-    image.flags.writeable = False
-    return image
+def get_ear(landmarks, eye_idxs, img_w, img_h):
+    # Calculate Eye Aspect Ratio for a stack of eyes, eye_idxs has shape (eyes, 6).
+    points = landmarks[eye_idxs, :2].astype(np.float64)
+    coords_points = denormalize_coordinates(points, img_w, img_h)
 
-def distance(point_1, point_2):
-    """Calculate l2-norm between two points"""
-    dist = sum([(i - j) ** 2 for i, j in zip(point_1, point_2)]) ** 0.5
-    return dist
+    # Eye landmark (x, y)-coordinates: P2-P6 and P3-P5 vertically, P1-P4 horizontally
+    vertical = coords_points[:, [1, 2]] - coords_points[:, [5, 4]]
+    horizontal = coords_points[:, 0] - coords_points[:, 3]
+    vertical = np.hypot(vertical[..., 0], vertical[..., 1]).sum(axis=1)
+    horizontal = np.hypot(horizontal[:, 0], horizontal[:, 1])
 
-def get_ear(landmarks, refer_idxs, img_w, img_h):
-    # Calculate Eye Aspect Ratio for one eye.
-    try:
-        # Compute the euclidean distance between the horizontal
-        coords_points = []
-        for i in refer_idxs:
-            lm = landmarks[i]
-            coord = denormalize_coordinates(lm.x, lm.y, img_w, img_h)
-            coords_points.append(coord)
+    # An eye with off-image landmarks or a collapsed width gets an EAR of 0.0
+    valid = ((points >= 0.0) & (points <= 1.0)).all(axis=(1, 2)) & (horizontal > 0.0)
 
-        # Eye landmark (x, y)-coordinates
-        P2_P6 = distance(coords_points[1], coords_points[5])
-        P3_P5 = distance(coords_points[2], coords_points[4])
-        P1_P4 = distance(coords_points[0], coords_points[3])
+    # Compute the eye aspect ratio
+    ear = np.where(valid, vertical / (2.0 * np.where(valid, horizontal, 1.0)), 0.0)
 
-        # Compute the eye aspect ratio
-        ear = (P2_P6 + P3_P5) / (2.0 * P1_P4)
+    return ear, coords_points.astype(np.int32), valid
 
-    except:
-        ear = 0.0
-        coords_points = None
 
-    return ear, coords_points
+def calculate_avg_ear(landmarks, eye_idxs, img_w, img_h):
+    # Calculate average Eye aspect ratio over both eyes, eye_idxs stacks the left and right indexes
+    ear, coordinates, valid = get_ear(landmarks, eye_idxs, img_w, img_h)
+    Avg_EAR = float(ear.mean())
 
-
-def calculate_avg_ear(landmarks, left_eye_idxs, right_eye_idxs, img_w, img_h):
-    # Calculate average Eye aspect ratio
-    left_ear, left_lm_coordinates = get_ear(landmarks, left_eye_idxs, img_w, img_h)
-    right_ear, right_lm_coordinates = get_ear(landmarks, right_eye_idxs, img_w, img_h)
-    Avg_EAR = (left_ear + right_ear) / 2.0
-
-    return Avg_EAR, (left_lm_coordinates, right_lm_coordinates)
+    return Avg_EAR, tuple(coords if ok else None for coords, ok in zip(coordinates, valid))
 
 
 def plot_eye_landmarks(image, left_lm_coordinates, right_lm_coordinates, color):
     for lm_coordinates in [left_lm_coordinates, right_lm_coordinates]:
-        if lm_coordinates:
-            for coord in lm_coordinates:
+        if lm_coordinates is not None:
+            for coord in lm_coordinates.tolist():
                 cv2.circle(image, coord, 2, color, -1)
 
 
 class DrowsinessDetector:
-    def __init__(self, face_mesh):
+    def __init__(self):
         self.EAR_THRESH = 0.20
         self.WAIT_TIME = 1.0  # secs
 
@@ -74,12 +52,13 @@ class DrowsinessDetector:
             "left": [362, 385, 387, 263, 373, 380],
             "right": [33, 160, 158, 133, 153, 144],
         }
+        self.eye_idx_stack = np.array([self.eye_idxs["left"], self.eye_idxs["right"]])
 
-        self.start_time = time.perf_counter()
+        self.start_time = None
         self.d_time = 0.0
         self.play_alarm = False
-
-        self.facemesh_model = face_mesh
+        self.ear = None
+        self.eye_coordinates = (None, None)
 
 
     def update_ear_thresh(self, new_value):
@@ -88,36 +67,36 @@ class DrowsinessDetector:
     def update_wait_time(self, new_value):
         self.WAIT_TIME = new_value
 
-    # This function is used to implement our Drowsy detection algorithm
-    def run(self, image: np.array):
-        image = process_image(image)
-        img_h, img_w, _ = image.shape    
-        results = self.facemesh_model.process(image)
+    def measure(self, analysis):
+        """Average EAR of a frame, None when no face was found. Keeps the eye coordinates for draw()"""
+        if not analysis.face_found:
+            self.eye_coordinates = (None, None)
+            return None
+        ear, self.eye_coordinates = calculate_avg_ear(analysis.landmarks, self.eye_idx_stack, analysis.img_w, analysis.img_h)
+        return ear
 
-        if results.multi_face_landmarks:
-            landmarks = results.multi_face_landmarks[0].landmark
-            EAR, coordinates = calculate_avg_ear(landmarks, self.eye_idxs["left"], self.eye_idxs["right"], img_w, img_h)
-            plot_eye_landmarks(image, coordinates[0], coordinates[1], (0, 255, 0))
+    def update(self, ear, timestamp):
+        """Advance the drowsiness timer with one frame's EAR, timestamp is the frame time in seconds"""
+        if self.start_time is None:
+            self.start_time = timestamp
 
-            if EAR < self.EAR_THRESH:
+        if ear is not None and ear < self.EAR_THRESH:
 
-                # Increase DROWSY_TIME to track the time period with EAR less than the threshold
-                # and reset the start_time for the next iteration.
-                end_time = time.perf_counter()
-                self.d_time += end_time - self.start_time
-                self.start_time = time.perf_counter()
+            # Increase DROWSY_TIME to track the time period with EAR less than the threshold
+            # and reset the start_time for the next iteration.
+            self.d_time += timestamp - self.start_time
+            self.start_time = timestamp
 
-                if self.d_time >= self.WAIT_TIME:
-                    self.play_alarm = True
-
-            else:
-                self.start_time = time.perf_counter()
-                self.d_time = 0.0
-                self.play_alarm = False
+            if self.d_time >= self.WAIT_TIME:
+                self.play_alarm = True
 
         else:
-            self.start_time = time.perf_counter()
+            self.start_time = timestamp
             self.d_time = 0.0
             self.play_alarm = False
 
-        return image, self.play_alarm
\ No newline at end of file
+        return self.play_alarm
+
+    def draw(self, image, rgb=False):
+        color = (0, 255, 0)  # Green in BGR and RGB
+        plot_eye_landmarks(image, self.eye_coordinates[0], self.eye_coordinates[1], color)
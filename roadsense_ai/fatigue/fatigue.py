@@ -0,0 +1,182 @@
+import numpy as np
+
+
+class MetricRing:
+    """Fixed-capacity FIFO of per-frame records, one numpy array per field"""
+    def __init__(self, capacity, **dtypes):
+        self.capacity = capacity
+        self.fields = {name: np.zeros(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def full(self):
+        return self.count == self.capacity
+
+    def push(self, **values):
+        """Append a record, the ring must not be full"""
+        index = (self.start + self.count) % self.capacity
+        for name, value in values.items():
+            self.fields[name][index] = value
+        self.count += 1
+
+    def oldest(self, name):
+        return self.fields[name][self.start]
+
+    def pop(self):
+        """Drop the oldest record"""
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+
+    def to_arrays(self):
+        """Copies of every field in insertion order"""
+        indexes = (self.start + np.arange(self.count)) % self.capacity
+        return {name: values[indexes] for name, values in self.fields.items()}
+
+
+class FatigueMonitor:
+    """PERCLOS and blink statistics over a sliding time window, updated in O(1) per frame.
+
+    Every frame is kept in a MetricRing with the time it accounts for (its gap to the previous
+    frame) and whether the eyes were closed (EAR below the threshold). Running sums are updated
+    as frames enter and leave the window, so nothing is ever rescanned and memory use is fixed
+    by the window length. Blinks are closures between MIN_BLINK and MAX_BLINK seconds long,
+    kept in a second ring the same way.
+    """
+    WINDOW = 60.0
+    MAX_FPS = 60
+    MAX_FRAME_GAP = 0.5
+    MIN_BLINK = 0.05
+    MAX_BLINK = 0.5
+    # PERCLOS, or the mean blink duration in seconds, at which the driver is considered fatigued
+    PERCLOS_THRESH = 0.15
+    SLOW_BLINK_THRESH = 0.3
+    # Share of the window that must have been observed before alerting
+    MIN_COVERAGE = 0.5
+
+    def __init__(self, window=None, max_fps=None):
+        self.window = window or self.WINDOW
+        capacity = int(self.window * (max_fps or self.MAX_FPS))
+        self.frames = MetricRing(capacity, timestamp=np.float64, ear=np.float32, pitch=np.float32,
+                                 yaw=np.float32, duration=np.float32, closed=np.bool_)
+        # At most one blink every 2 * MIN_BLINK seconds
+        self.blinks = MetricRing(int(self.window / (2 * self.MIN_BLINK)) + 1,
+                                 start=np.float64, duration=np.float32, interval=np.float32)
+
+        self.observed_time = 0.0
+        self.closed_time = 0.0
+        self.blink_time = 0.0
+        self.interval_time = 0.0
+        self.interval_count = 0
+        self.last_timestamp = None
+        self.closed_since = None
+        self.last_blink_start = None
+
+    def update(self, timestamp, ear, pitch=None, yaw=None, closed_thresh=0.24):
+        """Add one frame's measurements, ear is None when no face was found. Returns whether to alert"""
+        duration = 0.0
+        if ear is not None and self.last_timestamp is not None:
+            gap = timestamp - self.last_timestamp
+            # Long gaps are time nobody watched, they count for nothing
+            duration = gap if 0.0 < gap <= self.MAX_FRAME_GAP else 0.0
+        self.last_timestamp = timestamp
+        closed = ear is not None and ear < closed_thresh
+
+        if self.frames.full:
+            self.drop_frame()
+        self.frames.push(timestamp=timestamp, ear=np.nan if ear is None else ear,
+                         pitch=np.nan if pitch is None else pitch, yaw=np.nan if yaw is None else yaw,
+                         duration=duration, closed=closed)
+        self.observed_time += duration
+        self.closed_time += duration * closed
+
+        self.update_blinks(timestamp, ear, closed)
+        self.expire(timestamp - self.window)
+        return self.alert
+
+    def update_blinks(self, timestamp, ear, closed):
+        if ear is None:
+            # A closure the face was lost in is not a blink
+            self.closed_since = None
+        elif closed:
+            if self.closed_since is None:
+                self.closed_since = timestamp
+        elif self.closed_since is not None:
+            start, duration = self.closed_since, timestamp - self.closed_since
+            self.closed_since = None
+            if self.MIN_BLINK <= duration <= self.MAX_BLINK:
+                self.add_blink(start, duration)
+
+    def add_blink(self, start, duration):
+        interval = np.nan if self.last_blink_start is None else start - self.last_blink_start
+        self.last_blink_start = start
+        if self.blinks.full:
+            self.drop_blink()
+        self.blinks.push(start=start, duration=duration, interval=interval)
+        self.blink_time += duration
+        if not np.isnan(interval):
+            self.interval_time += interval
+            self.interval_count += 1
+
+    def expire(self, window_start):
+        while len(self.frames) and self.frames.oldest("timestamp") < window_start:
+            self.drop_frame()
+        while len(self.blinks) and self.blinks.oldest("start") < window_start:
+            self.drop_blink()
+
+    def drop_frame(self):
+        duration = float(self.frames.oldest("duration"))
+        self.observed_time = max(0.0, self.observed_time - duration)
+        if self.frames.oldest("closed"):
+            self.closed_time = max(0.0, self.closed_time - duration)
+        self.frames.pop()
+
+    def drop_blink(self):
+        self.blink_time = max(0.0, self.blink_time - float(self.blinks.oldest("duration")))
+        interval = float(self.blinks.oldest("interval"))
+        if not np.isnan(interval):
+            self.interval_time = max(0.0, self.interval_time - interval)
+            self.interval_count -= 1
+        self.blinks.pop()
+
+    @property
+    def perclos(self):
+        """Share of the observed time in the window the eyes were closed"""
+        return self.closed_time / self.observed_time if self.observed_time else 0.0
+
+    @property
+    def blink_rate(self):
+        """Blinks per minute of observed time"""
+        return len(self.blinks) * 60.0 / self.observed_time if self.observed_time else 0.0
+
+    @property
+    def mean_blink_duration(self):
+        return self.blink_time / len(self.blinks) if len(self.blinks) else 0.0
+
+    @property
+    def mean_blink_interval(self):
+        return self.interval_time / self.interval_count if self.interval_count else 0.0
+
+    @property
+    def alert(self):
+        if self.observed_time < self.MIN_COVERAGE * self.window:
+            return False
+        return self.perclos >= self.PERCLOS_THRESH or self.mean_blink_duration >= self.SLOW_BLINK_THRESH
+
+    def stats(self):
+        return {
+            "observed_seconds": self.observed_time,
+            "perclos": self.perclos,
+            "blinks": len(self.blinks),
+            "blink_rate": self.blink_rate,
+            "mean_blink_duration": self.mean_blink_duration,
+            "mean_blink_interval": self.mean_blink_interval,
+        }
+
+    def history(self):
+        """The frames of the window as arrays: timestamp, ear, pitch, yaw (nan without a face)"""
+        arrays = self.frames.to_arrays()
+        return {name: arrays[name] for name in ("timestamp", "ear", "pitch", "yaw")}
@@ -0,0 +1,252 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+import cv2
+
+from ..capture import capture
+from ..frame_analysis import frame_analysis
+from ..pipeline import pipeline
+from ..profiler import profiler
+from ..replay import replay
+
+
+def is_device(source):
+    """Camera indexes and stream URLs are read live, anything else is a recording"""
+    return source.isdigit() or "://" in source
+
+def get_stream_names(sources):
+    """Unique file-system friendly names for the sources, used for their timelines"""
+    names = []
+    for index, source in enumerate(sources):
+        if is_device(source):
+            name = "camera_" + re.sub(r"\W+", "_", source).strip("_")
+        else:
+            name = os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+        names.append(name if name not in names else f"{name}_{index}")
+    return names
+
+
+class Stream:
+    """One camera or recording with its own detector state and timeline.
+
+    Recordings are decoded on demand by whichever worker holds the stream, so they are never
+    read ahead of the analysis. Cameras are read by their own CaptureThread into a small
+    LatestFrameBuffer, dropping the frames the workers cannot keep up with.
+    """
+    def __init__(self, name, source, output, fps=None, forward=None, callibrate=False, settings=None):
+        self.name = name
+        self.source = source
+        self.live = is_device(source)
+        self.writer = replay.TimelineWriter(output, forward, callibrate, settings)
+        # "frame" times the analysis of each frame, "lag" runs from a frame's arrival to its record
+        self.profiler = profiler.StageProfiler()
+        self.frame_count = 0
+        self.finished = False
+        self.start_time = None
+        self.end_time = None
+
+        if self.live:
+            self.cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+            self.frame_buffer = capture.LatestFrameBuffer()
+            self.capture_thread = capture.CaptureThread(self.cap, self.frame_buffer, live=True)
+            self.last_sequence = 0
+        else:
+            self.frames = replay.iter_frames(source, fps)
+
+    @property
+    def dropped(self):
+        return self.frame_buffer.dropped if self.live else 0
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        if self.live:
+            self.capture_thread.start()
+
+    def read(self, timeout):
+        """Next frame as (timestamp, arrival time, image), None when no frame is ready within timeout.
+
+        Timestamps are seconds from the start of the stream. A recording's frames arrive as if it
+        was played in real time, so the lag of a recording shows how far the analysis is behind that.
+        """
+        if self.live:
+            frame = self.frame_buffer.get_latest(self.last_sequence, timeout)
+            if frame is None:
+                self.finished = self.frame_buffer.closed
+                return None
+            self.last_sequence = frame.sequence
+            return frame.timestamp - self.start_time, frame.timestamp, frame.image
+
+        timestamp, image = next(self.frames, (None, None))
+        if image is None:
+            self.finished = True
+            return None
+        return timestamp, self.start_time + timestamp, image
+
+    def close(self):
+        self.end_time = time.perf_counter()
+        if self.live:
+            self.capture_thread.stop()
+            self.capture_thread.thread.join()
+            self.cap.release()
+        else:
+            self.frames.close()
+        self.writer.close()
+
+    def stats(self):
+        stats = {"stream": self.name, "frames": self.frame_count, "fps": 0.0, "dropped": self.dropped,
+                 "lag_p50_ms": 0.0, "lag_p95_ms": 0.0}
+        if self.frame_count:
+            elapsed = (self.end_time or time.perf_counter()) - self.start_time
+            lag = self.profiler.stats("lag")
+            stats.update(fps=self.frame_count / elapsed if elapsed else 0.0,
+                         lag_p50_ms=lag["p50_ms"], lag_p95_ms=lag["p95_ms"])
+        return stats
+
+
+class Fleet:
+    """Analyses many streams at once on a bounded pool of inference workers.
+
+    Each worker owns one FaceMesh and leases one stream at a time: it analyses the stream's next
+    frame, runs the stream's detector timers on it and puts the stream back at the end of the
+    ready queue. With at most one frame of a stream in flight, timelines stay in frame order
+    and every stream gets its turn in round robin however many frames the others have. Since a
+    worker's FaceMesh sees frames of every stream, it runs in static image mode.
+    """
+    def __init__(self, streams, workers=None, poll_interval=0.01):
+        self.streams = streams
+        self.workers = workers or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.ready = deque()
+        self.active = 0
+        self.stopping = False
+        self.condition = threading.Condition()
+        self.threads = []
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        for stream in self.streams:
+            stream.start()
+        self.ready.extend(self.streams)
+        self.active = len(self.streams)
+        self.threads = [threading.Thread(target=self.work, name=f"fleet-worker-{index}", daemon=True)
+                        for index in range(min(self.workers, len(self.streams)))]
+        for thread in self.threads:
+            thread.start()
+
+    def run(self, report_interval=None, report=print):
+        """Start the fleet and wait until every stream has finished, reporting every report_interval seconds"""
+        self.start()
+        try:
+            while self.is_running():
+                time.sleep(report_interval or self.poll_interval * 10)
+                if report_interval and self.is_running():
+                    report(self.report())
+        except KeyboardInterrupt:
+            self.stop()
+        self.join()
+        return self.stats()
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        self.end_time = time.perf_counter()
+        # Streams still leased when the fleet was stopped are closed here
+        for stream in self.ready:
+            stream.close()
+        self.ready.clear()
+
+    def lease(self):
+        """Take the next ready stream, None once every stream has finished or the fleet is stopping"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.ready or not self.active or self.stopping)
+            if self.stopping or not self.ready:
+                return None
+            return self.ready.popleft()
+
+    def release(self, stream):
+        with self.condition:
+            if stream.finished or self.stopping:
+                self.active -= 1
+                self.condition.notify_all()
+            else:
+                self.ready.append(stream)
+                self.condition.notify()
+        if stream.finished or self.stopping:
+            stream.close()
+
+    def work(self):
+        face_mesh = frame_analysis.get_face_mesh(static_image_mode=True)
+        frame_analyzer = frame_analysis.FrameAnalyzer(face_mesh)
+        # Only measure() is used, the detector timers live in each stream's TimelineWriter
+        measuring_pipeline = pipeline.DetectionPipeline(frame_analyzer)
+        try:
+            while True:
+                stream = self.lease()
+                if stream is None:
+                    break
+                try:
+                    self.process(stream, frame_analyzer, measuring_pipeline)
+                finally:
+                    self.release(stream)
+        finally:
+            frame_analyzer.close()
+
+    def process(self, stream, frame_analyzer, measuring_pipeline):
+        start = time.perf_counter_ns()
+        frame = stream.read(self.poll_interval)
+        if frame is None:
+            return
+        timestamp, arrival, image = frame
+        measurement = measuring_pipeline.measure(frame_analyzer.analyze(image, timestamp))
+        stream.writer.write(measurement)
+        stream.frame_count += 1
+        end = stream.profiler.record("frame", start)
+        stream.profiler.record("lag", int(arrival * 1e9), end)
+
+    def stats(self):
+        elapsed = (self.end_time or time.perf_counter()) - self.start_time if self.start_time else 0.0
+        streams = [stream.stats() for stream in self.streams]
+        frames = sum(stats["frames"] for stats in streams)
+        return {"seconds": elapsed, "frames": frames, "fps": frames / elapsed if elapsed else 0.0,
+                "streams": streams}
+
+    def report(self):
+        stats = self.stats()
+        lines = [f"{len(self.streams)} streams, {stats['frames']} frames in {stats['seconds']:.1f}s "
+                 f"({stats['fps']:.1f} fps)",
+                 f"{'stream':<24}{'frames':>8}{'fps':>8}{'lag p50':>10}{'lag p95':>10}{'dropped':>9}"]
+        for stream in stats["streams"]:
+            lines.append(f"{stream['stream']:<24}{stream['frames']:>8}{stream['fps']:>8.1f}"
+                         f"{stream['lag_p50_ms']:>10.0f}{stream['lag_p95_ms']:>10.0f}{stream['dropped']:>9}")
+        return "\n".join(lines)
+
+
+def add_arguments(parser):
+    parser.add_argument("sources", nargs="+", help="video files, frame image directories, camera indexes or stream URLs")
+    parser.add_argument("-o", "--output", default="timelines", help="directory to write one JSONL timeline per source to")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="inference workers, each with its own landmark model (default one per CPU)")
+    parser.add_argument("--report-interval", type=float, metavar="SECONDS", help="print progress periodically")
+    replay.add_detector_arguments(parser)
+
+def main(args):
+    os.makedirs(args.output, exist_ok=True)
+    settings = replay.get_settings(args)
+    streams = [Stream(name, source, os.path.join(args.output, name + ".jsonl"), args.fps, args.forward,
+                      args.callibrate, settings)
+               for name, source in zip(get_stream_names(args.sources), args.sources)]
+    fleet = Fleet(streams, args.workers)
+    fleet.run(args.report_interval)
+    print(fleet.report())
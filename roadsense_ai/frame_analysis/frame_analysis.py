@@ -0,0 +1,176 @@
+import time
+import cv2
+import numpy as np
+
+from ..landmark_provider import landmark_provider
+from ..profiler import profiler
+
+
+def get_face_mesh(max_num_faces=1, refine_landmarks=True, min_detection_confidence=0.5, min_tracking_confidence=0.5, static_image_mode=False):
+    return landmark_provider.FaceMeshProvider(
+        static_image_mode=static_image_mode,
+        max_num_faces=max_num_faces,
+        refine_landmarks=refine_landmarks,
+        min_detection_confidence=min_detection_confidence,
+        min_tracking_confidence=min_tracking_confidence,)
+
+def process_image(image, dst=None):
+    # Flip the image horizontally for a selfie-view display.
+    image = cv2.flip(image, 1, dst)
+    image.flags.writeable = False
+    return image
+
+class FrameAnalysis:
+    """Landmark result of one frame, shared by every detector.
+
+    keyframe is False when the landmarks were tracked from an earlier frame instead of
+    coming from the landmark model. image is None for landmarks read back from a cache,
+    image_size then gives the (width, height) they were found in.
+    """
+    def __init__(self, image, landmarks, timestamp, keyframe=True, image_size=None):
+        self.image = image
+        self.landmarks = landmarks
+        self.timestamp = timestamp
+        self.keyframe = keyframe
+        if image is None:
+            self.img_w, self.img_h = image_size
+        else:
+            self.img_h, self.img_w = image.shape[:2]
+
+    @property
+    def face_found(self):
+        return self.landmarks is not None
+
+
+def get_face_crop(landmarks, img_w, img_h, margin):
+    """Pixel box (x0, y0, x1, y1) around the landmarks, grown by margin times the face size on each side"""
+    min_x, min_y = (landmarks[:, :2].min(axis=0) * (img_w, img_h)).tolist()
+    max_x, max_y = (landmarks[:, :2].max(axis=0) * (img_w, img_h)).tolist()
+    pad = margin * max(max_x - min_x, max_y - min_y)
+    return (max(0, int(min_x - pad)), max(0, int(min_y - pad)),
+            min(img_w, int(max_x + pad) + 1), min(img_h, int(max_y + pad) + 1))
+
+def contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+def area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+class FrameAnalyzer:
+    """Flips a frame once and runs the landmark model once on it.
+
+    The model is a landmark_provider.LandmarkProvider, FaceMesh by default from get_face_mesh().
+    With roi set, the model only sees the area around the face found in the previous frame
+    (grown by roi_margin times the face size), falling back to a full-frame search when the
+    face is lost. Crops run on their own roi_provider, as the model's face tracking state is
+    only valid for inputs in the same coordinates. With max_input_size set, the model input is
+    downscaled so its longer side is at most that many pixels. Landmarks are always returned
+    normalized to the full frame. Frames are flipped into one reused array unless a dst is
+    given, an analysis image is only valid until the next analyze() call.
+    """
+    def __init__(self, provider, stage_profiler=None, roi=False, roi_margin=0.5, max_input_size=None, roi_provider=None):
+        self.provider = provider
+        self.profiler = stage_profiler or profiler.StageProfiler(enabled=False)
+        self.roi = roi
+        self.roi_margin = roi_margin
+        self.max_input_size = max_input_size
+        if roi and not provider.synchronous:
+            # A late result cannot be mapped back from the crop it was found in
+            raise ValueError("roi needs a landmark provider that answers for the image it is given")
+        self.roi_provider = roi_provider
+        if roi and roi_provider is None:
+            self.roi_provider = provider.clone()
+        self.crop = None
+        self.flipped = None
+
+    def analyze(self, frame, timestamp=None, dst=None):
+        """Analyze one camera frame, timestamp is its capture time in seconds (now if not given).
+
+        The flipped frame is written to dst when given, an array of the frame's shape.
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+
+        start = time.perf_counter_ns()
+        if dst is None:
+            # cv2.flip allocates a new array when the frame size changed
+            image = self.flipped = process_image(frame, self.flipped)
+        else:
+            image = process_image(frame, dst)
+        self.profiler.record("flip", start)
+
+        landmarks = self.find_landmarks(image, timestamp)
+        image.flags.writeable = True
+        return FrameAnalysis(image, landmarks, timestamp)
+
+    def find_landmarks(self, image, timestamp=None):
+        """Run the landmark model on an already flipped image, None when no face was found"""
+        start = time.perf_counter_ns()
+        landmarks = None
+        if self.roi and self.crop is not None:
+            landmarks = self.detect(image, self.crop, timestamp)
+        if landmarks is None:
+            landmarks = self.detect(image, timestamp=timestamp)
+        self.profiler.record("inference", start)
+
+        if self.roi:
+            self.update_crop(landmarks, image.shape[1], image.shape[0])
+        return landmarks
+
+    def warm_up(self, img_w=640, img_h=480):
+        """Run the models once on a blank frame, so the first camera frame does not pay their setup cost"""
+        image = np.zeros((img_h, img_w, 3), dtype=np.uint8)
+        self.provider.warm_up(self.get_model_input(image))
+        if self.roi_provider is not None:
+            self.roi_provider.warm_up(self.get_model_input(image, (0, 0, img_w, img_h)))
+
+    def close(self):
+        """Close the model and the ROI model"""
+        self.provider.close()
+        if self.roi_provider is not None:
+            self.roi_provider.close()
+
+    def observe(self, escalate):
+        """Feedback from the detectors after each frame, every frame already runs the landmark model"""
+
+    def get_model_input(self, image, crop=None):
+        """The crop of an image, downscaled to max_input_size"""
+        if crop is not None:
+            x0, y0, x1, y1 = crop
+            image = np.ascontiguousarray(image[y0:y1, x0:x1])
+
+        input_h, input_w = image.shape[:2]
+        if self.max_input_size and max(input_h, input_w) > self.max_input_size:
+            scale = self.max_input_size / max(input_h, input_w)
+            image = cv2.resize(image, (max(1, round(input_w * scale)), max(1, round(input_h * scale))),
+                               interpolation=cv2.INTER_LINEAR)
+        return image
+
+    def detect(self, image, crop=None, timestamp=None):
+        """Run the landmark model on the crop of an image, None when no face was found"""
+        img_h, img_w = image.shape[:2]
+        x0, y0, x1, y1 = crop or (0, 0, img_w, img_h)
+        provider = self.provider if crop is None else self.roi_provider
+        landmarks = provider.detect(self.get_model_input(image, crop), timestamp)
+        if landmarks is None:
+            return None
+
+        if crop is not None:
+            # Map crop-normalized landmarks back to the full frame, z is scaled like x
+            landmarks[:, 0] = (landmarks[:, 0] * (x1 - x0) + x0) / img_w
+            landmarks[:, 1] = (landmarks[:, 1] * (y1 - y0) + y0) / img_h
+            landmarks[:, 2] *= (x1 - x0) / img_w
+        return landmarks
+
+    def update_crop(self, landmarks, img_w, img_h):
+        if landmarks is None:
+            self.crop = None
+            return
+
+        # Keep the crop while the face stays well inside it, so the model's own face
+        # tracking sees a steady input instead of one that shifts every frame.
+        inner = get_face_crop(landmarks, img_w, img_h, self.roi_margin / 2)
+        crop = get_face_crop(landmarks, img_w, img_h, self.roi_margin)
+        if self.crop is None or not contains(self.crop, inner) or area(self.crop) > 2 * area(crop):
+            self.crop = crop
@@ -1,44 +1,97 @@
 import cv2
-import mediapipe as mp
 import numpy as np
-import time
 
-def get_face_mesh(max_num_faces=1, min_detection_confidence=0.5, min_tracking_confidence=0.5):
-    face_mesh    =  mp.solutions.face_mesh.FaceMesh(
-                    max_num_faces=max_num_faces, 
-                    min_detection_confidence=min_detection_confidence, 
-                    min_tracking_confidence=min_tracking_confidence)
-    
-    return face_mesh
+# Canonical face in millimetres (x right, y down, z away from the camera, nose tip at the origin),
+# close to the FaceMesh landmarks of a frontal face scaled to 90 mm between the outer eye corners
+FACE_MODEL = {
+    1: (0.0, 0.0, 0.0),        # nose tip
+    33: (-45.0, -42.0, 38.0),  # eye outer corners
+    263: (45.0, -42.0, 38.0),
+    61: (-32.0, 14.0, 46.0),   # mouth corners
+    291: (32.0, 14.0, 46.0),
+    199: (0.0, 59.0, 37.0),    # chin
+}
 
-def process_image(image):
-    image = cv2.flip(image, 1)
-    image.flags.writeable = False 
-    return image
 
 def get_camera_matrix(img_h, img_w):
+    """Pinhole camera with the principal point at the image center, for an uncallibrated camera"""
     focal_length = 1 * img_w
-    cam_matrix = np.array([ [focal_length, 0, img_h / 2],
-                            [0, focal_length, img_w / 2],
-                            [0, 0, 1] ])
+    cam_matrix = np.array([ [focal_length, 0, img_w / 2],
+                            [0, focal_length, img_h / 2],
+                            [0, 0, 1] ], dtype=np.float64)
     return cam_matrix
 
-
-def get_rotvec(face_3d, face_2d, cam_matrix, dist_matrix):
-    success, rot_vec, trans_vec = cv2.solvePnP(face_3d, face_2d, cam_matrix, dist_matrix)
+def load_calibration(path):
+    """Read (camera matrix, distortion coefficients, (width, height) or None) from an OpenCV calibration file"""
+    storage = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+    if not storage.isOpened():
+        raise ValueError(f"Cannot open camera calibration {path!r}")
+    try:
+        cam_matrix = storage.getNode("camera_matrix").mat()
+        if cam_matrix is None or cam_matrix.shape != (3, 3):
+            raise ValueError(f"No 3x3 camera_matrix in {path!r}")
+        dist_coeffs = storage.getNode("distortion_coefficients").mat()
+        if dist_coeffs is None:
+            dist_coeffs = np.zeros((4, 1))
+        img_w, img_h = storage.getNode("image_width").real(), storage.getNode("image_height").real()
+        image_size = (img_w, img_h) if img_w and img_h else None
+    finally:
+        storage.release()
+    return cam_matrix.astype(np.float64), dist_coeffs.astype(np.float64).reshape(-1, 1), image_size
+
+def get_intrinsics(img_w, img_h, calibration=None):
+    """(camera matrix, distortion coefficients) for frames of a resolution.
+
+    A calibration made at another resolution is scaled to the frame size.
+    """
+    if calibration is None:
+        return get_camera_matrix(img_h, img_w), np.zeros((4, 1), dtype=np.float64)
+
+    cam_matrix, dist_coeffs, image_size = calibration
+    if image_size is not None:
+        calib_w, calib_h = image_size
+        cam_matrix = cam_matrix * np.array([[img_w / calib_w], [img_h / calib_h], [1.0]])
+    return cam_matrix, dist_coeffs
+
+def solve_pnp(model_points, face_2d, cam_matrix, dist_coeffs):
+    """Rotation vector of the face model.
+
+    SQPnP finds the global minimum without an initial guess. The iterative solver started from
+    scratch lands behind the camera on some frames, and started from the previous pose it is
+    several times slower than SQPnP.
+    """
+    _, rot_vec, _ = cv2.solvePnP(model_points, face_2d, cam_matrix, dist_coeffs, flags=cv2.SOLVEPNP_SQPNP)
     return rot_vec
 
-def get_rmat(rot_vec):
-    rmat, jac = cv2.Rodrigues(rot_vec)
-    return rmat
-
-def get_angles(img_h, img_w, face_3d, face_2d):
-    cam_matrix = get_camera_matrix(img_h, img_w)
-    dist_matrix = np.zeros((4, 1), dtype=np.float64)
-    rot_vec = get_rotvec(face_3d, face_2d, cam_matrix, dist_matrix)
-    rmat = get_rmat(rot_vec)
-    angles, mtxR, mtxQ, Qx, Qy, Qz = cv2.RQDecomp3x3(rmat)
-    return angles
+def get_euler_angles(rot_vecs):
+    """(N, 3) x, y, z angles in degrees of (N, 3) rotation vectors, as cv2.RQDecomp3x3 of their matrices"""
+    theta = np.linalg.norm(rot_vecs, axis=1)
+    axis = rot_vecs / np.where(theta > 0, theta, 1.0)[:, None]
+    kx, ky, kz = axis.T
+    sin, cos = np.sin(theta), 1 - np.cos(theta)
+    # Rodrigues' formula, only for the matrix elements the angles need
+    r00 = 1 - cos * (ky ** 2 + kz ** 2)
+    r10 = sin * kz + cos * kx * ky
+    r20 = -sin * ky + cos * kx * kz
+    r21 = sin * kx + cos * ky * kz
+    r22 = 1 - cos * (kx ** 2 + ky ** 2)
+    return np.degrees(np.column_stack((np.arctan2(r21, r22), np.arcsin(np.clip(-r20, -1, 1)), np.arctan2(r10, r00))))
+
+def to_head_angles(x, y):
+    """Head (pitch, yaw) from the face model rotation angles, positive for looking up and right"""
+    return -x, -y
+
+def get_image_points(landmarks, target_idxs, img_w, img_h):
+    """(N, 2) sub-pixel image points of the target landmarks"""
+    return landmarks[target_idxs, :2].astype(np.float64) * (img_w, img_h)
+
+def get_face_box(landmarks, img_w, img_h):
+    min_x, min_y = landmarks[:, :2].min(axis=0).tolist()
+    max_x, max_y = landmarks[:, :2].max(axis=0).tolist()
+    return int(min_x * img_w), int(min_y * img_h), int(max_x * img_w), int(max_y * img_h)
+
+def get_nose_2d(landmarks, img_w, img_h):
+    return landmarks[1, :2].astype(np.float64) * (img_w, img_h)
 
 def get_direction(fx, fy, x, y, offset:int):
     if y-fy < -offset:
@@ -52,29 +105,34 @@ def get_direction(fx, fy, x, y, offset:int):
     else:
         return "Forward"
 
-def plot_nose_line(image, nose_2d, x, y):
+def plot_nose_line(image, nose_2d, x, y, color=(255, 0, 0)):
     p1 = (int(nose_2d[0]), int(nose_2d[1]))
-    p2 = (int(nose_2d[0] + y * 10) , int(nose_2d[1] - x * 10))
-    cv2.line(image, p1, p2, (255, 0, 0), 3)
+    p2 = (int(nose_2d[0] + y * 2) , int(nose_2d[1] - x * 2))
+    cv2.line(image, p1, p2, color, 3)
     
 
 class HeadPoseEstimator:
-    def __init__(self, face_mesh) -> None:
+    def __init__(self) -> None:
         self.WAIT_TIME = 1.0
         self.OFFSET = 15
-        
-        self.face_mesh = face_mesh
-        self.mp_drawing = mp.solutions.drawing_utils
-        self.mp_drawing_styles = mp.solutions.drawing_styles
-        self.mp_face_mesh = mp.solutions.face_mesh
-        
+
         self.target_landmarks = [33, 263, 1, 61, 291, 199]
+        # PnP points in landmark index order, as the original per-landmark scan produced them
+        self.target_idxs = np.sort(self.target_landmarks)
+        self.model_points = np.array([FACE_MODEL[idx] for idx in self.target_idxs], dtype=np.float64)
+        self.calibration = None
+        self.intrinsics = {}
         self.good_directions = ["Forward"]
         self.play_alarm = False
         self.forward_x = 0.0
         self.forward_y = 0.0
         self.d_time = 0.0
-        self.start_time = time.perf_counter()
+        self.start_time = None
+        self.face_box = None
+        self.nose_2d = None
+        self.head_direction = None
+        self.x = None
+        self.y = None
 
     def update_wait_time(self, new_value):
         self.WAIT_TIME = new_value
@@ -82,87 +140,107 @@ class HeadPoseEstimator:
     def update_offset(self, new_value):
         self.OFFSET = new_value
 
-    def callibrate(self, image):
-        image = process_image(image)
-        direction_str, x, y = self.get_head_direction(image)
-        self.forward_x = x
-        self.forward_y = y
-
-    def get_head_direction(self, image):
-        results = self.face_mesh.process(image)
-        
-        img_h, img_w, img_c = image.shape
-        face_3d = []
-        face_2d = []
-
-        if results.multi_face_landmarks:
-            landmarks = results.multi_face_landmarks[0].landmark
-            for idx, lm in enumerate(landmarks):
-                if idx in self.target_landmarks:
-                    x, y = int(lm.x * img_w), int(lm.y * img_h)
-                    face_2d.append([x, y])
-                    face_3d.append([x, y, lm.z])
-        
-            # Extract coordinates of all face landmarks
-            all_landmarks = [landmark for landmarks in results.multi_face_landmarks for landmark in landmarks.landmark]
-
-            # Calculate bounding box
-            min_x = int(min(landmark.x for landmark in all_landmarks) * image.shape[1])
-            max_x = int(max(landmark.x for landmark in all_landmarks) * image.shape[1])
-            min_y = int(min(landmark.y for landmark in all_landmarks) * image.shape[0])
-            max_y = int(max(landmark.y for landmark in all_landmarks) * image.shape[0])
-
-            # Draw green bounding box
-            box_color = (0, 255, 0)  # Green color in BGR format
-            thickness = 2  # Line thickness
-            cv2.rectangle(image, (min_x, min_y), (max_x, max_y), box_color, thickness)
-
-
-            # Convert it to the NumPy array
-            face_2d = np.array(face_2d, dtype=np.float64)
-            face_3d = np.array(face_3d, dtype=np.float64)
-
-            angles = get_angles(img_h, img_w, face_3d, face_2d)
-
-            # scale the angles, I guess
-            x = angles[0] * 360
-            y = angles[1] * 360
-            z = angles[2] * 360
+    def load_calibration(self, path):
+        """Use the camera intrinsics of an OpenCV calibration file instead of the default pinhole camera"""
+        self.calibration = load_calibration(path)
+        self.intrinsics = {}
+
+    def get_intrinsics(self, img_w, img_h):
+        intrinsics = self.intrinsics.get((img_w, img_h))
+        if intrinsics is None:
+            intrinsics = self.intrinsics[(img_w, img_h)] = get_intrinsics(img_w, img_h, self.calibration)
+        return intrinsics
+
+    def solve_pose(self, face_2d, img_w, img_h):
+        """Head (pitch, yaw) in degrees of the target landmarks' image points"""
+        cam_matrix, dist_coeffs = self.get_intrinsics(img_w, img_h)
+        rot_vec = solve_pnp(self.model_points, face_2d, cam_matrix, dist_coeffs)
+        rmat, _ = cv2.Rodrigues(rot_vec)
+        angles = cv2.RQDecomp3x3(rmat)[0]
+        return to_head_angles(angles[0], angles[1])
+
+    def measure_batch(self, landmarks, present, image_sizes):
+        """Head (pitch, yaw) arrays of many frames for offline analysis, nan where present is False.
+
+        Gives the same angles as measure(), with the per-frame Python work done once over all frames.
+        """
+        pitch = np.full(len(present), np.nan)
+        yaw = np.full(len(present), np.nan)
+        frames = np.flatnonzero(present)
+        if not len(frames):
+            return pitch, yaw
+
+        image_sizes = np.asarray(image_sizes)[frames]
+        points = np.ascontiguousarray(np.asarray(landmarks)[frames][:, self.target_idxs, :2] * image_sizes[:, None, :],
+                                      dtype=np.float64)
+        rot_vecs = np.empty((len(frames), 3))
+        for i, (img_w, img_h) in enumerate(image_sizes.tolist()):
+            cam_matrix, dist_coeffs = self.get_intrinsics(img_w, img_h)
+            rot_vecs[i] = solve_pnp(self.model_points, points[i], cam_matrix, dist_coeffs).ravel()
+
+        angles = get_euler_angles(rot_vecs)
+        pitch[frames], yaw[frames] = to_head_angles(angles[:, 0], angles[:, 1])
+        return pitch, yaw
+
+    def callibrate(self, analysis):
+        direction_str, x, y = self.get_head_direction(analysis)
+        # Without a face the previous forward direction is kept
+        if x is not None and y is not None:
+            self.forward_x = x
+            self.forward_y = y
+
+    def measure(self, analysis):
+        """(pitch, yaw) head angles of a frame in degrees, (None, None) when no face was found"""
+        img_h, img_w = analysis.img_h, analysis.img_w
+        self.face_box = None
+        self.nose_2d = None
+
+        if analysis.face_found:
+            landmarks = analysis.landmarks
+            face_2d = get_image_points(landmarks, self.target_idxs, img_w, img_h)
+            self.face_box = get_face_box(landmarks, img_w, img_h)
+            self.nose_2d = get_nose_2d(landmarks, img_w, img_h)
+            x, y = self.solve_pose(face_2d, img_w, img_h)
+        else:
+            x = y = None
+
+        return x, y
+
+    def get_head_direction(self, analysis):
+        return self.get_direction(*self.measure(analysis))
 
+    def get_direction(self, x, y):
+        """Direction of the (x, y) head angles relative to the callibrated forward direction"""
         try:
             head_direction = get_direction(self.forward_x, self.forward_y, x, y, offset=self.OFFSET)
         except TypeError:
             head_direction = x = y = None
-        except UnboundLocalError:
-            head_direction = x = y = None
 
-        #? How to handle no face detected errors more elegantly
-    
         return head_direction, x, y
-        
-        
-    def run(self, image):
-        image = process_image(image)
-        head_direction, x, y = self.get_head_direction(image)
-        
-        if not (head_direction and x and y):
-            raise TypeError
-        
-        if head_direction:
-            if head_direction not in self.good_directions:
-                end_time = time.perf_counter()
-                self.d_time += end_time - self.start_time
-                self.start_time = time.perf_counter()
-
-                if self.d_time >= self.WAIT_TIME:
-                    self.play_alarm = True
-            else:
-                self.start_time = time.perf_counter()
-                self.d_time = 0.0
-                self.play_alarm = False
+
+    def update(self, head_direction, timestamp):
+        """Advance the head pose timer with one frame's direction, timestamp is the frame time in seconds"""
+        if self.start_time is None:
+            self.start_time = timestamp
+
+        if head_direction and head_direction not in self.good_directions:
+            self.d_time += timestamp - self.start_time
+            self.start_time = timestamp
+
+            if self.d_time >= self.WAIT_TIME:
+                self.play_alarm = True
         else:
-            self.start_time = time.perf_counter()
+            self.start_time = timestamp
             self.d_time = 0.0
             self.play_alarm = False
-            
-        return image, self.play_alarm
\ No newline at end of file
+
+        return self.play_alarm
+
+    def draw(self, image, rgb=False):
+        # Draw green bounding box
+        min_x, min_y, max_x, max_y = self.face_box
+        box_color = (0, 255, 0)  # Green color in BGR format
+        thickness = 2  # Line thickness
+        cv2.rectangle(image, (min_x, min_y), (max_x, max_y), box_color, thickness)
+        # Blue nose line, in the channel order of the image
+        plot_nose_line(image, self.nose_2d, self.x, self.y, (0, 0, 255) if rgb else (255, 0, 0))
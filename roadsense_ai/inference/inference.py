@@ -0,0 +1,196 @@
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ..frame_analysis import frame_analysis
+from ..landmark_provider import landmark_provider
+from ..pipeline import pipeline
+
+
+class SharedFrameRing:
+    """Frame slots in one shared memory block, mapped by both processes.
+
+    Every slot holds two planes of the frame shape: the camera frame written by the main process
+    (0) and the flipped frame written back by the worker (1), so no image is ever pickled.
+    """
+    def __init__(self, slots, shape, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        size = slots * 2 * int(np.prod(self.shape))
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.frames = np.ndarray((slots, 2) + self.shape, dtype=np.uint8, buffer=self.memory.buf)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def close(self):
+        self.frames = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # A caller still holds a frame view, the mapping goes away with it
+            pass
+        if self.owner:
+            self.memory.unlink()
+
+
+def run_worker(connection, img_w=640, img_h=480, roi=False, max_input_size=None, landmark_model=None,
+               running_mode="video", get_provider=None):
+    """Worker process: analyze and measure the frames of the ring slots named on the connection.
+
+    Requests are ("ring", name, slots, shape) to map a new ring, ("frame", slot, timestamp)
+    and None to stop.
+    """
+    ring = None
+    if get_provider is None:
+        face_mesh = landmark_provider.get_landmark_provider(landmark_model, running_mode)
+    else:
+        face_mesh = get_provider()
+    frame_analyzer = frame_analysis.FrameAnalyzer(face_mesh, roi=roi, max_input_size=max_input_size)
+    frame_analyzer.warm_up(img_w, img_h)
+    # Only measure() is used, the detector timers run in the main process
+    measuring_pipeline = pipeline.DetectionPipeline(frame_analyzer)
+    drowsiness_detector = measuring_pipeline.drowsiness_detector
+    head_pose_detector = measuring_pipeline.head_pose_detector
+    connection.send("ready")
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            if request[0] == "ring":
+                if ring is not None:
+                    ring.close()
+                ring = SharedFrameRing(request[2], request[3], request[1])
+                continue
+
+            _, slot, timestamp = request
+            start = time.perf_counter_ns()
+            analysis = frame_analyzer.analyze(ring.frames[slot, 0], timestamp, dst=ring.frames[slot, 1])
+            measurement = measuring_pipeline.measure(analysis)
+            # Everything the overlay needs, a few hundred bytes
+            connection.send((slot, measurement.to_tuple(), drowsiness_detector.eye_coordinates,
+                             head_pose_detector.face_box, head_pose_detector.nose_2d, start, time.perf_counter_ns()))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        frame_analyzer.close()
+        if ring is not None:
+            ring.close()
+
+
+class InferenceWorker:
+    """Runs the landmark model and the per-frame measurements in a separate process.
+
+    Inference and landmark post-processing no longer hold the main interpreter's GIL, which
+    is left to capture, the Tk main loop and alerts. Frames are copied once into a slot of a
+    SharedFrameRing, only the measurement and the overlay geometry come back through a pipe.
+    The ring is created for the first frame's shape and replaced if the camera resolution
+    changes, the worker process keeps running. get_provider() returns the LandmarkProvider
+    of the worker instead of the one of landmark_model, it is sent to the worker process so
+    it has to be picklable.
+    """
+    def __init__(self, stage_profiler=None, roi=False, max_input_size=None, slots=2, start_timeout=60.0,
+                 landmark_model=None, running_mode="video", get_provider=None):
+        self.profiler = stage_profiler
+        self.roi = roi
+        self.max_input_size = max_input_size
+        self.landmark_model = landmark_model
+        self.running_mode = running_mode
+        self.get_provider = get_provider
+        self.slots = slots
+        self.start_timeout = start_timeout
+        self.ring = None
+        self.process = None
+        self.connection = None
+        self.next_slot = 0
+        # The tracking thread and a callibration may both send frames
+        self.lock = threading.Lock()
+
+    def start(self, img_w=640, img_h=480):
+        """Start the worker process and wait until its model is loaded and warmed up for a frame size"""
+        self.connection, worker_connection = multiprocessing.Pipe()
+        context = multiprocessing.get_context("spawn")
+        self.process = context.Process(
+            target=run_worker, name="inference", daemon=True,
+            args=(worker_connection, img_w, img_h, self.roi, self.max_input_size, self.landmark_model,
+                  self.running_mode, self.get_provider))
+        self.process.start()
+        worker_connection.close()
+        try:
+            ready = self.connection.poll(self.start_timeout) and self.connection.recv() == "ready"
+        except EOFError:
+            # The worker exited while loading the model
+            ready = False
+        if not ready:
+            self.close()
+            raise RuntimeError("The inference worker did not start")
+
+    def restart(self):
+        """Replace a worker process that died, for frames of the last size it was sent"""
+        with self.lock:
+            shape = None if self.ring is None else self.ring.shape
+            self.close()
+            if shape is None:
+                self.start()
+            else:
+                self.start(shape[1], shape[0])
+
+    def map_ring(self, shape):
+        if self.ring is not None:
+            self.ring.close()
+        self.ring = SharedFrameRing(self.slots, shape)
+        self.connection.send(("ring", self.ring.name, self.slots, shape))
+        self.next_slot = 0
+
+    def analyze(self, frame, timestamp, detection_pipeline):
+        """Analyze and measure a camera frame in the worker, returns (analysis, measurement).
+
+        The analysis holds the flipped frame, a view into the ring that stays valid until the
+        slot is reused two frames later, and no landmarks. The detectors of detection_pipeline
+        get the overlay geometry, so process() can draw the overlay as usual.
+        """
+        with self.lock:
+            if self.process is None:
+                self.start(frame.shape[1], frame.shape[0])
+            if self.ring is None or self.ring.shape != frame.shape:
+                self.map_ring(frame.shape)
+
+            slot = self.next_slot
+            self.next_slot = (slot + 1) % self.slots
+            np.copyto(self.ring.frames[slot, 0], frame)
+            self.connection.send(("frame", slot, timestamp))
+            slot, values, eye_coordinates, face_box, nose_2d, start, end = self.connection.recv()
+        if self.profiler is not None:
+            self.profiler.record("worker", start, end)
+
+        detection_pipeline.drowsiness_detector.eye_coordinates = eye_coordinates
+        detection_pipeline.head_pose_detector.face_box = face_box
+        detection_pipeline.head_pose_detector.nose_2d = nose_2d
+        analysis = frame_analysis.FrameAnalysis(self.ring.frames[slot, 1], None, timestamp)
+        return analysis, pipeline.FrameMeasurement(*values)
+
+    def process_frame(self, frame, timestamp, detection_pipeline, annotate=True):
+        """DetectionPipeline.process_frame with the analysis done in the worker"""
+        analysis, measurement = self.analyze(frame, timestamp, detection_pipeline)
+        return detection_pipeline.process(analysis, annotate, measurement)
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(timeout=5.0)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.connection.close()
+            self.process = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
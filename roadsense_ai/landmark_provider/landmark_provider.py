@@ -0,0 +1,174 @@
+import threading
+import time
+
+import numpy as np
+
+
+RUNNING_MODES = ("video", "live_stream")
+
+
+def landmarks_to_array(landmark_list):
+    """Convert a NormalizedLandmarkList into an (N, 3) float32 array of normalized x, y, z"""
+    return np.array([(lm.x, lm.y, lm.z) for lm in landmark_list.landmark], dtype=np.float32)
+
+
+class LandmarkProvider:
+    """Finds the face landmarks of an image, the interface FrameAnalyzer runs its model through.
+
+    detect() returns an (N, 3) float32 array of x, y, z normalized to the image, or None when
+    no face was found. synchronous is False for providers whose result may belong to an
+    earlier image than the one passed in.
+    """
+    synchronous = True
+
+    def detect(self, image, timestamp=None):
+        raise NotImplementedError
+
+    def warm_up(self, image):
+        """Run the model once, so the first real frame does not pay its setup cost"""
+        self.detect(image)
+
+    def clone(self):
+        """A new provider with the same settings and its own tracking state, for face crops"""
+        raise NotImplementedError(f"{type(self).__name__} cannot run on face crops")
+
+    def close(self):
+        pass
+
+
+class FaceMeshProvider(LandmarkProvider):
+    """The legacy MediaPipe FaceMesh solution, bundled with the mediapipe package"""
+    def __init__(self, max_num_faces=1, refine_landmarks=True, min_detection_confidence=0.5,
+                 min_tracking_confidence=0.5, static_image_mode=False):
+        # mediapipe takes most of the import time of the package, only load it once a model is needed
+        import mediapipe as mp
+        self.settings = dict(max_num_faces=max_num_faces, refine_landmarks=refine_landmarks,
+                             min_detection_confidence=min_detection_confidence,
+                             min_tracking_confidence=min_tracking_confidence, static_image_mode=static_image_mode)
+        self.face_mesh = mp.solutions.face_mesh.FaceMesh(**self.settings)
+
+    def detect(self, image, timestamp=None):
+        results = self.face_mesh.process(image)
+        if not results.multi_face_landmarks:
+            return None
+        return landmarks_to_array(results.multi_face_landmarks[0])
+
+    def clone(self, **settings):
+        """A new FaceMesh with the same settings apart from the ones given"""
+        return FaceMeshProvider(**{**self.settings, **settings})
+
+    def close(self):
+        self.face_mesh.close()
+
+
+class FaceLandmarkerProvider(LandmarkProvider):
+    """The MediaPipe Tasks FaceLandmarker, loaded from a local .task model file.
+
+    In "video" mode every image is processed before detect() returns, tracking the face
+    across calls by timestamp. In "live_stream" mode images are queued to the model and
+    detect() returns the newest finished result right away, so landmarks may lag the image
+    by a frame or more while MediaPipe drops the images it cannot keep up with.
+    Timestamps are in seconds and must not go backwards.
+    """
+    def __init__(self, model_path, running_mode="video", num_faces=1, min_face_detection_confidence=0.5,
+                 min_face_presence_confidence=0.5, min_tracking_confidence=0.5):
+        if running_mode not in RUNNING_MODES:
+            raise ValueError(f"running_mode must be one of {', '.join(RUNNING_MODES)}, not {running_mode!r}")
+        import mediapipe as mp
+        from mediapipe.tasks.python import BaseOptions, vision
+        self.mp = mp
+        self.model_path = model_path
+        self.running_mode = running_mode
+        self.settings = dict(num_faces=num_faces, min_face_detection_confidence=min_face_detection_confidence,
+                             min_face_presence_confidence=min_face_presence_confidence,
+                             min_tracking_confidence=min_tracking_confidence)
+        self.synchronous = running_mode == "video"
+
+        self.lock = threading.Lock()
+        self.result = None
+        self.result_timestamp = None
+        self.last_timestamp_ms = -1
+        live_stream = running_mode == "live_stream"
+        options = vision.FaceLandmarkerOptions(
+            base_options=BaseOptions(model_asset_path=model_path),
+            running_mode=vision.RunningMode.LIVE_STREAM if live_stream else vision.RunningMode.VIDEO,
+            result_callback=self.on_result if live_stream else None,
+            **self.settings)
+        self.face_landmarker = vision.FaceLandmarker.create_from_options(options)
+
+    @staticmethod
+    def to_array(result):
+        if not result.face_landmarks:
+            return None
+        return np.array([(lm.x, lm.y, lm.z) for lm in result.face_landmarks[0]], dtype=np.float32)
+
+    def get_timestamp_ms(self, timestamp):
+        # The model rejects timestamps that do not increase, frames closer than a millisecond apart are nudged
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        timestamp_ms = max(int(timestamp * 1000), self.last_timestamp_ms + 1)
+        self.last_timestamp_ms = timestamp_ms
+        return timestamp_ms
+
+    def on_result(self, result, output_image, timestamp_ms):
+        landmarks = self.to_array(result)
+        with self.lock:
+            self.result = landmarks
+            self.result_timestamp = timestamp_ms / 1000
+
+    def detect(self, image, timestamp=None):
+        mp_image = self.mp.Image(image_format=self.mp.ImageFormat.SRGB, data=np.ascontiguousarray(image))
+        timestamp_ms = self.get_timestamp_ms(timestamp)
+        if self.synchronous:
+            return self.to_array(self.face_landmarker.detect_for_video(mp_image, timestamp_ms))
+
+        self.face_landmarker.detect_async(mp_image, timestamp_ms)
+        with self.lock:
+            return self.result
+
+    def clone(self):
+        return FaceLandmarkerProvider(self.model_path, self.running_mode, **self.settings)
+
+    def close(self):
+        self.face_landmarker.close()
+
+
+class ReplayProvider(LandmarkProvider):
+    """Recorded landmarks handed out in order, one frame per detect() call, with no model.
+
+    landmarks is an (N, 478, 3) array, present marks the frames a face was found in. The
+    images passed to detect() are ignored, they only have to match the recording's size.
+    """
+    def __init__(self, landmarks, present=None, loop=False):
+        self.landmarks = landmarks
+        self.present = np.ones(len(landmarks), dtype=bool) if present is None else present
+        self.loop = loop
+        self.index = 0
+
+    @classmethod
+    def from_cache(cls, landmark_cache, loop=False):
+        return cls(landmark_cache.landmarks, landmark_cache.present, loop)
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    def detect(self, image, timestamp=None):
+        if self.index >= len(self.landmarks):
+            if not self.loop:
+                return None
+            self.index = 0
+        index = self.index
+        self.index += 1
+        if not self.present[index]:
+            return None
+        return np.array(self.landmarks[index], dtype=np.float32)
+
+    def warm_up(self, image):
+        pass
+
+
+def get_landmark_provider(model_path=None, running_mode="video", static_image_mode=False):
+    """FaceLandmarker on the .task file at model_path when given, FaceMesh otherwise"""
+    if model_path:
+        return FaceLandmarkerProvider(model_path, running_mode)
+    return FaceMeshProvider(static_image_mode=static_image_mode)
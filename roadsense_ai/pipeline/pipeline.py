@@ -0,0 +1,192 @@
+import time
+import cv2
+import numpy as np
+
+from ..drowsiness_detection import drowsiness_detection
+from ..fatigue import fatigue
+from ..head_pose_estimation import head_pose_estimation
+from ..profiler import profiler
+
+
+class FrameMeasurement:
+    """Stateless per-frame measurements, everything the detector timers need from a frame"""
+    __slots__ = ("timestamp", "ear", "pitch", "yaw")
+
+    def __init__(self, timestamp, ear, pitch, yaw):
+        self.timestamp = timestamp
+        self.ear = ear
+        self.pitch = pitch
+        self.yaw = yaw
+
+    def to_tuple(self):
+        return self.timestamp, self.ear, self.pitch, self.yaw
+
+
+class FrameResult:
+    """Per-frame detector output"""
+    def __init__(self, timestamp, ear, pitch, yaw, direction, drowsy, head_pose, driver_not_visible,
+                 fatigued=False, perclos=None):
+        self.timestamp = timestamp
+        self.ear = ear
+        self.pitch = pitch
+        self.yaw = yaw
+        self.direction = direction
+        self.drowsy = drowsy
+        self.head_pose = head_pose
+        self.driver_not_visible = driver_not_visible
+        self.fatigued = fatigued
+        self.perclos = perclos
+
+    @property
+    def alerts(self):
+        """Active alerts, named like the keys of responses.responses"""
+        alerts = []
+        if self.drowsy:
+            alerts.append("drowsiness_detect")
+        if self.head_pose:
+            alerts.append("head_pose_detect")
+        if self.driver_not_visible:
+            alerts.append("driver_not_visible")
+        if self.fatigued:
+            alerts.append("sleep_reminder_detect")
+        return alerts
+
+    def to_dict(self):
+        return {
+            "timestamp": self.timestamp,
+            "ear": self.ear,
+            "pitch": None if self.pitch is None else float(self.pitch),
+            "yaw": None if self.yaw is None else float(self.yaw),
+            "direction": self.direction,
+            "perclos": self.perclos,
+            "alerts": self.alerts,
+        }
+
+
+class DetectionPipeline:
+    """Runs the detectors on one shared FrameAnalysis per frame, with no GUI or audio attached"""
+    EAR_THRESH = 0.24
+    DROWSINESS_WAIT_TIME = 0.9
+    HEAD_POSE_WAIT_TIME = 0.7
+    HEAD_POSE_OFFSET = 10
+    MAX_NOT_VISIBLE_FRAMES = 10
+    # How close to the alert thresholds tracked landmarks stop being trusted
+    EAR_MARGIN = 0.04
+    HEAD_POSE_MARGIN = 4
+
+    def __init__(self, frame_analyzer, stage_profiler=None):
+        self.frame_analyzer = frame_analyzer
+        self.profiler = stage_profiler or profiler.StageProfiler(enabled=False)
+        self.drowsiness_detector = drowsiness_detection.DrowsinessDetector()
+        self.head_pose_detector = head_pose_estimation.HeadPoseEstimator()
+        self.fatigue_monitor = fatigue.FatigueMonitor()
+
+        self.drowsiness_detector.EAR_THRESH = DetectionPipeline.EAR_THRESH
+        self.drowsiness_detector.WAIT_TIME = DetectionPipeline.DROWSINESS_WAIT_TIME
+        self.head_pose_detector.WAIT_TIME = DetectionPipeline.HEAD_POSE_WAIT_TIME
+        self.head_pose_detector.OFFSET = DetectionPipeline.HEAD_POSE_OFFSET
+
+        self.overlay = None
+        # capture.FramePool the overlays are drawn into, when their consumer hands them back
+        self.overlay_pool = None
+        self.not_visible_counter = 0
+        self.driver_not_visible = False
+
+    def process_frame(self, frame, timestamp=None, annotate=True):
+        analysis, measurement = self.analyze_frame(frame, timestamp)
+        return self.process(analysis, annotate, measurement)
+
+    def analyze_frame(self, frame, timestamp=None):
+        """Analyze and measure one camera frame, returns (analysis, measurement)"""
+        analysis = self.frame_analyzer.analyze(frame, timestamp)
+        measurement = self.measure(analysis)
+        # Tracked landmarks are only trusted away from the alert thresholds
+        if not analysis.keyframe and self.near_threshold(measurement):
+            analysis = self.frame_analyzer.refine(analysis)
+            measurement = self.measure(analysis)
+        self.frame_analyzer.observe(self.near_threshold(measurement))
+        return analysis, measurement
+
+    def near_threshold(self, measurement):
+        """Whether a frame's EAR or head angles are within the margins of an alert threshold"""
+        if measurement.ear is not None and measurement.ear < self.drowsiness_detector.EAR_THRESH + self.EAR_MARGIN:
+            return True
+        if measurement.pitch is None or measurement.yaw is None:
+            return False
+        head_pose_detector = self.head_pose_detector
+        deviation = max(abs(measurement.pitch - head_pose_detector.forward_x),
+                        abs(measurement.yaw - head_pose_detector.forward_y))
+        return deviation > head_pose_detector.OFFSET - self.HEAD_POSE_MARGIN
+
+    def process(self, analysis, annotate=True, measurement=None):
+        """Run every detector on the analysis, with annotate the annotated RGB frame is kept in overlay"""
+        if measurement is None:
+            measurement = self.measure(analysis)
+        result = self.update(measurement)
+
+        if annotate:
+            start = time.perf_counter_ns()
+            self.overlay = self.render_overlay(analysis, result)
+            self.profiler.record("overlay", start)
+
+        return result
+
+    def render_overlay(self, analysis, result):
+        """Draw every detector's annotations onto one copy of the frame, in RGB for display"""
+        # The color conversion is the only full-frame pass and makes the copy the drawing goes to
+        dst = None if self.overlay_pool is None else self.overlay_pool.acquire()
+        start = time.perf_counter_ns()
+        overlay = cv2.cvtColor(analysis.image, cv2.COLOR_BGR2RGB, dst)
+        self.profiler.record("cvtcolor", start)
+        self.drowsiness_detector.draw(overlay, rgb=True)
+        if result.direction is not None:
+            self.head_pose_detector.draw(overlay, rgb=True)
+        return overlay
+
+    def measure(self, analysis):
+        """The stateless half of process(), safe to run out of order or in another process"""
+        start = time.perf_counter_ns()
+        ear = self.drowsiness_detector.measure(analysis)
+        start = self.profiler.record("ear", start)
+        pitch, yaw = self.head_pose_detector.measure(analysis)
+        self.profiler.record("head_pose", start)
+        return FrameMeasurement(analysis.timestamp, ear, pitch, yaw)
+
+    def update(self, measurement):
+        """The stateful half of process(), measurements must be fed in frame order"""
+        drowsiness_detector = self.drowsiness_detector
+        drowsiness_detector.ear = measurement.ear
+        drowsy = drowsiness_detector.update(measurement.ear, measurement.timestamp)
+
+        head_pose_detector = self.head_pose_detector
+        head_direction, x, y = head_pose_detector.get_direction(measurement.pitch, measurement.yaw)
+        head_pose_detector.head_direction, head_pose_detector.x, head_pose_detector.y = head_direction, x, y
+
+        # No face, or no usable angles: leave the head pose timer untouched and count the frame
+        if head_direction and x and y:
+            head_pose_detector.update(head_direction, measurement.timestamp)
+            self.not_visible_counter = 0
+            self.driver_not_visible = False
+
+        else:
+            head_pose_detector.head_direction = None
+            self.not_visible_counter += 1
+            if self.not_visible_counter >= self.MAX_NOT_VISIBLE_FRAMES:
+                self.driver_not_visible = True
+
+        fatigue_monitor = self.fatigue_monitor
+        fatigued = fatigue_monitor.update(measurement.timestamp, measurement.ear, measurement.pitch,
+                                          measurement.yaw, drowsiness_detector.EAR_THRESH)
+
+        return FrameResult(
+            measurement.timestamp, measurement.ear,
+            head_pose_detector.x, head_pose_detector.y, head_pose_detector.head_direction,
+            drowsy, head_pose_detector.play_alarm, self.driver_not_visible,
+            fatigued, fatigue_monitor.perclos)
+
+    def callibrate(self, frame, timestamp=None):
+        # Flipped into its own array, the tracking thread may be analysing a frame meanwhile
+        analysis = self.frame_analyzer.analyze(frame, timestamp, dst=np.empty_like(frame))
+        if not analysis.keyframe:
+            analysis = self.frame_analyzer.refine(analysis)
+        self.head_pose_detector.callibrate(analysis)
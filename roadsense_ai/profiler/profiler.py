@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class StageBuffer:
+    """Ring buffer of (start, duration) nanosecond pairs for one stage"""
+    def __init__(self, capacity):
+        self.starts = np.zeros(capacity, dtype=np.int64)
+        self.durations = np.zeros(capacity, dtype=np.int64)
+        self.count = 0
+        self.thread_id = threading.get_ident()
+        # A stage can be recorded from several threads while another one reads it
+        self.lock = threading.Lock()
+
+    def add(self, start_ns, duration_ns):
+        with self.lock:
+            index = self.count % len(self.starts)
+            self.starts[index] = start_ns
+            self.durations[index] = duration_ns
+            self.count += 1
+
+    def snapshot(self):
+        """(starts, durations) of the buffered samples in recording order"""
+        with self.lock:
+            capacity = len(self.starts)
+            if self.count <= capacity:
+                return self.starts[:self.count].copy(), self.durations[:self.count].copy()
+            index = self.count % capacity
+            order = np.r_[index:capacity, 0:index]
+            return self.starts[order], self.durations[order]
+
+
+def get_stats(stage, buffer):
+    """Latency percentiles of a StageBuffer in milliseconds, and its rate in runs per second"""
+    starts, durations = buffer.snapshot()
+    p50, p95, p99 = np.percentile(durations, (50, 95, 99)) / 1e6
+    span = (starts[-1] - starts[0]) / 1e9
+    return {
+        "stage": stage,
+        "count": len(durations),
+        "mean_ms": float(durations.mean() / 1e6),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "fps": (len(starts) - 1) / span if span > 0 else 0.0,
+    }
+
+
+class StageProfiler:
+    """Low-overhead per-stage latency recorder.
+
+    Hot code takes a time.perf_counter_ns() stamp before a stage and calls record() after it.
+    Only the last `capacity` samples of each stage are kept, so memory use is fixed. Stages are
+    recorded from several threads and first appear at any time, readers iterate over a copy of
+    the stage dict.
+    """
+    def __init__(self, capacity=2048, enabled=True):
+        self.capacity = capacity
+        self.enabled = enabled
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, start_ns, end_ns=None):
+        """Record one run of a stage, returns its end stamp so consecutive stages can chain"""
+        if end_ns is None:
+            end_ns = time.perf_counter_ns()
+        if self.enabled:
+            buffer = self.stages.get(stage)
+            if buffer is None:
+                buffer = self.add_stage(stage)
+            buffer.add(start_ns, end_ns - start_ns)
+        return end_ns
+
+    def add_stage(self, stage):
+        """The buffer of a stage, created by the first thread to record it"""
+        with self.lock:
+            buffer = self.stages.get(stage)
+            if buffer is None:
+                buffer = self.stages[stage] = StageBuffer(self.capacity)
+            return buffer
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def stats(self, stage):
+        """Latency percentiles of a stage in milliseconds, and its rate in runs per second"""
+        return get_stats(stage, self.stages[stage])
+
+    def fps(self, stage="frame"):
+        buffer = self.stages.get(stage)
+        return get_stats(stage, buffer)["fps"] if buffer is not None and buffer.count else 0.0
+
+    def report(self):
+        lines = [f"{'stage':<12}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'fps':>10}"]
+        for stage, buffer in list(self.stages.items()):
+            if not buffer.count:
+                # Added by another thread that did not record its first sample yet
+                continue
+            stats = get_stats(stage, buffer)
+            lines.append(f"{stage:<12}{stats['count']:>8}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+                         f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['fps']:>10.1f}")
+        return "\n".join(lines)
+
+    def export_csv(self, path):
+        """Write every buffered sample as stage, start_ns, duration_ns rows"""
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["stage", "start_ns", "duration_ns"])
+            for stage, buffer in list(self.stages.items()):
+                starts, durations = buffer.snapshot()
+                writer.writerows((stage, start, duration) for start, duration in zip(starts.tolist(), durations.tolist()))
+
+    def export_chrome_trace(self, path):
+        """Write the buffered samples in the Chrome trace event format (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        events = []
+        for stage, buffer in list(self.stages.items()):
+            starts, durations = buffer.snapshot()
+            events += [{"name": stage, "ph": "X", "ts": start / 1e3, "dur": duration / 1e3, "pid": pid, "tid": buffer.thread_id}
+                       for start, duration in zip(starts.tolist(), durations.tolist())]
+        events.sort(key=lambda event: event["ts"])
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
@@ -0,0 +1,229 @@
+import collections
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from ..landmark_provider import landmark_provider
+from ..tracking import tracking
+
+
+class QualityLevel:
+    """Settings of one step of the quality ladder, None keeps the pipeline's configured value.
+
+    overlay_interval draws the tracking overlay on every n-th frame only, max_input_size caps
+    the landmark model input, keyframe_interval runs the model on every n-th frame only and
+    refine_landmarks False swaps FaceMesh for its cheaper variant without the refined eye
+    and iris landmarks.
+    """
+    __slots__ = ("name", "overlay_interval", "max_input_size", "keyframe_interval", "refine_landmarks")
+
+    def __init__(self, name, overlay_interval=1, max_input_size=None, keyframe_interval=None, refine_landmarks=True):
+        self.name = name
+        self.overlay_interval = overlay_interval
+        self.max_input_size = max_input_size
+        self.keyframe_interval = keyframe_interval
+        self.refine_landmarks = refine_landmarks
+
+
+# Cheapest last. The knobs that leave the alert signals untouched come first: the overlay,
+# then the input size. Keyframes still run the model on every frame near an alert threshold,
+# and the unrefined eye landmarks, which move the EAR, are the last resort.
+LEVELS = (
+    QualityLevel("full"),
+    QualityLevel("overlay_half", overlay_interval=2),
+    QualityLevel("input_640", overlay_interval=2, max_input_size=640),
+    QualityLevel("input_480", overlay_interval=3, max_input_size=480),
+    QualityLevel("keyframes_3", overlay_interval=3, max_input_size=480, keyframe_interval=3),
+    QualityLevel("no_refine", overlay_interval=4, max_input_size=480, keyframe_interval=3, refine_landmarks=False),
+)
+
+
+class OtherCpuLoad:
+    """Load of the other processes per CPU, None where the OS does not report a load average.
+
+    The system load average of the last minute counts this process's own threads as well,
+    which alone can keep a one- or two-core host looking saturated. Their CPU use, averaged
+    over the same minute, is taken off.
+    """
+    def __init__(self, period=60.0, clock=time.monotonic):
+        self.period = period
+        self.clock = clock
+        self.own_load = None
+        self.last_time = clock()
+        self.last_cpu = self.get_cpu_time()
+
+    @staticmethod
+    def get_cpu_time():
+        times = os.times()
+        return times.user + times.system
+
+    def __call__(self):
+        try:
+            load = os.getloadavg()[0]
+        except (AttributeError, OSError):
+            return None
+
+        now, cpu = self.clock(), self.get_cpu_time()
+        if now > self.last_time:
+            usage = (cpu - self.last_cpu) / (now - self.last_time)
+            if self.own_load is None:
+                self.own_load = usage
+            else:
+                # Exponential moving average like the kernel's, over irregular intervals
+                decay = math.exp(-(now - self.last_time) / self.period)
+                self.own_load = usage + (self.own_load - usage) * decay
+            self.last_time, self.last_cpu = now, cpu
+        return max(0.0, load - (self.own_load or 0.0)) / (os.cpu_count() or 1)
+
+def cheapest_size(*sizes):
+    sizes = [size for size in sizes if size]
+    return min(sizes) if sizes else None
+
+def cheapest_interval(*intervals):
+    intervals = [interval for interval in intervals if interval]
+    return max(intervals) if intervals else None
+
+
+class QosGovernor:
+    """Steps a DetectionPipeline along LEVELS to hold a per-frame latency budget in seconds.
+
+    observe() takes each frame's processing time from the tracking thread and applies level
+    changes there, between frames. Once a window of frames at the current level has its
+    percentile latency over the budget, the governor steps one level down. It steps back up
+    when the latency stayed below headroom times the budget and the other processes do not
+    load the CPUs over cpu_limit, so a busy host does not bounce between levels. Settings the pipeline was
+    configured with (max_input_size, keyframes) are only ever made cheaper. The FaceMesh
+    variant without refined landmarks is loaded in the background from the start, a level
+    that asks for it before it is ready keeps the current model until then.
+    """
+    def __init__(self, detection_pipeline, budget=0.033, levels=LEVELS, window=30, percentile=90,
+                 headroom=0.6, cpu_limit=0.9, cpu_load=None):
+        self.pipeline = detection_pipeline
+        self.budget = budget
+        self.levels = levels
+        self.window = window
+        self.percentile = percentile
+        self.headroom = headroom
+        self.cpu_limit = cpu_limit
+        self.cpu_load = cpu_load or OtherCpuLoad()
+
+        frame_analyzer = detection_pipeline.frame_analyzer
+        self.keyframe_analyzer = None
+        self.configured_interval = None
+        if isinstance(frame_analyzer, tracking.KeyframeAnalyzer):
+            self.keyframe_analyzer = frame_analyzer
+            self.configured_interval = frame_analyzer.keyframe_interval
+            frame_analyzer = frame_analyzer.frame_analyzer
+        self.frame_analyzer = frame_analyzer
+        self.configured_size = frame_analyzer.max_input_size
+        # (provider, roi_provider) per refine_landmarks
+        self.providers = {True: (frame_analyzer.provider, frame_analyzer.roi_provider)}
+        # Loading a model stalls for hundreds of ms, which the tracking thread of an overloaded
+        # host cannot afford when it steps down
+        self.loader = None
+        if not all(level.refine_landmarks for level in levels):
+            self.loader = threading.Thread(target=self.load_variant, args=(False,), name="qos-loader", daemon=True)
+            self.loader.start()
+
+        self.latencies = collections.deque(maxlen=window)
+        self.index = 0
+        self.frame_count = 0
+        self.changes = 0
+        self.frames_at_level = [0] * len(levels)
+
+    @property
+    def level(self):
+        return self.levels[self.index]
+
+    def load_variant(self, refine):
+        provider, roi_provider = self.providers[True]
+        if not isinstance(provider, landmark_provider.FaceMeshProvider) or provider.settings["refine_landmarks"] == refine:
+            # Only FaceMesh comes in two variants
+            self.providers[refine] = self.providers[True]
+            return
+
+        variant = (provider.clone(refine_landmarks=refine),
+                   None if roi_provider is None else roi_provider.clone(refine_landmarks=refine))
+        blank = np.zeros((480, 640, 3), dtype=np.uint8)
+        for variant_provider in variant:
+            if variant_provider is not None:
+                variant_provider.warm_up(blank)
+        self.providers[refine] = variant
+
+    def render_overlay(self):
+        """Whether this frame gets the tracking overlay, ask once per frame before processing it"""
+        return self.frame_count % self.level.overlay_interval == 0
+
+    def observe(self, latency):
+        """Record one frame's processing time in seconds, possibly switching the level for the next frame"""
+        self.frame_count += 1
+        self.frames_at_level[self.index] += 1
+        self.latencies.append(latency)
+        # Picks up a variant that finished loading after its level was set
+        self.use_variant(self.level.refine_landmarks)
+        if len(self.latencies) < self.window:
+            return
+
+        latency = np.percentile(self.latencies, self.percentile)
+        if latency > self.budget and self.index < len(self.levels) - 1:
+            self.set_level(self.index + 1)
+        elif latency < self.budget * self.headroom and self.index > 0:
+            load = self.cpu_load()
+            if load is None or load < self.cpu_limit:
+                self.set_level(self.index - 1)
+
+    def set_level(self, index):
+        self.index = index
+        self.changes += 1
+        # The next decision only looks at frames run at the new level
+        self.latencies.clear()
+        self.apply(self.levels[index])
+
+    def apply(self, level):
+        frame_analyzer = self.frame_analyzer
+        frame_analyzer.max_input_size = cheapest_size(self.configured_size, level.max_input_size)
+
+        self.use_variant(level.refine_landmarks)
+
+        interval = cheapest_interval(self.configured_interval, level.keyframe_interval)
+        if interval is None:
+            self.pipeline.frame_analyzer = frame_analyzer
+        else:
+            if self.keyframe_analyzer is None:
+                self.keyframe_analyzer = tracking.use_keyframes(self.pipeline, interval)
+            elif self.pipeline.frame_analyzer is not self.keyframe_analyzer:
+                self.keyframe_analyzer.reset()
+                self.pipeline.frame_analyzer = self.keyframe_analyzer
+            self.keyframe_analyzer.keyframe_interval = interval
+
+    def use_variant(self, refine):
+        """Run the model variant for refine_landmarks once it is loaded"""
+        variant = self.providers.get(refine)
+        frame_analyzer = self.frame_analyzer
+        if variant is not None and variant[0] is not frame_analyzer.provider:
+            frame_analyzer.provider, frame_analyzer.roi_provider = variant
+            # The crop belongs to the other model's tracking state
+            frame_analyzer.crop = None
+
+    def report(self):
+        level = self.level
+        latency = np.percentile(self.latencies, self.percentile) * 1e3 if self.latencies else float("nan")
+        load = self.cpu_load()
+        return (f"Quality level {self.index}/{len(self.levels) - 1} {level.name}: p{self.percentile} "
+                f"{latency:.1f} ms of a {self.budget * 1e3:.0f} ms budget"
+                + ("" if load is None else f", other CPU load {load:.2f}")
+                + f", {self.changes} changes")
+
+    def close(self):
+        """Close the model variants the governor loaded itself, putting the configured models back"""
+        if self.loader is not None:
+            self.loader.join()
+        self.use_variant(True)
+        for refine, providers in self.providers.items():
+            if refine is not True and providers is not self.providers[True]:
+                for provider in providers:
+                    if provider is not None:
+                        provider.close()
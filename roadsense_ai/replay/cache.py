@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import shutil
+from importlib import metadata
+
+import numpy as np
+
+from ..frame_analysis import frame_analysis
+
+
+# Version 2 records the landmark count, 478 with refined eyes and irises and 468 without
+CACHE_VERSION = 2
+CHUNK_SIZE = 1 << 20
+
+
+def get_cache_dir():
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "roadsense_ai", "landmarks")
+
+def hash_source(source):
+    """sha1 of a video file's content, or of the names and content of a directory's images"""
+    digest = hashlib.sha1()
+    if os.path.isdir(source):
+        from . import replay
+        paths = [os.path.join(source, name) for name in replay.list_images(source)]
+    else:
+        paths = [source]
+
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+        with open(path, "rb") as source_file:
+            while chunk := source_file.read(CHUNK_SIZE):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def get_model_version():
+    try:
+        return metadata.version("mediapipe")
+    except metadata.PackageNotFoundError:
+        return None
+
+def get_cache_key(source, fps=None, static_image_mode=False, roi=False, max_input_size=None, dtype=np.float32):
+    """Cache entry name of a recording analysed with the given model settings"""
+    settings = {
+        "version": CACHE_VERSION,
+        "model": get_model_version(),
+        "fps": fps,
+        "static_image_mode": static_image_mode,
+        "roi": roi,
+        "max_input_size": max_input_size,
+        "dtype": np.dtype(dtype).name,
+    }
+    settings_key = hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{hash_source(source)}-{settings_key}"
+
+
+class LandmarkCache:
+    """Landmarks of one analysed recording, memory-mapped from a cache entry.
+
+    An entry is a directory of raw little-endian arrays described by meta.json:
+    landmarks (frames, landmarks, 3) of normalized x, y, z in float16 or float32, a present mask
+    that is False for frames without a face, and the timestamp and image size of every frame.
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            self.meta = json.load(meta_file)
+        frames = self.meta["frames"]
+        shape = (frames, self.meta["landmarks"], 3)
+
+        def load(name, dtype, shape):
+            if not np.prod(shape):
+                return np.zeros(shape, dtype=dtype)
+            return np.memmap(os.path.join(path, name), dtype=dtype, mode="r", shape=shape)
+
+        self.landmarks = load("landmarks.bin", np.dtype(self.meta["dtype"]).newbyteorder("<"), shape)
+        self.present = load("present.bin", np.bool_, (frames,))
+        self.timestamps = load("timestamps.bin", np.dtype("<f8"), (frames,))
+        self.image_sizes = load("image_sizes.bin", np.dtype("<i4"), (frames, 2))
+
+    def __len__(self):
+        return self.meta["frames"]
+
+    def iter_analyses(self, start=0, stop=None):
+        """Yield a FrameAnalysis without an image per cached frame"""
+        for index in range(start, len(self) if stop is None else min(stop, len(self))):
+            landmarks = self.landmarks[index].astype(np.float32) if self.present[index] else None
+            yield frame_analysis.FrameAnalysis(None, landmarks, float(self.timestamps[index]),
+                                               image_size=tuple(int(size) for size in self.image_sizes[index]))
+
+def open_cache(path):
+    """The LandmarkCache at path, None when there is no complete entry"""
+    try:
+        return LandmarkCache(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class LandmarkCacheWriter:
+    """Appends analysed frames to a new cache entry, which only appears at path once closed.
+
+    The landmark count is taken from the first frame with a face, a frame with another count
+    raises ValueError.
+    """
+    def __init__(self, path, dtype=np.float32):
+        self.path = path
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.temp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(self.temp_path, exist_ok=True)
+        self.files = {name: open(os.path.join(self.temp_path, name), "wb")
+                      for name in ("landmarks.bin", "present.bin", "timestamps.bin", "image_sizes.bin")}
+        self.frames = 0
+        self.num_landmarks = None
+        # Frames without a face before the landmark count is known
+        self.missing = 0
+        self.empty = None
+
+    def write(self, analysis):
+        landmarks = analysis.landmarks
+        if landmarks is not None and self.num_landmarks is None:
+            self.num_landmarks = len(landmarks)
+            self.empty = np.zeros((self.num_landmarks, 3), dtype=self.dtype)
+            self.files["landmarks.bin"].write(self.empty.tobytes() * self.missing)
+        elif landmarks is not None and len(landmarks) != self.num_landmarks:
+            raise ValueError(f"{len(landmarks)} landmarks in a cache entry of {self.num_landmarks}")
+
+        if landmarks is not None:
+            self.files["landmarks.bin"].write(landmarks.astype(self.dtype, copy=False).tobytes())
+        elif self.empty is not None:
+            self.files["landmarks.bin"].write(self.empty.tobytes())
+        else:
+            self.missing += 1
+        self.files["present.bin"].write(bytes((analysis.face_found,)))
+        self.files["timestamps.bin"].write(np.array(analysis.timestamp, dtype="<f8").tobytes())
+        self.files["image_sizes.bin"].write(np.array((analysis.img_w, analysis.img_h), dtype="<i4").tobytes())
+        self.frames += 1
+
+    def close(self):
+        for entry_file in self.files.values():
+            entry_file.close()
+        with open(os.path.join(self.temp_path, "meta.json"), "w") as meta_file:
+            json.dump({"version": CACHE_VERSION, "frames": self.frames, "landmarks": self.num_landmarks or 0,
+                       "dtype": self.dtype.name}, meta_file)
+        # Another run may have filled the same entry meanwhile, both are equally good
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        for entry_file in self.files.values():
+            entry_file.close()
+        shutil.rmtree(self.temp_path, ignore_errors=True)
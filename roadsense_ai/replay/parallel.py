@@ -0,0 +1,43 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from ..pipeline import pipeline
+from . import replay
+
+
+def measure_segment(source, start, stop, fps=None, max_input_size=None, camera_calibration=None, get_provider=None):
+    """Measure frames [start, stop) of a source in a worker process, as plain tuples"""
+    # The landmark model runs in static image mode: with face tracking (or a face ROI) its output
+    # would depend on the frames before the segment, which this worker never sees.
+    provider = None if get_provider is None else get_provider(start, stop)
+    measurements = replay.measure_frames(source, fps, start, stop, static_image_mode=True, max_input_size=max_input_size,
+                                         camera_calibration=camera_calibration, provider=provider)
+    return [measurement.to_tuple() for measurement in measurements]
+
+def get_segments(frame_count, segment_frames):
+    """[start, stop) frame ranges covering a source, the last one open-ended as frame counts are estimates"""
+    starts = list(range(0, max(frame_count, 1), segment_frames))
+    return [(start, stop) for start, stop in zip(starts, starts[1:] + [None])]
+
+def measure_frames_parallel(source, workers=None, segment_seconds=60.0, fps=None, max_input_size=None,
+                            camera_calibration=None, get_provider=None):
+    """Yield the FrameMeasurements of a source in frame order, analysing segments in worker processes.
+
+    Only the stateless measurements are computed in the workers. The detector timers are run
+    afterwards over the stitched stream in the calling process, so d_time carries across segment
+    boundaries and the timeline is identical to a serial run in static image mode.
+    get_provider(start, stop) returns the LandmarkProvider of a segment instead of a static image
+    FaceMesh, it is sent to the workers so it has to be picklable.
+    """
+    workers = workers or os.cpu_count()
+    frame_count, source_fps = replay.get_frame_info(source, fps)
+    segments = get_segments(frame_count, max(1, int(segment_seconds * source_fps)))
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(measure_segment, source, start, stop, fps, max_input_size,
+                                   camera_calibration, get_provider) for start, stop in segments]
+        for future in futures:
+            for row in future.result():
+                yield pipeline.FrameMeasurement(*row)
@@ -0,0 +1,337 @@
+import json
+import math
+import os
+import time
+import cv2
+import numpy as np
+
+from ..drowsiness_detection import drowsiness_detection
+from ..frame_analysis import frame_analysis
+from ..head_pose_estimation import head_pose_estimation
+from ..landmark_provider import landmark_provider
+from ..pipeline import pipeline
+from ..profiler import profiler
+from ..tracking import tracking
+from . import cache
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+DEFAULT_FPS = 30.0
+
+
+def iter_video_frames(path, start=0, stop=None):
+    """Yield (timestamp, frame) for frames [start, stop) of a video file, timestamps in seconds from the start"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video {path!r}")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    index = start
+    try:
+        while stop is None or index < stop:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            # Prefer the container timestamp, fall back to the nominal frame rate
+            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if timestamp <= 0.0 and index:
+                timestamp = index / fps
+            yield timestamp, frame
+            index += 1
+    finally:
+        cap.release()
+
+def list_images(directory):
+    return sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+def iter_image_frames(directory, fps=DEFAULT_FPS, start=0, stop=None):
+    """Yield (timestamp, frame) for images [start, stop) of a directory in file name order"""
+    names = list_images(directory)
+    for index in range(start, len(names) if stop is None else min(stop, len(names))):
+        frame = cv2.imread(os.path.join(directory, names[index]))
+        if frame is not None:
+            yield index / fps, frame
+
+def iter_frames(source, fps=None, start=0, stop=None):
+    if os.path.isdir(source):
+        return iter_image_frames(source, fps or DEFAULT_FPS, start, stop)
+    return iter_video_frames(source, start, stop)
+
+def get_frame_info(source, fps=None):
+    """(frame count, frames per second) of a source, the count of a video is the container's estimate"""
+    if os.path.isdir(source):
+        return len(list_images(source)), fps or DEFAULT_FPS
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video {source!r}")
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    finally:
+        cap.release()
+
+
+def measure_frames(source, fps=None, start=0, stop=None, static_image_mode=False, stage_profiler=None,
+                   roi=False, max_input_size=None, keyframe_interval=None, forward=None, callibrate=False,
+                   settings=None, cache_writer=None, camera_calibration=None, landmark_model=None,
+                   provider=None):
+    """Yield a FrameMeasurement per frame, running the landmark model once per frame.
+
+    With keyframe_interval set, the model runs on keyframes only and landmarks are tracked in
+    between. Tracking falls back to the model near the alert thresholds, so forward, callibrate
+    and settings should match the ones the timeline is written with. Each frame's landmarks are
+    also written to cache_writer when given. camera_calibration is an OpenCV calibration file.
+    landmark_model is a MediaPipe Tasks .task file to find the landmarks with instead of FaceMesh.
+    provider is a LandmarkProvider to use instead, such as a ReplayProvider of recorded landmarks.
+    """
+    stage_profiler = stage_profiler or profiler.StageProfiler(enabled=False)
+    if provider is None:
+        provider = landmark_provider.get_landmark_provider(landmark_model, static_image_mode=static_image_mode)
+    frame_analyzer = frame_analysis.FrameAnalyzer(provider, stage_profiler, roi=roi, max_input_size=max_input_size)
+    detection_pipeline = pipeline.DetectionPipeline(frame_analyzer, stage_profiler)
+    apply_settings(detection_pipeline, settings or {})
+    head_pose_detector = detection_pipeline.head_pose_detector
+    if forward is not None:
+        head_pose_detector.forward_x, head_pose_detector.forward_y = forward
+    if camera_calibration:
+        head_pose_detector.load_calibration(camera_calibration)
+    if keyframe_interval:
+        tracking.use_keyframes(detection_pipeline, keyframe_interval)
+
+    frames = iter_frames(source, fps, start, stop)
+    try:
+        while True:
+            frame_start = time.perf_counter_ns()
+            timestamp, frame = next(frames, (None, None))
+            if frame is None:
+                break
+            stage_profiler.record("capture", frame_start)
+
+            analysis, measurement = detection_pipeline.analyze_frame(frame, timestamp)
+            if cache_writer is not None:
+                cache_writer.write(analysis)
+            if callibrate and measurement.pitch is not None:
+                head_pose_detector.forward_x, head_pose_detector.forward_y = measurement.pitch, measurement.yaw
+                callibrate = False
+            stage_profiler.record("frame", frame_start)
+            yield measurement
+    finally:
+        frame_analyzer.close()
+
+
+def measure_cached_frames(landmark_cache, stage_profiler=None, start=0, stop=None, camera_calibration=None):
+    """Yield a FrameMeasurement per frame of a LandmarkCache, with no decoding or landmark model"""
+    stage_profiler = stage_profiler or profiler.StageProfiler(enabled=False)
+    drowsiness_detector = drowsiness_detection.DrowsinessDetector()
+    head_pose_detector = head_pose_estimation.HeadPoseEstimator()
+    if camera_calibration:
+        head_pose_detector.load_calibration(camera_calibration)
+
+    # Head poses are solved for the whole range at once
+    stop = len(landmark_cache) if stop is None else min(stop, len(landmark_cache))
+    pose_start = time.perf_counter_ns()
+    pitch, yaw = head_pose_detector.measure_batch(landmark_cache.landmarks[start:stop], landmark_cache.present[start:stop],
+                                                  landmark_cache.image_sizes[start:stop])
+    stage_profiler.record("head_pose", pose_start)
+
+    for analysis, x, y in zip(landmark_cache.iter_analyses(start, stop), pitch.tolist(), yaw.tolist()):
+        ear_start = time.perf_counter_ns()
+        ear = drowsiness_detector.measure(analysis)
+        stage_profiler.record("ear", ear_start)
+        yield pipeline.FrameMeasurement(analysis.timestamp, ear, None if math.isnan(x) else x, None if math.isnan(y) else y)
+
+def measure_frames_cached(source, fps=None, static_image_mode=False, stage_profiler=None, roi=False,
+                          max_input_size=None, cache_dir=None, dtype=np.float32, camera_calibration=None):
+    """Like measure_frames, but reading the landmarks back when the recording was analysed before.
+
+    Cache entries are keyed by the recording's content and the landmark model settings, the
+    detector thresholds are not part of the key. A run that stops early leaves no entry behind.
+    """
+    path = os.path.join(cache_dir or cache.get_cache_dir(), cache.get_cache_key(
+        source, fps, static_image_mode, roi, max_input_size, dtype))
+    landmark_cache = cache.open_cache(path)
+    if landmark_cache is not None:
+        yield from measure_cached_frames(landmark_cache, stage_profiler, camera_calibration=camera_calibration)
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cache_writer = cache.LandmarkCacheWriter(path, dtype)
+    try:
+        yield from measure_frames(source, fps, static_image_mode=static_image_mode, stage_profiler=stage_profiler,
+                                  roi=roi, max_input_size=max_input_size, cache_writer=cache_writer,
+                                  camera_calibration=camera_calibration)
+    except BaseException:
+        cache_writer.abort()
+        raise
+    cache_writer.close()
+
+
+def get_events(previous_alerts, alerts):
+    """Alert state changes between two consecutive frames"""
+    events = [{"type": alert, "state": "start"} for alert in alerts if alert not in previous_alerts]
+    events += [{"type": alert, "state": "end"} for alert in previous_alerts if alert not in alerts]
+    return events
+
+
+class TimelineWriter:
+    """Runs the detector timers over measurements fed in frame order and writes a JSONL timeline.
+
+    forward is the callibrated (pitch, yaw) of the driver looking ahead. With callibrate set,
+    the first frame with a face is used as the forward direction instead.
+    """
+    def __init__(self, output, forward=None, callibrate=False, settings=None):
+        self.detection_pipeline = pipeline.DetectionPipeline(None)
+        apply_settings(self.detection_pipeline, settings or {})
+        self.head_pose_detector = self.detection_pipeline.head_pose_detector
+        if forward is not None:
+            self.head_pose_detector.forward_x, self.head_pose_detector.forward_y = forward
+        self.callibrate = callibrate
+
+        self.frame_count = 0
+        self.event_count = 0
+        self.previous_alerts = []
+        self.timeline = open(output, "w")
+
+    def write(self, measurement):
+        """Advance the timers with one measurement and write its record"""
+        if self.callibrate and measurement.pitch is not None:
+            self.head_pose_detector.forward_x, self.head_pose_detector.forward_y = measurement.pitch, measurement.yaw
+            self.callibrate = False
+
+        result = self.detection_pipeline.update(measurement)
+        record = {"frame": self.frame_count, **result.to_dict()}
+        record["events"] = get_events(self.previous_alerts, record["alerts"])
+        self.timeline.write(json.dumps(record) + "\n")
+
+        self.previous_alerts = record["alerts"]
+        self.event_count += len(record["events"])
+        self.frame_count += 1
+        return record
+
+    def close(self):
+        self.timeline.close()
+
+
+def write_timeline(measurements, output, forward=None, callibrate=False, settings=None):
+    """Run the detector timers over a stream of measurements in frame order and write a JSONL timeline"""
+    start_time = time.perf_counter()
+    writer = TimelineWriter(output, forward, callibrate, settings)
+    try:
+        for measurement in measurements:
+            writer.write(measurement)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start_time
+    return {"frames": writer.frame_count, "events": writer.event_count, "seconds": elapsed,
+            "fps": writer.frame_count / elapsed if elapsed else 0.0}
+
+def replay(source, output, fps=None, forward=None, callibrate=False, settings=None):
+    """Run the detection pipeline over a recording as fast as possible and write a JSONL timeline"""
+    return write_timeline(measure_frames(source, fps), output, forward, callibrate, settings)
+
+
+def apply_settings(detection_pipeline, settings):
+    """Apply detector settings given with the same names as the settings window variables"""
+    if "ear_thresh" in settings:
+        detection_pipeline.drowsiness_detector.update_ear_thresh(settings["ear_thresh"])
+    if "drowsiness_wait_time" in settings:
+        detection_pipeline.drowsiness_detector.update_wait_time(settings["drowsiness_wait_time"])
+    if "head_pose_wait_time" in settings:
+        detection_pipeline.head_pose_detector.update_wait_time(settings["head_pose_wait_time"])
+    if "head_pose_offset" in settings:
+        detection_pipeline.head_pose_detector.update_offset(settings["head_pose_offset"])
+
+
+def add_detector_arguments(parser):
+    parser.add_argument("--fps", type=float, help=f"frame rate of an image directory (default {DEFAULT_FPS:g})")
+    parser.add_argument("--forward", type=float, nargs=2, metavar=("PITCH", "YAW"),
+                        help="callibrated forward head angles")
+    parser.add_argument("--callibrate", action="store_true",
+                        help="use the first frame with a face as the forward direction")
+    parser.add_argument("--ear-thresh", type=float, default=pipeline.DetectionPipeline.EAR_THRESH)
+    parser.add_argument("--drowsiness-wait-time", type=float, default=pipeline.DetectionPipeline.DROWSINESS_WAIT_TIME)
+    parser.add_argument("--head-pose-wait-time", type=float, default=pipeline.DetectionPipeline.HEAD_POSE_WAIT_TIME)
+    parser.add_argument("--head-pose-offset", type=float, default=pipeline.DetectionPipeline.HEAD_POSE_OFFSET)
+
+def get_settings(args):
+    return {
+        "ear_thresh": args.ear_thresh,
+        "drowsiness_wait_time": args.drowsiness_wait_time,
+        "head_pose_wait_time": args.head_pose_wait_time,
+        "head_pose_offset": args.head_pose_offset,
+    }
+
+def add_arguments(parser):
+    parser.add_argument("source", help="video file or directory of frame images")
+    parser.add_argument("-o", "--output", default="timeline.jsonl", help="JSONL timeline to write")
+    add_detector_arguments(parser)
+    parser.add_argument("--static-image-mode", action="store_true",
+                        help="detect the face on every frame instead of tracking it between frames")
+    parser.add_argument("--roi", action="store_true",
+                        help="run the landmark model on the area around the previous frame's face")
+    parser.add_argument("--max-input-size", type=int, metavar="PIXELS",
+                        help="downscale the landmark model input to at most this many pixels on its longer side")
+    parser.add_argument("--keyframe-interval", type=int, metavar="FRAMES",
+                        help="run the landmark model on every FRAMES-th frame only and track the landmarks "
+                             "with optical flow in between, except near the alert thresholds")
+    parser.add_argument("--camera-calibration", metavar="PATH",
+                        help="OpenCV calibration file (camera_matrix, distortion_coefficients) of the camera "
+                             "for the head pose")
+    parser.add_argument("--landmark-model", metavar="PATH",
+                        help="MediaPipe Tasks FaceLandmarker .task file to find the landmarks with, "
+                             "run in video mode, instead of the bundled FaceMesh")
+    parser.add_argument("--cache", action="store_true",
+                        help="keep the landmarks of the recording in a cache and reuse them on later runs, "
+                             "so only the detector thresholds are re-run")
+    parser.add_argument("--cache-dir", help="landmark cache directory (default the per-user cache)")
+    parser.add_argument("--cache-dtype", choices=("float32", "float16"), default="float32",
+                        help="precision the landmarks are cached with. float16 halves the cache but moved "
+                             "the EAR by up to 0.03 on a test recording, enough to move alerts near the "
+                             "threshold; float32 reproduces uncached timelines exactly")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="worker processes, each analysing its own time segment of the recording. "
+                             "Workers always use static image mode, so the timeline matches a serial "
+                             "--static-image-mode run exactly")
+    parser.add_argument("--segment-seconds", type=float, default=60.0,
+                        help="length of the segments handed to the workers")
+    parser.add_argument("--profile", action="store_true", help="print per-stage latencies (serial runs only)")
+    parser.add_argument("--profile-csv", metavar="PATH", help="write per-stage latency samples as CSV")
+    parser.add_argument("--profile-trace", metavar="PATH", help="write per-stage latency samples as a Chrome trace")
+
+def main(args):
+    settings = get_settings(args)
+    stage_profiler = profiler.StageProfiler(capacity=1 << 16)
+    if args.landmark_model and (args.cache or args.workers > 1):
+        # Cache entries are keyed by the bundled model and workers always run FaceMesh
+        raise SystemExit("--landmark-model cannot be combined with --cache or --workers")
+    if args.cache:
+        # Tracked landmarks depend on the thresholds and worker segments are run separately
+        if args.keyframe_interval or args.workers > 1:
+            raise SystemExit("--cache cannot be combined with --keyframe-interval or --workers")
+        measurements = measure_frames_cached(args.source, args.fps, args.static_image_mode, stage_profiler,
+                                             args.roi, args.max_input_size, args.cache_dir, args.cache_dtype,
+                                             args.camera_calibration)
+    elif args.workers > 1:
+        from . import parallel
+        measurements = parallel.measure_frames_parallel(args.source, args.workers, args.segment_seconds, args.fps,
+                                                        args.max_input_size, args.camera_calibration)
+    else:
+        measurements = measure_frames(args.source, args.fps, static_image_mode=args.static_image_mode,
+                                      stage_profiler=stage_profiler, roi=args.roi, max_input_size=args.max_input_size,
+                                      keyframe_interval=args.keyframe_interval, forward=args.forward,
+                                      callibrate=args.callibrate, settings=settings,
+                                      camera_calibration=args.camera_calibration, landmark_model=args.landmark_model)
+
+    summary = write_timeline(measurements, args.output, args.forward, args.callibrate, settings)
+    print(f"{summary['frames']} frames, {summary['events']} alert events in {summary['seconds']:.1f}s "
+          f"({summary['fps']:.1f} fps) -> {args.output}")
+
+    if args.profile and stage_profiler.stages:
+        print(stage_profiler.report())
+    if args.profile_csv:
+        stage_profiler.export_csv(args.profile_csv)
+    if args.profile_trace:
+        stage_profiler.export_chrome_trace(args.profile_trace)
@@ -30,3 +30,11 @@ responses = {
     "driver_not_visible":["Warning, Look forward."],
     "mobile_phone_detect":["Mobile detected!", "Please do not use your mobile phone while driving."]
 }
+
+# Spoken by the app itself rather than in response to a detection
+prompts = {
+    "callibration_start": "The callibration is starting, please look forward.",
+    "callibration_countdown": "In 3,, 2,, 1",
+    "callibration_done": "The calibration was successful, you can now start tracking.",
+    "tracking_failed": "Driver monitoring has stopped working. Please restart RoadSense AI.",
+}
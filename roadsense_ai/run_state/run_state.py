@@ -0,0 +1,64 @@
+import threading
+
+
+STOPPED = "stopped"
+TRACKING = "tracking"
+PAUSED = "paused"
+SHUTDOWN = "shutdown"
+
+
+class RunState:
+    """Run state of the app shared by its threads: stopped (webcam only), tracking, paused or shut down.
+
+    Threads block in wait_for_tracking() / wait_for_webcam() instead of polling flags, so they
+    use no CPU while there is nothing for them to do. Every transition wakes them up.
+    """
+    def __init__(self):
+        self.state = STOPPED
+        self.condition = threading.Condition()
+
+    def set_state(self, state):
+        with self.condition:
+            if self.state != SHUTDOWN:
+                self.state = state
+            self.condition.notify_all()
+
+    def start(self):
+        self.set_state(TRACKING)
+
+    def pause(self):
+        self.set_state(PAUSED)
+
+    def resume(self):
+        self.set_state(TRACKING)
+
+    def stop(self):
+        self.set_state(STOPPED)
+
+    def shutdown(self):
+        self.set_state(SHUTDOWN)
+
+    @property
+    def tracking(self):
+        return self.state == TRACKING
+
+    @property
+    def webcam(self):
+        """Whether camera frames are wanted, they are not while paused"""
+        return self.state in (STOPPED, TRACKING)
+
+    @property
+    def is_shutdown(self):
+        return self.state == SHUTDOWN
+
+    def wait_for_tracking(self, timeout=None):
+        """Block until tracking, returns False on shutdown or timeout"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.state in (TRACKING, SHUTDOWN), timeout)
+            return self.state == TRACKING
+
+    def wait_for_webcam(self, timeout=None):
+        """Block until camera frames are wanted, returns False on shutdown or timeout"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.webcam or self.state == SHUTDOWN, timeout)
+            return self.webcam
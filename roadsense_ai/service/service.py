@@ -0,0 +1,363 @@
+import json
+import math
+import os
+import signal
+import socket
+import stat
+import struct
+import threading
+import time
+
+import cv2
+
+from ..capture import capture
+from ..frame_analysis import frame_analysis
+from ..landmark_provider import landmark_provider
+from ..pipeline import pipeline
+from ..profiler import profiler
+from ..qos import qos
+from ..replay import replay
+from ..telemetry import telemetry
+
+
+DEFAULT_SOCKET = "/tmp/roadsense_ai.sock"
+# Wire format, little endian. Every message starts with its type byte and has a fixed size:
+#   HELLO  magic, version                                    sent once on connect
+#   FRAME  timestamp, ear, pitch, yaw, direction, flags, perclos
+#   EVENT  timestamp, alert, state
+# Missing values (no face, no PERCLOS yet) are NaN, flags has one bit per entry of ALERTS.
+HELLO, FRAME, EVENT = 0, 1, 2
+MAGIC = b"RSAI"
+VERSION = 1
+MESSAGES = {
+    HELLO: struct.Struct("<B4sB"),
+    FRAME: struct.Struct("<BdfffBBf"),
+    EVENT: struct.Struct("<BdBB"),
+}
+ALERTS = ("drowsiness_detect", "head_pose_detect", "driver_not_visible", "sleep_reminder_detect")
+DIRECTIONS = (None, "Forward", "Left", "Right", "Up", "Down")
+STATES = ("start", "end")
+
+
+def get_value(value):
+    return math.nan if value is None else value
+
+def get_optional(value):
+    return None if math.isnan(value) else value
+
+def encode_frame(result):
+    flags = sum(1 << bit for bit, alert in enumerate(ALERTS) if alert in result.alerts)
+    return MESSAGES[FRAME].pack(FRAME, result.timestamp, get_value(result.ear), get_value(result.pitch),
+                                get_value(result.yaw), DIRECTIONS.index(result.direction), flags,
+                                get_value(result.perclos))
+
+def encode_events(timestamp, previous_alerts, alerts):
+    """EVENT messages of the alert state changes between two consecutive frames"""
+    return b"".join(MESSAGES[EVENT].pack(EVENT, timestamp, ALERTS.index(event["type"]), STATES.index(event["state"]))
+                    for event in replay.get_events(previous_alerts, alerts))
+
+def decode(message_type, fields):
+    """A received message as a dict, like a replay timeline record"""
+    if message_type == FRAME:
+        timestamp, ear, pitch, yaw, direction, flags, perclos = fields
+        return {"type": "frame", "timestamp": timestamp, "ear": get_optional(ear), "pitch": get_optional(pitch),
+                "yaw": get_optional(yaw), "direction": DIRECTIONS[direction], "perclos": get_optional(perclos),
+                "alerts": [alert for bit, alert in enumerate(ALERTS) if flags & 1 << bit]}
+    if message_type == EVENT:
+        timestamp, alert, state = fields
+        return {"type": "event", "timestamp": timestamp, "alert": ALERTS[alert], "state": STATES[state]}
+    magic, version = fields
+    return {"type": "hello", "magic": magic, "version": version}
+
+
+class Subscriber:
+    """One connected client and the bytes it has not taken yet"""
+    def __init__(self, connection):
+        self.connection = connection
+        self.pending = bytearray()
+
+    def send(self, data):
+        """Queue data and send as much as the socket takes without waiting, returns the bytes still queued"""
+        self.pending += data
+        try:
+            sent = self.connection.send(self.pending)
+        except BlockingIOError:
+            sent = 0
+        del self.pending[:sent]
+        return len(self.pending)
+
+    def close(self):
+        self.connection.close()
+
+
+class EventPublisher:
+    """Publishes per-frame results and alert state changes to every client of a Unix domain socket.
+
+    publish_result() never waits for a client: messages a client has not read yet are kept
+    for it, and a client that falls more than max_pending bytes behind is disconnected.
+    Clients connect at any time on an accept thread and get a HELLO message first.
+    """
+    def __init__(self, path=DEFAULT_SOCKET, max_pending=1 << 16):
+        self.path = path
+        self.max_pending = max_pending
+        self.server = None
+        self.subscribers = []
+        self.previous_alerts = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.counts = {"frames": 0, "events": 0, "connected": 0, "dropped": 0, "disconnected": 0}
+
+    def start(self):
+        # A socket file left behind by a previous run would make bind() fail
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.unlink(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen()
+        self.running = True
+        self.thread = threading.Thread(target=self.accept, name="event-publisher", daemon=True)
+        self.thread.start()
+
+    def accept(self):
+        while self.running:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                # The server socket was closed by stop()
+                break
+            connection.setblocking(False)
+            subscriber = Subscriber(connection)
+            with self.lock:
+                subscriber.send(MESSAGES[HELLO].pack(HELLO, MAGIC, VERSION))
+                self.subscribers.append(subscriber)
+                self.counts["connected"] += 1
+
+    @property
+    def subscriber_count(self):
+        return len(self.subscribers)
+
+    def publish(self, data):
+        """Send raw messages to every client, dropping the ones that are too far behind or gone"""
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                try:
+                    pending = subscriber.send(data)
+                except OSError:
+                    self.remove(subscriber, "disconnected")
+                    continue
+                if pending > self.max_pending:
+                    self.remove(subscriber, "dropped")
+
+    def remove(self, subscriber, reason):
+        self.subscribers.remove(subscriber)
+        subscriber.close()
+        self.counts[reason] += 1
+
+    def publish_result(self, result):
+        """Publish a pipeline FrameResult and the alert state changes since the previous one"""
+        alerts = result.alerts
+        data = encode_frame(result)
+        if alerts != self.previous_alerts:
+            events = encode_events(result.timestamp, self.previous_alerts, alerts)
+            self.counts["events"] += len(events) // MESSAGES[EVENT].size
+            data += events
+            self.previous_alerts = alerts
+        self.counts["frames"] += 1
+        self.publish(data)
+
+    def flush(self, timeout=1.0):
+        """Wait up to timeout seconds for every client to take its queued messages"""
+        deadline = time.perf_counter() + timeout
+        while any(subscriber.pending for subscriber in self.subscribers) and time.perf_counter() < deadline:
+            self.publish(b"")
+            time.sleep(0.001)
+
+    def stop(self, timeout=1.0):
+        """Stop accepting clients, give the connected ones up to timeout seconds to read what is queued"""
+        self.running = False
+        if self.server is not None:
+            # Closing alone does not wake a thread blocked in accept() on Linux
+            try:
+                self.server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server.close()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+        self.flush(timeout)
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+            self.subscribers.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class EventSubscriber:
+    """Client side of an EventPublisher socket, iterating over the decoded messages"""
+    def __init__(self, path=DEFAULT_SOCKET, timeout=None):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.settimeout(timeout)
+        self.connection.connect(path)
+        self.buffer = bytearray()
+        self.messages = self.read_raw()
+        hello = next(self.messages, None)
+        if hello is None or hello[0] != HELLO or hello[1][0] != MAGIC:
+            self.close()
+            raise ConnectionError(f"{path} is not a RoadSense event socket")
+        self.version = hello[1][1]
+
+    def read_raw(self):
+        """Yield (type, fields) of every message until the publisher closes the connection"""
+        position = 0
+        while True:
+            while position < len(self.buffer):
+                message = MESSAGES.get(self.buffer[position])
+                if message is None:
+                    raise ConnectionError(f"unknown message type {self.buffer[position]}")
+                if position + message.size > len(self.buffer):
+                    break
+                fields = message.unpack_from(self.buffer, position)
+                position += message.size
+                yield fields[0], fields[1:]
+            del self.buffer[:position]
+            position = 0
+            data = self.connection.recv(1 << 16)
+            if not data:
+                return
+            self.buffer += data
+
+    def __iter__(self):
+        for message_type, fields in self.messages:
+            yield decode(message_type, fields)
+
+    def close(self):
+        self.connection.close()
+
+
+class HeadlessService:
+    """Runs the detectors on a camera or recording without Tk or audio, publishing every result.
+
+    Frames are taken newest first like in the app, results go to an EventPublisher and,
+    with telemetry_path set, to a TelemetryRecorder.
+    """
+    def __init__(self, source="0", socket_path=DEFAULT_SOCKET, settings=None, forward=None, callibrate=False,
+                 landmark_model=None, telemetry_path=None, latency_budget=None):
+        self.source = source
+        self.settings = settings or {}
+        self.forward = forward
+        self.callibrate = callibrate
+        self.landmark_model = landmark_model
+        self.latency_budget = latency_budget
+        self.governor = None
+        self.profiler = profiler.StageProfiler()
+        self.publisher = EventPublisher(socket_path)
+        self.telemetry = None
+        if telemetry_path:
+            self.telemetry = telemetry.TelemetryRecorder(telemetry.get_writer(telemetry_path))
+        self.frame_buffer = capture.LatestFrameBuffer(pool_consumers=1)
+        self.capture_thread = None
+
+    def run(self):
+        cap = cv2.VideoCapture(int(self.source) if self.source.isdigit() else self.source)
+        if not cap.isOpened():
+            raise ValueError(f"Cannot open {self.source!r}")
+        provider = landmark_provider.get_landmark_provider(self.landmark_model)
+        frame_analyzer = frame_analysis.FrameAnalyzer(provider, self.profiler)
+        frame_analyzer.warm_up()
+        detection_pipeline = pipeline.DetectionPipeline(frame_analyzer, self.profiler)
+        replay.apply_settings(detection_pipeline, self.settings)
+        head_pose_detector = detection_pipeline.head_pose_detector
+        if self.forward is not None:
+            head_pose_detector.forward_x, head_pose_detector.forward_y = self.forward
+        callibrate = self.callibrate
+        if self.latency_budget:
+            self.governor = qos.QosGovernor(detection_pipeline, self.latency_budget)
+
+        self.publisher.start()
+        if self.telemetry is not None:
+            self.telemetry.start()
+        self.capture_thread = capture.CaptureThread(cap, self.frame_buffer, self.profiler,
+                                                    live=self.source.isdigit() or "://" in self.source)
+        self.capture_thread.start()
+        last_sequence = 0
+        try:
+            while True:
+                frame = self.frame_buffer.get_latest(last_sequence, timeout=0.5)
+                if frame is None:
+                    if self.frame_buffer.closed:
+                        break
+                    continue
+                last_sequence = frame.sequence
+
+                frame_start = time.perf_counter_ns()
+                analysis, measurement = detection_pipeline.analyze_frame(frame.image, frame.timestamp)
+                if callibrate and measurement.pitch is not None:
+                    head_pose_detector.forward_x, head_pose_detector.forward_y = measurement.pitch, measurement.yaw
+                    callibrate = False
+                result = detection_pipeline.process(analysis, annotate=False, measurement=measurement)
+                self.frame_buffer.release(frame)
+                start = time.perf_counter_ns()
+                self.publisher.publish_result(result)
+                self.profiler.record("publish", start)
+                if self.telemetry is not None:
+                    self.telemetry.record(result)
+                end = self.profiler.record("frame", frame_start)
+                if self.governor is not None:
+                    self.governor.observe((end - frame_start) / 1e9)
+        finally:
+            self.capture_thread.stop()
+            self.capture_thread.thread.join(timeout=1.0)
+            cap.release()
+            if self.governor is not None:
+                self.governor.close()
+            frame_analyzer.close()
+            self.publisher.stop()
+            if self.telemetry is not None:
+                self.telemetry.stop()
+
+    def stop(self):
+        """Stop after the current frame, safe to call from a signal handler"""
+        if self.capture_thread is not None:
+            self.capture_thread.stop()
+        self.frame_buffer.close()
+
+
+def add_arguments(parser):
+    parser.add_argument("source", nargs="?", default="0", help="camera index, stream URL or recording (default 0)")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"Unix socket to publish on (default {DEFAULT_SOCKET})")
+    parser.add_argument("--landmark-model", metavar="PATH", help="MediaPipe Tasks FaceLandmarker .task file")
+    parser.add_argument("--telemetry", metavar="PATH", help="also record the trip, see DriverAidSystem.TELEMETRY_PATH")
+    parser.add_argument("--latency-budget", type=float, metavar="MS",
+                        help="step the landmark model's input size, cadence and variant down to hold this "
+                             "per-frame latency")
+    replay.add_detector_arguments(parser)
+
+def main(args):
+    service = HeadlessService(args.source, args.socket, replay.get_settings(args), args.forward, args.callibrate,
+                              args.landmark_model, args.telemetry,
+                              args.latency_budget / 1000 if args.latency_budget else None)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: service.stop())
+    print(f"publishing on {args.socket}")
+    service.run()
+    print(service.profiler.report())
+    if service.governor is not None:
+        print(service.governor.report())
+
+
+def add_listen_arguments(parser):
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"Unix socket to read (default {DEFAULT_SOCKET})")
+    parser.add_argument("--events", action="store_true", help="only print alert state changes")
+
+def listen(args):
+    subscriber = EventSubscriber(args.socket)
+    try:
+        for message in subscriber:
+            if message["type"] == "event" or not args.events:
+                print(json.dumps(message), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.close()
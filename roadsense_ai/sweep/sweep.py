@@ -0,0 +1,238 @@
+import csv
+import json
+
+import numpy as np
+
+
+# Elements of the (settings, wait times, frames) blocks evaluated at once
+BLOCK_SIZE = 1 << 24
+DROWSINESS = "drowsiness_detect"
+HEAD_POSE = "head_pose_detect"
+
+
+def load_timeline(path):
+    """timestamp, ear, pitch and yaw arrays of a replay timeline, nan where no face was measured"""
+    with open(path) as timeline:
+        records = [json.loads(line) for line in timeline if line.strip()]
+    columns = [[record[key] for record in records] for key in ("timestamp", "ear", "pitch", "yaw")]
+    return tuple(np.array(column, dtype=np.float64) for column in columns)
+
+def load_labels(path):
+    """Labelled events, a JSON list of {"type": alert name, "start": seconds, "end": seconds}"""
+    with open(path) as labels_file:
+        return json.load(labels_file)
+
+def get_range(start, stop, step):
+    """Inclusive range of settings values"""
+    return np.round(np.arange(start, stop + step / 2, step), 6)
+
+
+def get_timer(timestamps, active):
+    """d_time of the detector timers on every frame, for rows of per-frame active flags.
+
+    A timer accumulates the frame time deltas while its condition holds and resets on the first
+    frame it does not, so on an active frame it equals the time since the last inactive frame
+    (or the first frame).
+    """
+    index = np.arange(active.shape[-1])
+    last_inactive = np.maximum.accumulate(np.where(active, 0, index), axis=-1)
+    return np.where(active, timestamps - timestamps[last_inactive], 0.0)
+
+def get_alarms(timestamps, active, wait_times):
+    """(rows, wait times, frames) alarm flags of the timers, play_alarm is set once d_time >= WAIT_TIME"""
+    return get_timer(timestamps, active)[:, None, :] >= np.asarray(wait_times)[None, :, None]
+
+def drowsiness_alarms(timestamps, ear, thresholds, wait_times):
+    """DrowsinessDetector.update over every frame for each EAR threshold and wait time"""
+    # nan (no face) compares False and resets the timer like a None EAR
+    closed = ear[None, :] < np.asarray(thresholds)[:, None]
+    return get_alarms(timestamps, closed, wait_times)
+
+def head_pose_alarms(timestamps, pitch, yaw, forward, offsets, wait_times):
+    """HeadPoseEstimator.update for each offset and wait time, as driven by DetectionPipeline.update.
+
+    Frames without usable angles (no face, or an angle of exactly 0) do not reach the timer,
+    which keeps its state, so their alarm is the one of the last frame with angles.
+    """
+    valid = ~np.isnan(pitch) & ~np.isnan(yaw) & (pitch != 0) & (yaw != 0)
+    forward_x, forward_y = forward
+    offsets = np.asarray(offsets)[:, None]
+    away = (np.abs(pitch[valid] - forward_x) > offsets) | (np.abs(yaw[valid] - forward_y) > offsets)
+    alarms = get_alarms(timestamps[valid], away, wait_times)
+
+    if not valid.any():
+        return np.zeros(alarms.shape[:2] + valid.shape, dtype=bool)
+    held = np.cumsum(valid) - 1
+    alarms = alarms[..., np.maximum(held, 0)]
+    alarms[..., held < 0] = False
+    return alarms
+
+
+def get_onsets(alarms):
+    """Frames an alert starts on"""
+    onsets = alarms.copy()
+    onsets[..., 1:] &= ~alarms[..., :-1]
+    return onsets
+
+def get_label_ranges(timestamps, labels, tolerance):
+    """[first, last) frame ranges of labelled events, grown by tolerance seconds"""
+    starts = np.array([label["start"] - tolerance for label in labels], dtype=np.float64)
+    ends = np.array([label["end"] + tolerance for label in labels], dtype=np.float64)
+    return np.searchsorted(timestamps, starts, "left"), np.searchsorted(timestamps, ends, "right")
+
+def score(onsets, first, last):
+    """Alert count, alerts inside a labelled event and labelled events alerted on, per row of onsets"""
+    alerts = onsets.sum(axis=-1)
+    in_label = np.zeros(onsets.shape[-1] + 1, dtype=np.int32)
+    np.add.at(in_label, first, 1)
+    np.add.at(in_label, last, -1)
+    in_label = np.cumsum(in_label[:-1]) > 0
+    true_alerts = (onsets & in_label).sum(axis=-1)
+
+    counts = np.zeros(onsets.shape[:-1] + (onsets.shape[-1] + 1,), dtype=np.int32)
+    np.cumsum(onsets, axis=-1, out=counts[..., 1:])
+    hit_labels = (counts[..., last] > counts[..., first]).sum(axis=-1)
+    return alerts, true_alerts, hit_labels
+
+def get_precision_recall(alerts, true_alerts, hit_labels, label_count):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(alerts > 0, true_alerts / alerts, 0.0)
+        recall = np.where(label_count > 0, hit_labels / max(label_count, 1), 0.0)
+    return precision, recall
+
+
+class ThresholdSweep:
+    """Evaluates grids of detector settings over one session's per-frame measurements.
+
+    The detector timers only depend on the EAR, head angles and timestamps, so every settings
+    combination is replayed at once with numpy instead of one DetectionPipeline per setting.
+    Drowsiness alerts only depend on the EAR threshold and wait time and head pose alerts only
+    on the offset and wait time, so both are evaluated on their own and combined at the end.
+    labels are labelled events (see load_labels), alerts starting within tolerance seconds of
+    one count as true positives.
+    """
+    def __init__(self, timestamps, ear, pitch, yaw, forward=(0.0, 0.0), labels=(), tolerance=1.0):
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.ear = np.asarray(ear, dtype=np.float64)
+        self.pitch = np.asarray(pitch, dtype=np.float64)
+        self.yaw = np.asarray(yaw, dtype=np.float64)
+        self.forward = forward
+        self.labels = {alert: [label for label in labels if label["type"] == alert] for alert in (DROWSINESS, HEAD_POSE)}
+        self.label_ranges = {alert: get_label_ranges(self.timestamps, alert_labels, tolerance)
+                             for alert, alert_labels in self.labels.items()}
+
+    def evaluate(self, alert, get_alarms, settings, wait_times):
+        """Alert counts and scores of one detector, arrays of shape (settings, wait times)"""
+        first, last = self.label_ranges[alert]
+        block = max(1, BLOCK_SIZE // max(1, len(wait_times) * len(self.timestamps)))
+        scores = []
+        for start in range(0, len(settings), block):
+            onsets = get_onsets(get_alarms(settings[start:start + block], wait_times))
+            scores.append(score(onsets, first, last))
+        return [np.concatenate(column) for column in zip(*scores)]
+
+    def run(self, ear_thresh, drowsiness_wait_time, head_pose_offset, head_pose_wait_time):
+        """Evaluate every combination of the settings values, returns a dict of result columns"""
+        grid = [np.atleast_1d(np.asarray(values, dtype=np.float64)) for values in
+                (ear_thresh, drowsiness_wait_time, head_pose_offset, head_pose_wait_time)]
+        drowsiness = self.evaluate(DROWSINESS, lambda thresholds, wait_times: drowsiness_alarms(
+            self.timestamps, self.ear, thresholds, wait_times), grid[0], grid[1])
+        head_pose = self.evaluate(HEAD_POSE, lambda offsets, wait_times: head_pose_alarms(
+            self.timestamps, self.pitch, self.yaw, self.forward, offsets, wait_times), grid[2], grid[3])
+
+        # Broadcast both detectors' (setting, wait time) tables over the full grid
+        shape = tuple(len(values) for values in grid)
+        drowsiness = [np.broadcast_to(column[:, :, None, None], shape).ravel() for column in drowsiness]
+        head_pose = [np.broadcast_to(column[None, None, :, :], shape).ravel() for column in head_pose]
+        columns = {name: np.broadcast_to(values.reshape([-1 if axis == i else 1 for axis in range(4)]), shape).ravel()
+                   for i, (name, values) in enumerate(zip(
+                       ("ear_thresh", "drowsiness_wait_time", "head_pose_offset", "head_pose_wait_time"), grid))}
+
+        for alert, name, (alerts, true_alerts, hit_labels) in ((DROWSINESS, "drowsiness", drowsiness),
+                                                               (HEAD_POSE, "head_pose", head_pose)):
+            precision, recall = get_precision_recall(alerts, true_alerts, hit_labels, len(self.labels[alert]))
+            columns.update({f"{name}_alerts": alerts, f"{name}_precision": precision, f"{name}_recall": recall})
+
+        alerts = drowsiness[0] + head_pose[0]
+        precision, recall = get_precision_recall(alerts, drowsiness[1] + head_pose[1], drowsiness[2] + head_pose[2],
+                                                 sum(len(labels) for labels in self.labels.values()))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        columns.update({"precision": precision, "recall": recall, "f1": f1})
+        return columns
+
+    def timeline(self, ear_thresh, drowsiness_wait_time, head_pose_offset, head_pose_wait_time):
+        """Per-frame alarm flags of one combination of settings, by alert name"""
+        return {
+            DROWSINESS: drowsiness_alarms(self.timestamps, self.ear, [ear_thresh], [drowsiness_wait_time])[0, 0],
+            HEAD_POSE: head_pose_alarms(self.timestamps, self.pitch, self.yaw, self.forward,
+                                        [head_pose_offset], [head_pose_wait_time])[0, 0],
+        }
+
+    def events(self, *settings):
+        """Alert start and end events of one combination of settings, as in replay timelines"""
+        events = []
+        for alert, alarms in self.timeline(*settings).items():
+            changes = np.flatnonzero(np.diff(alarms.astype(np.int8), prepend=0))
+            events += [{"frame": int(frame), "timestamp": float(self.timestamps[frame]), "type": alert,
+                        "state": "start" if alarms[frame] else "end"} for frame in changes]
+        return sorted(events, key=lambda event: event["frame"])
+
+
+def get_forward(pitch, yaw):
+    """Head angles of the first frame with a face, what replay --callibrate uses as forward"""
+    found = np.flatnonzero(~np.isnan(pitch))
+    return (float(pitch[found[0]]), float(yaw[found[0]])) if len(found) else (0.0, 0.0)
+
+def write_results(columns, output, order=None):
+    names = list(columns)
+    order = np.arange(len(columns[names[0]])) if order is None else order
+    with open(output, "w", newline="") as results_file:
+        writer = csv.writer(results_file)
+        writer.writerow(names)
+        writer.writerows(zip(*(columns[name][order].tolist() for name in names)))
+
+
+def add_arguments(parser):
+    parser.add_argument("timeline", help="JSONL timeline written by replay, e.g. from a --cache run")
+    parser.add_argument("--labels", help="JSON list of labelled events: {\"type\", \"start\", \"end\"} in seconds")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="seconds an alert may be off a labelled event")
+    parser.add_argument("--forward", type=float, nargs=2, metavar=("PITCH", "YAW"),
+                        help="callibrated forward head angles (default the first frame with a face)")
+    parser.add_argument("--ear-thresh", type=float, nargs=3, metavar=("START", "STOP", "STEP"),
+                        default=(0.15, 0.35, 0.01))
+    parser.add_argument("--drowsiness-wait-time", type=float, nargs=3, metavar=("START", "STOP", "STEP"),
+                        default=(0.3, 2.0, 0.1))
+    parser.add_argument("--head-pose-offset", type=float, nargs=3, metavar=("START", "STOP", "STEP"),
+                        default=(5, 25, 1))
+    parser.add_argument("--head-pose-wait-time", type=float, nargs=3, metavar=("START", "STOP", "STEP"),
+                        default=(0.3, 2.0, 0.1))
+    parser.add_argument("-o", "--output", default="sweep.csv", help="CSV of every combination, best F1 first")
+    parser.add_argument("--events", metavar="PATH", help="write the alert events of the best combination as JSONL")
+    parser.add_argument("--top", type=int, default=10, help="combinations to print")
+
+def main(args):
+    timestamps, ear, pitch, yaw = load_timeline(args.timeline)
+    labels = load_labels(args.labels) if args.labels else []
+    forward = args.forward or get_forward(pitch, yaw)
+    threshold_sweep = ThresholdSweep(timestamps, ear, pitch, yaw, forward, labels, args.tolerance)
+    grid = [get_range(*values) for values in (args.ear_thresh, args.drowsiness_wait_time,
+                                              args.head_pose_offset, args.head_pose_wait_time)]
+    columns = threshold_sweep.run(*grid)
+
+    # Best F1 first, fewest alerts among equals
+    order = np.lexsort((columns["drowsiness_alerts"] + columns["head_pose_alerts"], -columns["f1"]))
+    write_results(columns, args.output, order)
+    print(f"{len(order)} combinations over {len(timestamps)} frames, {len(labels)} labelled events -> {args.output}")
+    settings_names = ("ear_thresh", "drowsiness_wait_time", "head_pose_offset", "head_pose_wait_time")
+    for index in order[:args.top]:
+        settings = "  ".join(f"{name} {columns[name][index]:g}" for name in settings_names)
+        print(f"{settings}  alerts {columns['drowsiness_alerts'][index]}+{columns['head_pose_alerts'][index]}  "
+              f"precision {columns['precision'][index]:.2f} recall {columns['recall'][index]:.2f} "
+              f"f1 {columns['f1'][index]:.2f}")
+
+    if args.events and len(order):
+        best = [float(columns[name][order[0]]) for name in settings_names]
+        with open(args.events, "w") as events_file:
+            for event in threshold_sweep.events(*best):
+                events_file.write(json.dumps(event) + "\n")
@@ -0,0 +1,293 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+FRAME_FIELDS = ("timestamp", "ear", "pitch", "yaw", "direction", "driver_not_visible", "drowsy", "head_pose",
+                "fatigued", "perclos")
+EVENT_FIELDS = ("timestamp", "alert", "state")
+# Frames further apart than this are a gap in the recording and count towards no state
+MAX_FRAME_GAP = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trips (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    ended REAL,
+    driver TEXT
+);
+CREATE TABLE IF NOT EXISTS frames (
+    trip_id INTEGER NOT NULL REFERENCES trips (id),
+    timestamp REAL NOT NULL,
+    ear REAL,
+    pitch REAL,
+    yaw REAL,
+    direction TEXT,
+    driver_not_visible INTEGER NOT NULL,
+    drowsy INTEGER NOT NULL,
+    head_pose INTEGER NOT NULL,
+    fatigued INTEGER NOT NULL,
+    perclos REAL
+);
+CREATE INDEX IF NOT EXISTS frames_trip ON frames (trip_id, timestamp);
+CREATE TABLE IF NOT EXISTS events (
+    trip_id INTEGER NOT NULL REFERENCES trips (id),
+    timestamp REAL NOT NULL,
+    alert TEXT NOT NULL,
+    state TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_trip ON events (trip_id, state, alert);
+"""
+
+
+def frame_row(result, clock_offset=0.0):
+    """Tuple of FRAME_FIELDS of a pipeline FrameResult, timestamps moved by clock_offset"""
+    return (result.timestamp + clock_offset, result.ear,
+            None if result.pitch is None else float(result.pitch),
+            None if result.yaw is None else float(result.yaw),
+            result.direction, bool(result.driver_not_visible), bool(result.drowsy), bool(result.head_pose),
+            bool(result.fatigued), result.perclos)
+
+
+class SqliteTelemetryWriter:
+    """Writes telemetry batches into a SQLite database in WAL mode, one transaction per batch"""
+    def __init__(self, path):
+        self.path = path
+        # Created on the recording thread, only used by the writer thread afterwards
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps the database consistent without a sync on every commit
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def begin_trip(self, started, driver=None):
+        with self.connection:
+            return self.connection.execute("INSERT INTO trips (started, driver) VALUES (?, ?)",
+                                           (started, driver)).lastrowid
+
+    def write(self, trip_id, frames, events):
+        with self.connection:
+            self.connection.executemany(f"INSERT INTO frames VALUES (?, {', '.join('?' * len(FRAME_FIELDS))})",
+                                        [(trip_id, *frame) for frame in frames])
+            self.connection.executemany("INSERT INTO events VALUES (?, ?, ?, ?)",
+                                        [(trip_id, *event) for event in events])
+
+    def end_trip(self, trip_id, ended):
+        with self.connection:
+            self.connection.execute("UPDATE trips SET ended = ? WHERE id = ?", (ended, trip_id))
+
+    def close(self):
+        self.connection.close()
+
+
+class JsonlTelemetryWriter:
+    """Writes telemetry batches as gzip-compressed JSONL files in a directory.
+
+    Each trip gets its own files, a new one is started once the current one holds
+    max_records lines. Every line is a frame or an event record with its "type".
+    """
+    def __init__(self, directory, max_records=100000):
+        self.directory = directory
+        self.max_records = max_records
+        self.file = None
+        self.records = 0
+        self.part = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def begin_trip(self, started, driver=None):
+        # Milliseconds and a counter keep trips started close together from sharing files
+        base = time.strftime("%Y%m%d-%H%M%S", time.localtime(started)) + f"-{int(started % 1 * 1000):03d}"
+        trip_id, count = base, 0
+        while os.path.exists(self.get_path(trip_id, 0)):
+            count += 1
+            trip_id = f"{base}-{count}"
+        self.part = 0
+        self.open(trip_id)
+        self.write_line({"type": "trip", "id": trip_id, "started": started, "driver": driver})
+        return trip_id
+
+    def get_path(self, trip_id, part):
+        return os.path.join(self.directory, f"trip-{trip_id}-{part:04d}.jsonl.gz")
+
+    def open(self, trip_id):
+        if self.file is not None:
+            self.file.close()
+        self.file = gzip.open(self.get_path(trip_id, self.part), "wt", compresslevel=6)
+        self.records = 0
+        self.part += 1
+
+    def write_line(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.records += 1
+
+    def write(self, trip_id, frames, events):
+        for frame in frames:
+            if self.records >= self.max_records:
+                self.open(trip_id)
+            self.write_line({"type": "frame", **dict(zip(FRAME_FIELDS, frame))})
+        for event in events:
+            self.write_line({"type": "event", **dict(zip(EVENT_FIELDS, event))})
+
+    def end_trip(self, trip_id, ended):
+        self.write_line({"type": "trip_end", "id": trip_id, "ended": ended})
+        self.file.close()
+        self.file = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def get_writer(path):
+    """SQLite writer for a .db or .sqlite path, compressed JSONL files in a directory otherwise"""
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        return SqliteTelemetryWriter(path)
+    return JsonlTelemetryWriter(path)
+
+
+class TelemetryRecorder:
+    """Records the per-frame results and alert events of one trip, writing them on its own thread.
+
+    record() only appends to a queue and never waits for the disk, so the tracking loop can call
+    it on every frame. The writer thread flushes the queue as one batch once batch_size frames
+    are waiting or flush_interval seconds passed. When the writer falls behind by max_queue
+    frames, further frames are dropped and counted until it catches up, and so are alert events
+    past max_queue. A batch the writer fails to store is counted as an error and the writer
+    carries on with the next one. Timestamps are stored as wall-clock seconds.
+    """
+    def __init__(self, writer, driver=None, max_queue=8192, batch_size=512, flush_interval=1.0):
+        self.writer = writer
+        self.driver = driver
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.frames = []
+        self.events = []
+        self.previous_alerts = []
+        self.trip_id = None
+        # Frame timestamps come from time.perf_counter()
+        self.clock_offset = time.time() - time.perf_counter()
+        self.running = False
+        self.condition = threading.Condition()
+        self.thread = None
+        self.counts = {"recorded": 0, "dropped": 0, "dropped_events": 0, "written": 0, "batches": 0, "errors": 0}
+
+    def start(self):
+        self.trip_id = self.writer.begin_trip(time.time(), self.driver)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="telemetry", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Write what is still queued, close the trip and wait for the writer to exit"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def record(self, result):
+        """Queue one pipeline FrameResult and the alert state changes since the previous one"""
+        alerts = result.alerts
+        with self.condition:
+            if alerts != self.previous_alerts:
+                timestamp = result.timestamp + self.clock_offset
+                events = [(timestamp, alert, "start") for alert in alerts if alert not in self.previous_alerts]
+                events += [(timestamp, alert, "end") for alert in self.previous_alerts if alert not in alerts]
+                room = max(0, self.max_queue - len(self.events))
+                self.events.extend(events[:room])
+                self.counts["dropped_events"] += len(events[room:])
+                self.previous_alerts = alerts
+
+            self.counts["recorded"] += 1
+            if len(self.frames) >= self.max_queue:
+                self.counts["dropped"] += 1
+                return
+            self.frames.append(frame_row(result, self.clock_offset))
+            if len(self.frames) >= self.batch_size:
+                self.condition.notify()
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: len(self.frames) >= self.batch_size or not self.running,
+                                            self.flush_interval)
+                    frames, self.frames = self.frames, []
+                    events, self.events = self.events, []
+                    running = self.running
+
+                if frames or events:
+                    try:
+                        self.writer.write(self.trip_id, frames, events)
+                    except (OSError, sqlite3.Error):
+                        # A full disk or a locked database loses this batch, not the rest of the trip
+                        self.counts["errors"] += 1
+                    else:
+                        self.counts["written"] += len(frames)
+                        self.counts["batches"] += 1
+                if not running:
+                    break
+            try:
+                self.writer.end_trip(self.trip_id, time.time())
+            except (OSError, sqlite3.Error):
+                self.counts["errors"] += 1
+        finally:
+            self.writer.close()
+
+
+class TelemetryDatabase:
+    """Per-trip queries on a database written by SqliteTelemetryWriter"""
+    def __init__(self, path):
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        self.connection.row_factory = sqlite3.Row
+
+    def trips(self):
+        return [dict(row) for row in self.connection.execute("SELECT * FROM trips ORDER BY id")]
+
+    def alert_counts(self, trip_id):
+        """Number of times each alert was raised during a trip"""
+        rows = self.connection.execute(
+            "SELECT alert, COUNT(*) FROM events WHERE trip_id = ? AND state = 'start' GROUP BY alert", (trip_id,))
+        return dict(rows.fetchall())
+
+    def summary(self, trip_id):
+        """Frame count, duration, seconds spent in each alert state, EAR and PERCLOS of a trip"""
+        # Each frame lasts until the next one, except across gaps in the recording
+        row = self.connection.execute("""
+            SELECT COUNT(*) AS frames,
+                   MAX(timestamp) - MIN(timestamp) AS duration,
+                   TOTAL(CASE WHEN ear IS NOT NULL THEN duration END) AS visible_time,
+                   TOTAL(CASE WHEN drowsy THEN duration END) AS drowsy_time,
+                   TOTAL(CASE WHEN head_pose THEN duration END) AS head_pose_time,
+                   TOTAL(CASE WHEN driver_not_visible THEN duration END) AS not_visible_time,
+                   TOTAL(CASE WHEN fatigued THEN duration END) AS fatigued_time,
+                   AVG(ear) AS mean_ear,
+                   MAX(perclos) AS max_perclos
+            FROM (SELECT *, CASE WHEN gap <= ? THEN gap ELSE 0 END AS duration
+                  FROM (SELECT *, LEAD(timestamp) OVER (ORDER BY timestamp) - timestamp AS gap
+                        FROM frames WHERE trip_id = ?))
+            """, (MAX_FRAME_GAP, trip_id)).fetchone()
+        return {"trip_id": trip_id, **dict(row), "alerts": self.alert_counts(trip_id)}
+
+    def close(self):
+        self.connection.close()
+
+
+def add_arguments(parser):
+    parser.add_argument("database", help="SQLite telemetry database written by the app")
+    parser.add_argument("--trip", type=int, action="append", help="trip to summarize (default all)")
+
+def main(args):
+    database = TelemetryDatabase(args.database)
+    try:
+        trip_ids = args.trip or [trip["id"] for trip in database.trips()]
+        for trip_id in trip_ids:
+            print(json.dumps(database.summary(trip_id)))
+    finally:
+        database.close()
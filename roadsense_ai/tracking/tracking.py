@@ -0,0 +1,138 @@
+import time
+import cv2
+import numpy as np
+
+from ..frame_analysis import frame_analysis
+
+
+LK_PARAMS = dict(winSize=(21, 21), maxLevel=3,
+                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+
+def get_tracked_idxs(drowsiness_detector, head_pose_detector):
+    """Landmarks the detectors measure: the eye points and the head pose points"""
+    return np.union1d(drowsiness_detector.eye_idx_stack.ravel(), head_pose_detector.target_idxs)
+
+def use_keyframes(detection_pipeline, keyframe_interval, **kwargs):
+    """Wrap the frame analyzer of a DetectionPipeline in a KeyframeAnalyzer tracking the landmarks its detectors use"""
+    tracked_idxs = get_tracked_idxs(detection_pipeline.drowsiness_detector, detection_pipeline.head_pose_detector)
+    detection_pipeline.frame_analyzer = KeyframeAnalyzer(detection_pipeline.frame_analyzer, tracked_idxs,
+                                                         keyframe_interval, **kwargs)
+    return detection_pipeline.frame_analyzer
+
+def get_search_box(points, img_w, img_h, margin):
+    """Pixel box (x0, y0, x1, y1) around the points, grown by margin pixels on each side"""
+    min_x, min_y = points.min(axis=0).tolist()
+    max_x, max_y = points.max(axis=0).tolist()
+    return (max(0, int(min_x - margin)), max(0, int(min_y - margin)),
+            min(img_w, int(max_x + margin) + 1), min(img_h, int(max_y + margin) + 1))
+
+
+class KeyframeAnalyzer:
+    """Runs the landmark model on keyframes only and tracks landmarks between them with optical flow.
+
+    The tracked landmarks are followed with pyramidal Lucas-Kanade flow from frame to frame,
+    every other landmark moves with their median displacement. A keyframe is taken every
+    keyframe_interval frames, when tracking fails or its error exceeds max_flow_error, and on
+    every frame while the detectors report measurements close to an alert threshold.
+    """
+    def __init__(self, frame_analyzer, tracked_idxs, keyframe_interval=5, max_flow_error=12.0, search_margin=40):
+        self.frame_analyzer = frame_analyzer
+        self.profiler = frame_analyzer.profiler
+        self.tracked_idxs = np.asarray(tracked_idxs)
+        self.keyframe_interval = keyframe_interval
+        self.max_flow_error = max_flow_error
+        self.search_margin = search_margin
+
+        self.escalated = False
+        self.frames_since_keyframe = 0
+        self.flipped = None
+        # Grayscale frames alternate between two arrays, the previous one is kept for the flow
+        self.grays = [None, None]
+        self.previous_gray = None
+        self.landmarks = None
+        self.frame_count = 0
+        self.keyframe_count = 0
+
+    def reset(self):
+        """Forget the tracked landmarks, the next frame is a keyframe"""
+        self.landmarks = None
+        self.previous_gray = None
+        self.frames_since_keyframe = 0
+
+    @property
+    def keyframe_ratio(self):
+        return self.keyframe_count / self.frame_count if self.frame_count else 0.0
+
+    def analyze(self, frame, timestamp=None, dst=None):
+        """Analyze one camera frame, timestamp is its capture time in seconds (now if not given).
+
+        Like FrameAnalyzer.analyze(), the frame is flipped into dst or else into a reused array.
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+
+        start = time.perf_counter_ns()
+        if dst is None:
+            image = self.flipped = frame_analysis.process_image(frame, self.flipped)
+        else:
+            image = frame_analysis.process_image(frame, dst)
+        self.profiler.record("flip", start)
+        self.frame_count += 1
+
+        start = time.perf_counter_ns()
+        index = 1 if self.previous_gray is self.grays[0] else 0
+        gray = self.grays[index] = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, self.grays[index])
+        landmarks = None
+        # A keyframe and keyframe_interval - 1 tracked frames, so the model runs on every keyframe_interval-th frame
+        if self.landmarks is not None and not self.escalated and self.frames_since_keyframe + 1 < self.keyframe_interval:
+            landmarks = self.track(gray)
+        self.profiler.record("tracking", start)
+
+        if landmarks is None:
+            analysis = self.run_keyframe(image, gray, timestamp)
+        else:
+            self.frames_since_keyframe += 1
+            analysis = frame_analysis.FrameAnalysis(image, landmarks, timestamp, keyframe=False)
+        image.flags.writeable = True
+        return analysis
+
+    def refine(self, analysis):
+        """Run the landmark model on a tracked frame after all, returning it as a keyframe"""
+        # After a tracked frame previous_gray already holds this frame
+        return self.run_keyframe(analysis.image, self.previous_gray, analysis.timestamp)
+
+    def run_keyframe(self, image, gray, timestamp):
+        self.landmarks = self.frame_analyzer.find_landmarks(image, timestamp)
+        self.previous_gray = gray
+        self.frames_since_keyframe = 0
+        self.keyframe_count += 1
+        return frame_analysis.FrameAnalysis(image, self.landmarks, timestamp)
+
+    def track(self, gray):
+        """Move the previous frame's landmarks to this frame, None when the flow is unreliable"""
+        img_h, img_w = gray.shape
+        scale = np.array((img_w, img_h), dtype=np.float32)
+        points = self.landmarks[self.tracked_idxs, :2] * scale
+
+        # Only the area around the face is searched, so both pyramids stay small
+        x0, y0, x1, y1 = get_search_box(points, img_w, img_h, self.search_margin)
+        offset = np.array((x0, y0), dtype=np.float32)
+        new_points, status, error = cv2.calcOpticalFlowPyrLK(
+            self.previous_gray[y0:y1, x0:x1], gray[y0:y1, x0:x1],
+            (points - offset).reshape(-1, 1, 2), None, **LK_PARAMS)
+        if new_points is None or not status.all() or np.median(error) > self.max_flow_error:
+            return None
+
+        new_points = new_points.reshape(-1, 2) + offset
+        landmarks = self.landmarks.copy()
+        landmarks[:, :2] += np.median(new_points - points, axis=0) / scale
+        landmarks[self.tracked_idxs, :2] = new_points / scale
+
+        self.landmarks = landmarks
+        self.previous_gray = gray
+        return landmarks
+
+    def observe(self, escalate):
+        """Feedback from the detectors after each frame, escalate asks for a keyframe on every frame"""
+        self.escalated = escalate
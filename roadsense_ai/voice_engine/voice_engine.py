@@ -1,20 +1,220 @@
-import pyttsx3
+import hashlib
+import io
+import os
+import threading
+import time
+import wave
+
+# Voice backends have speak(audio, on_start=None), blocking until the phrase was said, calling
+# on_start when the sound actually starts and returning True when stop() cut it short. stop() is
+# called from other threads; a stop that comes before speak() started cancels that phrase too,
+# until reset() readies the backend for the next one.
 
 
 class VoiceEngine:
     def __init__(self) -> None:                
+        import pyttsx3
         self.engine = pyttsx3.init('sapi5')
         voices = self.engine.getProperty('voices')
         self.engine.setProperty('voice', voices[0].id)
         self.engine.setProperty("rate", 220)
+        self.on_start = None
+        self.stopped = threading.Event()
+        self.engine.connect("started-utterance", self.started_utterance)
 
+    def started_utterance(self, name):
+        if self.on_start is not None:
+            self.on_start()
 
-    def speak(self, audio:str):
+    def speak(self, audio:str, on_start=None):
+        if self.stopped.is_set():
+            return True
+        self.on_start = on_start
         self.engine.say(audio)
         try:
             self.engine.runAndWait()
         except RuntimeError:
             pass
+        self.on_start = None
+        return self.stopped.is_set()
+
+    def stop(self):
+        self.stopped.set()
+        # Interrupts runAndWait() in the speaking thread
+        self.engine.stop()
+
+    def reset(self):
+        self.stopped.clear()
+
+    def get_settings(self):
+        """The voice and rate, everything besides the text that changes the rendered sound"""
+        return self.engine.getProperty("voice"), self.engine.getProperty("rate")
+
+    def render(self, phrases):
+        """Synthesize {text: wav path} to files in one run of the engine"""
+        for text, path in phrases.items():
+            self.engine.save_to_file(text, path)
+        self.engine.runAndWait()
+
+
+def get_cache_dir():
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "roadsense_ai", "voice")
+
+def get_clip_key(text, voice, rate):
+    return hashlib.sha1(f"{voice}\0{rate}\0{text}".encode("utf-8")).hexdigest()
+
+def load_clip(path):
+    """Read a wav file into memory, None when it is missing or not a readable wav"""
+    try:
+        with open(path, "rb") as clip_file:
+            clip = clip_file.read()
+        with wave.open(io.BytesIO(clip)) as clip_wave:
+            if not clip_wave.getnframes():
+                return None
+    except (OSError, EOFError, wave.Error):
+        return None
+    return clip
+
+
+# Clip players have start(clip), returning once the clip is playing, wait() until it ended or
+# was stopped, and stop() called from other threads.
+
+
+class WinsoundPlayer:
+    """Plays in-memory wav clips on Windows"""
+    def __init__(self) -> None:
+        import winsound
+        self.winsound = winsound
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self, clip):
+        # winsound only plays from memory synchronously, on a thread of its own
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.play, args=(clip,), daemon=True)
+        self.thread.start()
+
+    def play(self, clip):
+        if not self.stopped.is_set():
+            self.winsound.PlaySound(clip, self.winsound.SND_MEMORY | self.winsound.SND_NODEFAULT)
+
+    def wait(self):
+        self.thread.join()
+
+    def stop(self):
+        self.stopped.set()
+        self.winsound.PlaySound(None, 0)
+
+
+class ClipVoiceEngine:
+    """Voice backend playing pre-rendered clips from memory.
+
+    Clips are wav files in cache_dir keyed by text, voice and rate. preload() loads the known
+    phrases at startup and synthesizes the missing ones with the voice_engine once; phrases that
+    were not preloaded are synthesized on first use.
+    """
+    def __init__(self, voice_engine, player=None, cache_dir=None) -> None:
+        self.voice_engine = voice_engine
+        self.player = player or WinsoundPlayer()
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.voice, self.rate = voice_engine.get_settings()
+        self.clips = {}
+        self.misses = 0
+        self.stopped = threading.Event()
+        # Held across the stopped check and the start of playback, so a stop() cannot fall between them
+        self.lock = threading.Lock()
+
+    def get_path(self, text):
+        return os.path.join(self.cache_dir, get_clip_key(text, self.voice, self.rate) + ".wav")
+
+    def preload(self, phrases):
+        """Load the clips of phrases into memory, rendering the ones not in the cache yet"""
+        missing = {}
+        for text in phrases:
+            clip = load_clip(self.get_path(text))
+            if clip is None:
+                missing[text] = self.get_path(text)
+            else:
+                self.clips[text] = clip
+
+        if missing:
+            self.misses += len(missing)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.voice_engine.render(missing)
+            for text, path in missing.items():
+                clip = load_clip(path)
+                if clip is not None:
+                    self.clips[text] = clip
+        return len(phrases) - len(missing)
+
+    def speak(self, audio:str, on_start=None):
+        if audio not in self.clips:
+            self.preload([audio])
+        clip = self.clips.get(audio)
+        if clip is None:
+            # Rendering failed, say it live instead
+            return self.voice_engine.speak(audio, on_start)
+        with self.lock:
+            if self.stopped.is_set():
+                return True
+            self.player.start(clip)
+        if on_start is not None:
+            on_start()
+        self.player.wait()
+        return self.stopped.is_set()
+
+    def stop(self):
+        with self.lock:
+            self.stopped.set()
+            self.player.stop()
+        self.voice_engine.stop()
+
+    def reset(self):
+        self.stopped.clear()
+        self.voice_engine.reset()
+
+
+class NullVoiceEngine:
+    """Voice backend that stays silent, for headless runs"""
+    def speak(self, audio:str, on_start=None):
+        if on_start is not None:
+            on_start()
+        return False
+
+    def stop(self):
+        pass
+
+    def reset(self):
+        pass
+
+
+class RecordingVoiceEngine:
+    """Voice backend that records what would be said, speech taking `duration` seconds unless stopped"""
+    def __init__(self, duration=0.0, clock=time.monotonic) -> None:
+        self.duration = duration
+        self.clock = clock
+        self.spoken = []
+        self.interrupted = []
+        self.stopped = threading.Event()
+
+    def speak(self, audio:str, on_start=None):
+        if self.stopped.is_set():
+            self.interrupted.append(audio)
+            return True
+        self.spoken.append((self.clock(), audio))
+        if on_start is not None:
+            on_start()
+        if self.stopped.wait(self.duration):
+            self.interrupted.append(audio)
+            return True
+        return False
+
+    def stop(self):
+        self.stopped.set()
+
+    def reset(self):
+        self.stopped.clear()
 
         
         
\ No newline at end of file
@@ -0,0 +1,184 @@
+import json
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from roadsense_ai.drowsiness_detection import drowsiness_detection
+from roadsense_ai.head_pose_estimation import head_pose_estimation
+from roadsense_ai.landmark_provider import landmark_provider
+from roadsense_ai.pipeline import pipeline
+from roadsense_ai.replay import replay
+
+
+NUM_LANDMARKS = 478
+
+
+def synthetic_landmarks(seed=0):
+    """Random landmarks inside the image, shaped like a FaceMesh result"""
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0.3, 0.7, (NUM_LANDMARKS, 3)).astype(np.float32)
+
+def rotation_matrix(x, y):
+    """Rotation by x degrees about the x axis, then y degrees about the y axis, as RQDecomp3x3 decomposes"""
+    x, y = np.radians(x), np.radians(y)
+    rot_x = np.array([[1, 0, 0], [0, np.cos(x), -np.sin(x)], [0, np.sin(x), np.cos(x)]])
+    rot_y = np.array([[np.cos(y), 0, np.sin(y)], [0, 1, 0], [-np.sin(y), 0, np.cos(y)]])
+    return rot_y @ rot_x
+
+def synthetic_head_poses(frames=600, img_w=1280, img_h=720, noise_px=0.4, seed=0):
+    """Landmark arrays of a face slowly turning in front of the camera, and the true (pitch, yaw)"""
+    rng = np.random.default_rng(seed)
+    head_pose_detector = head_pose_estimation.HeadPoseEstimator()
+    cam_matrix = head_pose_estimation.get_camera_matrix(img_h, img_w)
+    t = np.arange(frames) / 30.0
+    truth = np.column_stack((8 * np.sin(t * 0.7), 25 * np.sin(t * 0.4)))
+    landmarks = np.tile(synthetic_landmarks(), (frames, 1, 1))
+    for frame, (pitch, yaw) in enumerate(truth):
+        # to_head_angles flips the signs of the model rotation
+        rot_vec, _ = cv2.Rodrigues(rotation_matrix(-pitch, -yaw))
+        points, _ = cv2.projectPoints(head_pose_detector.model_points, rot_vec, np.array([0.0, 0.0, 600.0]),
+                                      cam_matrix, None)
+        points = points[:, 0] + rng.normal(0, noise_px, (len(points), 2))
+        landmarks[frame, head_pose_detector.target_idxs, :2] = points / (img_w, img_h)
+        landmarks[frame, head_pose_detector.target_idxs, 2] = head_pose_detector.model_points[:, 2] / img_w
+    return landmarks, truth
+
+
+def run_frame_path(cap, frame_buffer, display_buffer, detection_pipeline, frames):
+    """The live loop on one thread: capture, track, publish the overlay and display it.
+
+    Returns the largest transient allocation of a frame and how much traced memory grew, in bytes.
+    """
+    peaks = []
+    tracemalloc.start()
+    begin = tracemalloc.get_traced_memory()[0]
+    for index in range(frames):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        dst = frame_buffer.acquire()
+        ok, image = cap.read(dst)
+        if not ok:
+            # A failed read returns no image, the recording starts over in the same array
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, image = cap.read(dst)
+        frame_buffer.publish(image, index / 30.0)
+        frame = frame_buffer.get_latest(frame_buffer.sequence - 1)
+        detection_pipeline.process_frame(frame.image, frame.timestamp, annotate=True)
+        frame_buffer.release(frame)
+        display_buffer.publish(detection_pipeline.overlay, frame.timestamp)
+        shown = display_buffer.get_latest(display_buffer.sequence - 1)
+        display_buffer.release(shown)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    growth = tracemalloc.get_traced_memory()[0] - begin
+    tracemalloc.stop()
+    return max(peaks), growth
+
+
+EYE_WIDTH = 40
+DRIVE_FRAMES = 150
+DRIVE_SIZE = (320, 240)
+
+
+def set_eyes(landmarks, ear, img_w, img_h):
+    """Place the eye landmarks of every frame so each eye has the given EAR, keeping the head pose targets"""
+    targets = head_pose_estimation.HeadPoseEstimator().target_landmarks
+    for eye in drowsiness_detection.DrowsinessDetector().eye_idxs.values():
+        # One corner of each eye is a head pose target, the other corner is placed beside it
+        anchor, other = (eye[3], eye[0]) if eye[3] in targets else (eye[0], eye[3])
+        anchor_px = landmarks[:, anchor, :2] * (img_w, img_h)
+        landmarks[:, other, :2] = (anchor_px + (EYE_WIDTH, 0)) / (img_w, img_h)
+        p1, p4 = landmarks[:, eye[0], :2] * (img_w, img_h), landmarks[:, eye[3], :2] * (img_w, img_h)
+        half_height = np.column_stack((np.zeros(len(ear)), ear * EYE_WIDTH / 2))
+        for top, bottom, fraction in (eye[1], eye[5], 1 / 3), (eye[2], eye[4], 2 / 3):
+            middle = p1 + (p4 - p1) * fraction
+            landmarks[:, top, :2] = (middle - half_height) / (img_w, img_h)
+            landmarks[:, bottom, :2] = (middle + half_height) / (img_w, img_h)
+
+def get_drive():
+    """Landmarks and face presence of a driver turning their head, closing their eyes for 1.7 s and leaving the frame"""
+    landmarks, _ = synthetic_head_poses(DRIVE_FRAMES, *DRIVE_SIZE)
+    ear = np.full(DRIVE_FRAMES, 0.35)
+    ear[30:80] = 0.1
+    set_eyes(landmarks, ear, *DRIVE_SIZE)
+    present = np.ones(DRIVE_FRAMES, dtype=bool)
+    present[100:135] = False
+    return landmarks, present
+
+def get_segment_provider(start, stop):
+    """ReplayProvider of frames [start, stop) of the drive, picklable for the parallel workers"""
+    landmarks, present = get_drive()
+    return landmark_provider.ReplayProvider(landmarks[start:stop], present[start:stop])
+
+def get_drive_provider():
+    """ReplayProvider of the whole drive, picklable for an inference worker"""
+    return landmark_provider.ReplayProvider(*get_drive())
+
+def write_video(path, frames=DRIVE_FRAMES, size=DRIVE_SIZE, fps=30.0):
+    """A noise video the drive's landmarks are replayed over"""
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    rng = np.random.default_rng(0)
+    for _ in range(frames):
+        writer.write(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+def read_timeline(path):
+    with open(path) as timeline:
+        return timeline.read()
+
+def get_events(timeline):
+    """(alert, state) pairs of the events in a JSONL timeline"""
+    return {(event["type"], event["state"]) for record in map(json.loads, timeline.splitlines())
+            for event in record["events"]}
+
+
+def synthetic_ear(frames, fps=30.0, blink_every=4.0, blink_seconds=0.15, seed=0):
+    """EAR of a driver who blinks regularly, with noise and some frames without a face"""
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(frames) / fps
+    ear = 0.3 + rng.normal(0, 0.01, frames)
+    ear[timestamps % blink_every < blink_seconds] = 0.15
+    missing = rng.random(frames) < 0.01
+    return timestamps, [None if gone else float(value) for gone, value in zip(missing, ear)]
+
+def rescan_perclos(timestamps, ear, window, closed_thresh, max_gap):
+    """PERCLOS of the last window seconds, recomputed from the whole history"""
+    last = None
+    observed = closed = 0.0
+    for timestamp, value in zip(timestamps, ear):
+        gap = 0.0 if last is None else timestamp - last
+        last = timestamp
+        if value is None or timestamp < timestamps[-1] - window or not 0.0 < gap <= max_gap:
+            continue
+        observed += gap
+        closed += gap * (value < closed_thresh)
+    return closed / observed
+
+
+def synthetic_session(minutes=30.0, seed=0):
+    """timestamp, ear, pitch, yaw arrays of a drive with jittery frame times and face losses"""
+    rng = np.random.default_rng(seed)
+    frames = int(minutes * 60 * 30)
+    index = np.arange(frames)
+    timestamps = np.cumsum(rng.uniform(0.02, 0.045, frames))
+    ear = 0.27 + 0.08 * np.sin(index / 200) + rng.normal(0, 0.02, frames)
+    pitch = 12 * np.sin(index / 300) + rng.normal(0, 2, frames)
+    yaw = 15 * np.sin(index / 450 + 1) + rng.normal(0, 2, frames)
+    missing = index // 100 % 37 == 5
+    for values in (ear, pitch, yaw):
+        values[missing] = np.nan
+    return timestamps, ear, pitch, yaw
+
+def get_measurements(timestamps, ear, pitch, yaw):
+    """FrameMeasurements of a synthetic session, None where the face was missing"""
+    for row in zip(timestamps.tolist(), ear.tolist(), pitch.tolist(), yaw.tolist()):
+        yield pipeline.FrameMeasurement(*(None if np.isnan(value) else value for value in row))
+
+def run_pipeline(timestamps, ear, pitch, yaw, forward, settings):
+    """Per-frame drowsiness and head pose alarms of DetectionPipeline with one set of settings"""
+    detection_pipeline = pipeline.DetectionPipeline(None)
+    replay.apply_settings(detection_pipeline, settings)
+    detection_pipeline.head_pose_detector.forward_x, detection_pipeline.head_pose_detector.forward_y = forward
+    results = [detection_pipeline.update(measurement) for measurement in get_measurements(timestamps, ear, pitch, yaw)]
+    return np.array([result.drowsy for result in results]), np.array([result.head_pose for result in results])
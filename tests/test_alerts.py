@@ -0,0 +1,87 @@
+import threading
+import time
+
+from roadsense_ai.alerts import alerts
+from roadsense_ai.voice_engine import voice_engine
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+class GatedVoiceEngine(voice_engine.RecordingVoiceEngine):
+    """Holds each phrase until the gate opens, to push alerts before speech starts"""
+    def __init__(self, duration=0.0):
+        super().__init__(duration)
+        self.gate = threading.Event()
+        self.waiting = threading.Event()
+
+    def speak(self, audio, on_start=None):
+        self.waiting.set()
+        self.gate.wait()
+        return super().speak(audio, on_start)
+
+
+class DeafVoiceEngine(voice_engine.RecordingVoiceEngine):
+    """Ignores stop(), every phrase plays to the end"""
+    def stop(self):
+        pass
+
+
+def test_sustained_alert_waits_for_cooldown_after_speech():
+    backend = voice_engine.RecordingVoiceEngine(duration=0.2)
+    scheduler = alerts.AlertScheduler(backend, cooldowns={"drowsiness_detect": 0.5})
+    scheduler.start()
+    try:
+        end = time.monotonic() + 1.0
+        while time.monotonic() < end:
+            scheduler.raise_alert("drowsiness_detect")
+            time.sleep(0.01)
+    finally:
+        scheduler.stop()
+
+    times = [spoken_at for spoken_at, _ in backend.spoken]
+    assert len(times) == 2
+    # Speech takes 0.2 s, the cooldown starts once it ended
+    assert times[1] - times[0] >= 0.2 + 0.5 - 0.02
+
+
+def test_stop_before_speech_starts_preempts():
+    backend = GatedVoiceEngine(duration=0.05)
+    scheduler = alerts.AlertScheduler(backend)
+    scheduler.start()
+    try:
+        head_pose = scheduler.raise_alert("head_pose_detect")
+        backend.waiting.wait(2.0)
+        drowsiness = scheduler.raise_alert("drowsiness_detect")
+        backend.gate.set()
+        assert head_pose.done.wait(2.0) and drowsiness.done.wait(2.0)
+    finally:
+        scheduler.stop()
+
+    assert head_pose.preempted and not drowsiness.preempted
+    assert [text for _, text in backend.spoken] == [drowsiness.text]
+    assert "head_pose_detect" not in scheduler.last_spoken
+    assert scheduler.counts["preempted"] == 1
+
+
+def test_phrase_that_played_to_the_end_gets_cooldown():
+    backend = DeafVoiceEngine(duration=0.05)
+    scheduler = alerts.AlertScheduler(backend)
+    scheduler.start()
+    try:
+        head_pose = scheduler.raise_alert("head_pose_detect")
+        wait_until(lambda: backend.spoken)
+        drowsiness = scheduler.raise_alert("drowsiness_detect")
+        assert head_pose.done.wait(2.0) and drowsiness.done.wait(2.0)
+        assert scheduler.raise_alert("head_pose_detect") is None
+    finally:
+        scheduler.stop()
+
+    assert not head_pose.preempted
+    assert "head_pose_detect" in scheduler.last_spoken
+    assert scheduler.counts["preempted"] == 0
+    assert scheduler.counts["cooling_down"] == 1
@@ -0,0 +1,159 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from roadsense_ai import app, responses
+from roadsense_ai.capture import capture
+from roadsense_ai.pipeline import pipeline
+
+
+class StubGUI:
+    """The parts of the GUI the tracking thread uses, with no Tk window"""
+    def __init__(self, driver_aid_system):
+        self.tracking_view = False
+        self.display_buffer = capture.LatestFrameBuffer(pool_consumers=1)
+
+
+class Announcement:
+    def __init__(self):
+        self.done = threading.Event()
+        self.done.set()
+
+
+class RecordingScheduler:
+    def __init__(self):
+        self.alerts = []
+        self.announced = []
+
+    def raise_alert(self, alert):
+        self.alerts.append(alert)
+
+    def announce(self, phrase):
+        self.announced.append(phrase)
+        return Announcement()
+
+
+class CrashingWorker:
+    """InferenceWorker whose process dies on the first `crashes` frames"""
+    def __init__(self, crashes, run_state, frames=3):
+        self.crashes = crashes
+        self.run_state = run_state
+        self.frames = frames
+        self.restarts = 0
+
+    def process_frame(self, frame, timestamp, detection_pipeline, annotate=True):
+        if self.crashes:
+            self.crashes -= 1
+            raise BrokenPipeError("worker died")
+        self.frames -= 1
+        if not self.frames:
+            self.run_state.shutdown()
+        return detection_pipeline.update(pipeline.FrameMeasurement(timestamp, 0.3, 0.0, 0.0))
+
+    def restart(self):
+        self.restarts += 1
+
+
+class CountingWorker:
+    """InferenceWorker counting the frames tracking hands it"""
+    def __init__(self):
+        self.frames = 0
+
+    def process_frame(self, frame, timestamp, detection_pipeline, annotate=True):
+        self.frames += 1
+        return detection_pipeline.update(pipeline.FrameMeasurement(timestamp, 0.3, 0.0, 0.0))
+
+
+class FacelessWorker:
+    """InferenceWorker that finds no face"""
+    def analyze(self, frame, timestamp, detection_pipeline):
+        return None, pipeline.FrameMeasurement(timestamp, None, None, None)
+
+
+@pytest.fixture
+def driver_aid_system(monkeypatch):
+    monkeypatch.setattr(app.GUI, "GUI", StubGUI)
+    system = app.DriverAidSystem()
+    system.alert_scheduler = RecordingScheduler()
+    return system
+
+
+def run_tracking(system):
+    """Run the tracking thread with a camera publishing frames until it returns"""
+    tracking_thread = threading.Thread(target=system.track)
+    system.run_state.start()
+    tracking_thread.start()
+    index = 0
+    while tracking_thread.is_alive():
+        image = system.frame_buffer.acquire()
+        system.frame_buffer.publish(np.zeros((48, 64, 3), dtype=np.uint8) if image is None else image, index / 30.0)
+        index += 1
+        tracking_thread.join(0.005)
+        assert index < 2000, "tracking did not return"
+
+
+def publish_frames(system, seconds):
+    """Publish camera frames at about 200 fps for a while"""
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        image = system.frame_buffer.acquire()
+        system.frame_buffer.publish(np.zeros((48, 64, 3), dtype=np.uint8) if image is None else image, time.monotonic())
+        time.sleep(0.005)
+
+
+def test_tracking_waits_while_stopped_or_paused(driver_aid_system):
+    worker = driver_aid_system.inference_worker = CountingWorker()
+    run_state = driver_aid_system.run_state
+    tracking_thread = threading.Thread(target=driver_aid_system.track)
+    tracking_thread.start()
+    try:
+        publish_frames(driver_aid_system, 0.1)
+        assert worker.frames == 0
+
+        run_state.start()
+        publish_frames(driver_aid_system, 0.1)
+        assert worker.frames > 0
+
+        run_state.pause()
+        # A frame that was already being tracked may still finish
+        publish_frames(driver_aid_system, 0.05)
+        frames = worker.frames
+        publish_frames(driver_aid_system, 0.1)
+        assert worker.frames == frames
+    finally:
+        # Paused, no frame arrives to end the wait, the shutdown wakes it
+        begin = time.monotonic()
+        run_state.shutdown()
+        tracking_thread.join(5)
+    assert not tracking_thread.is_alive() and time.monotonic() - begin < 0.3
+
+
+def test_crashed_worker_is_restarted(driver_aid_system):
+    worker = driver_aid_system.inference_worker = CrashingWorker(2, driver_aid_system.run_state)
+    run_tracking(driver_aid_system)
+    assert worker.restarts == 2 and worker.frames == 0
+    assert driver_aid_system.errors.empty()
+    assert "worker_restart" in driver_aid_system.profiler.stages
+
+
+def test_tracking_stops_after_max_restarts(driver_aid_system):
+    worker = driver_aid_system.inference_worker = CrashingWorker(100, driver_aid_system.run_state)
+    run_tracking(driver_aid_system)
+    assert worker.restarts == app.DriverAidSystem.MAX_WORKER_RESTARTS
+    assert "inference worker failed" in driver_aid_system.errors.get_nowait()
+    assert driver_aid_system.alert_scheduler.announced == [responses.prompts["tracking_failed"]]
+
+
+def test_callibration_without_a_face_keeps_the_forward_direction(driver_aid_system):
+    driver_aid_system.inference_worker = FacelessWorker()
+    head_pose_detector = driver_aid_system.head_pose_detector
+    head_pose_detector.forward_x, head_pose_detector.forward_y = 2.0, -3.0
+    driver_aid_system.ready.set()
+    frame_buffer = driver_aid_system.frame_buffer
+    camera = threading.Timer(0.05, frame_buffer.publish, (np.zeros((48, 64, 3), dtype=np.uint8), 0.0))
+    camera.start()
+    driver_aid_system.callibrate()
+    camera.join()
+    assert (head_pose_detector.forward_x, head_pose_detector.forward_y) == (2.0, -3.0)
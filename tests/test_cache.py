@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from roadsense_ai.frame_analysis import frame_analysis
+from roadsense_ai.landmark_provider import landmark_provider
+from roadsense_ai.replay import cache, replay
+
+from . import synthetic
+
+
+def get_analyses(num_landmarks=478, frames=6):
+    """Analyses without images, the first two and the fifth without a face"""
+    rng = np.random.default_rng(0)
+    return [frame_analysis.FrameAnalysis(
+        None, None if index in (0, 1, 4) else rng.random((num_landmarks, 3)).astype(np.float32),
+        index / 30.0, image_size=(640, 480)) for index in range(frames)]
+
+def write_entry(path, analyses, dtype=np.float32):
+    writer = cache.LandmarkCacheWriter(str(path), dtype)
+    for analysis in analyses:
+        writer.write(analysis)
+    writer.close()
+    return cache.open_cache(str(path))
+
+
+@pytest.mark.parametrize("num_landmarks", [478, 468])
+def test_entry_round_trip(tmp_path, num_landmarks):
+    analyses = get_analyses(num_landmarks)
+    landmark_cache = write_entry(tmp_path / "entry", analyses)
+    assert len(landmark_cache) == len(analyses)
+    assert landmark_cache.landmarks.shape == (len(analyses), num_landmarks, 3)
+    for expected, analysis in zip(analyses, landmark_cache.iter_analyses()):
+        assert analysis.timestamp == expected.timestamp
+        assert (analysis.img_w, analysis.img_h) == (640, 480)
+        assert analysis.face_found == expected.face_found
+        if expected.face_found:
+            np.testing.assert_array_equal(analysis.landmarks, expected.landmarks)
+
+
+def test_float16_entry_is_close(tmp_path):
+    analyses = get_analyses()
+    landmark_cache = write_entry(tmp_path / "entry", analyses, np.float16)
+    for expected, analysis in zip(analyses[2:4], list(landmark_cache.iter_analyses())[2:4]):
+        np.testing.assert_allclose(analysis.landmarks, expected.landmarks, atol=1e-3)
+
+
+def test_entry_without_faces(tmp_path):
+    landmark_cache = write_entry(tmp_path / "entry", [analysis for analysis in get_analyses() if not analysis.face_found])
+    assert len(landmark_cache) == 3
+    assert not any(analysis.face_found for analysis in landmark_cache.iter_analyses())
+
+
+def test_landmark_count_change_is_refused(tmp_path):
+    writer = cache.LandmarkCacheWriter(str(tmp_path / "entry"))
+    writer.write(get_analyses(478)[2])
+    with pytest.raises(ValueError):
+        writer.write(get_analyses(468)[2])
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_entry_only_appears_once_closed(tmp_path):
+    path = str(tmp_path / "entry")
+    writer = cache.LandmarkCacheWriter(path)
+    writer.write(get_analyses()[2])
+    assert cache.open_cache(path) is None
+    writer.close()
+    assert len(cache.open_cache(path)) == 1
+
+
+def test_cached_measurements_match_the_model(tmp_path):
+    video = synthetic.write_video(tmp_path / "drive.avi")
+    path = str(tmp_path / "entry")
+    writer = cache.LandmarkCacheWriter(path)
+    provider = landmark_provider.ReplayProvider(*synthetic.get_drive())
+    measured = [measurement.to_tuple() for measurement in replay.measure_frames(video, provider=provider,
+                                                                                cache_writer=writer)]
+    writer.close()
+    cached = [measurement.to_tuple() for measurement in replay.measure_cached_frames(cache.open_cache(path))]
+    assert len(cached) == len(measured)
+    for row, expected in zip(cached, measured):
+        # Timestamps and EARs are exact, the batch head pose solver differs in the last digits
+        assert row[:2] == expected[:2]
+        assert row[2:] == (expected[2:] if expected[2] is None else pytest.approx(expected[2:], abs=1e-9))
+
+
+def test_cache_key_changes_with_the_recording_and_settings(tmp_path):
+    video = tmp_path / "drive.avi"
+    video.write_bytes(b"frames")
+    key = cache.get_cache_key(str(video))
+    assert cache.get_cache_key(str(video)) == key
+    for settings in ({"fps": 25.0}, {"static_image_mode": True}, {"roi": True}, {"max_input_size": 480},
+                     {"dtype": np.float16}):
+        assert cache.get_cache_key(str(video), **settings) != key, settings
+
+    video.write_bytes(b"other frames")
+    assert cache.get_cache_key(str(video)) != key
@@ -0,0 +1,47 @@
+import numpy as np
+
+from roadsense_ai.capture import capture
+
+
+class FlakyCapture:
+    """cv2.VideoCapture whose reads fail at the given read indexes, ending after `frames` reads"""
+    def __init__(self, failures, frames):
+        self.failures = set(failures)
+        self.frames = frames
+        self.reads = 0
+
+    def read(self, image=None):
+        index = self.reads
+        self.reads += 1
+        if index in self.failures or index >= self.frames:
+            return False, None
+        if image is None:
+            image = np.empty((4, 4, 3), dtype=np.uint8)
+        image[:] = index % 256
+        return True, image
+
+
+def run_capture(cap, live, stop_after=None):
+    frame_buffer = capture.LatestFrameBuffer(size=16, pool_consumers=1)
+    capture_thread = capture.CaptureThread(cap, frame_buffer, live=live)
+    capture_thread.RETRY_DELAY = capture_thread.MAX_RETRY_DELAY = 0.001
+    capture_thread.start()
+    if stop_after is not None:
+        while frame_buffer.sequence < stop_after:
+            frame_buffer.get_latest(frame_buffer.sequence, timeout=1.0)
+        capture_thread.stop()
+    capture_thread.thread.join(2.0)
+    assert not capture_thread.thread.is_alive()
+    return capture_thread, frame_buffer
+
+
+def test_recording_ends_on_first_failed_read():
+    capture_thread, frame_buffer = run_capture(FlakyCapture([3], 10), live=False)
+    assert frame_buffer.closed
+    assert frame_buffer.sequence == 3
+
+
+def test_live_camera_survives_failed_reads():
+    capture_thread, frame_buffer = run_capture(FlakyCapture([3, 4, 5], 10 ** 6), live=True, stop_after=8)
+    assert capture_thread.failures == 3
+    assert frame_buffer.sequence >= 8
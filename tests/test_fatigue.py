@@ -0,0 +1,45 @@
+from roadsense_ai.fatigue import fatigue
+
+from . import synthetic
+
+
+def run_monitor(monitor, timestamps, ear, checks):
+    """Feed the frames to the monitor, comparing its PERCLOS with a rescan of the history at every check"""
+    for index, (timestamp, value) in enumerate(zip(timestamps, ear)):
+        monitor.update(timestamp, value, 0.0, 0.0, 0.24)
+        if index in checks:
+            expected = synthetic.rescan_perclos(timestamps[:index + 1], ear[:index + 1], monitor.window, 0.24,
+                                                monitor.MAX_FRAME_GAP)
+            assert abs(monitor.perclos - expected) < 1e-5, index
+
+
+def test_perclos_matches_rescan():
+    timestamps, ear = synthetic.synthetic_ear(30 * 120)
+    monitor = fatigue.FatigueMonitor(window=20.0)
+    # Before the window is full, and after frames started leaving it
+    run_monitor(monitor, timestamps, ear, {100, 599, 600, 601, 1799, 3599})
+
+
+def test_perclos_skips_gaps():
+    timestamps, ear = synthetic.synthetic_ear(30 * 60)
+    timestamps = timestamps.copy()
+    # A second with no frames at all, counting for neither open nor closed eyes
+    timestamps[900:] += 1.0
+    monitor = fatigue.FatigueMonitor(window=20.0)
+    run_monitor(monitor, timestamps, ear, {899, 900, 901, 1200, 1799})
+
+
+def test_blink_statistics():
+    timestamps, ear = synthetic.synthetic_ear(30 * 60, blink_every=4.0)
+    ear = [0.3 if value is None else value for value in ear]
+    monitor = fatigue.FatigueMonitor(window=20.0)
+    for timestamp, value in zip(timestamps, ear):
+        monitor.update(timestamp, value)
+
+    stats = monitor.stats()
+    # A blink every 4 s, each 5 frames of closed eyes
+    assert stats["blinks"] == 5
+    assert abs(stats["mean_blink_interval"] - 4.0) < 1e-6
+    assert abs(stats["mean_blink_duration"] - 5 / 30) < 1e-6
+    assert abs(stats["perclos"] - 5 / 120) < 0.01
+    assert not monitor.alert
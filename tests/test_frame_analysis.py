@@ -0,0 +1,100 @@
+import numpy as np
+
+from roadsense_ai.frame_analysis import frame_analysis
+from roadsense_ai.landmark_provider import landmark_provider
+
+from . import synthetic
+
+
+IMG_W, IMG_H = 640, 480
+
+
+class CountingProvider(landmark_provider.ReplayProvider):
+    """ReplayProvider that keeps the size of every image it was given"""
+    def __init__(self, landmarks, present=None):
+        super().__init__(landmarks, present)
+        self.shapes = []
+
+    def detect(self, image, timestamp=None):
+        self.shapes.append(image.shape[:2])
+        return super().detect(image, timestamp)
+
+
+def get_face(shift=(0.0, 0.0), scale=1.0):
+    """Full-frame landmarks of a face around the image centre, moved by shift pixels"""
+    landmarks = synthetic.synthetic_landmarks()
+    landmarks[:, :2] = (landmarks[:, :2] - 0.5) * scale + 0.5 + np.divide(shift, (IMG_W, IMG_H))
+    return landmarks
+
+def to_crop(landmarks, crop):
+    """Landmarks as the model finds them in a crop of the frame, normalized to the crop"""
+    x0, y0, x1, y1 = crop
+    cropped = landmarks.copy()
+    cropped[:, 0] = (landmarks[:, 0] * IMG_W - x0) / (x1 - x0)
+    cropped[:, 1] = (landmarks[:, 1] * IMG_H - y0) / (y1 - y0)
+    cropped[:, 2] = landmarks[:, 2] * IMG_W / (x1 - x0)
+    return cropped
+
+def get_analyzer(full_frame, crops, present=None, max_input_size=None):
+    provider = CountingProvider(np.array(full_frame))
+    roi_provider = CountingProvider(np.array(crops), present)
+    return frame_analysis.FrameAnalyzer(provider, roi=True, max_input_size=max_input_size, roi_provider=roi_provider)
+
+
+def test_crop_landmarks_are_mapped_to_the_full_frame():
+    face = get_face()
+    crop = (100, 50, 420, 370)
+    analyzer = get_analyzer([face], [to_crop(face, crop)], max_input_size=160)
+    analyzer.crop = crop
+    image = np.zeros((IMG_H, IMG_W, 3), dtype=np.uint8)
+
+    landmarks = analyzer.find_landmarks(image)
+    np.testing.assert_allclose(landmarks, face, atol=1e-6)
+    # The model only saw the crop, downscaled to max_input_size
+    assert analyzer.roi_provider.shapes == [(160, 160)]
+    assert analyzer.provider.shapes == []
+
+
+def test_crop_is_kept_while_the_face_stays_inside():
+    analyzer = get_analyzer([], [])
+    face = get_face()
+    analyzer.update_crop(face, IMG_W, IMG_H)
+    crop = analyzer.crop
+    assert crop == frame_analysis.get_face_crop(face, IMG_W, IMG_H, analyzer.roi_margin)
+
+    analyzer.update_crop(get_face(shift=(5, -5)), IMG_W, IMG_H)
+    assert analyzer.crop == crop
+
+    # Past the inner margin the crop follows the face
+    moved = get_face(shift=(120, 0))
+    analyzer.update_crop(moved, IMG_W, IMG_H)
+    assert analyzer.crop == frame_analysis.get_face_crop(moved, IMG_W, IMG_H, analyzer.roi_margin)
+
+    # A face that got much smaller gets a tighter crop
+    far = get_face(shift=(120, 0), scale=0.5)
+    analyzer.update_crop(far, IMG_W, IMG_H)
+    assert analyzer.crop == frame_analysis.get_face_crop(far, IMG_W, IMG_H, analyzer.roi_margin)
+
+    analyzer.update_crop(None, IMG_W, IMG_H)
+    assert analyzer.crop is None
+
+
+def test_lost_face_falls_back_to_a_full_frame_search():
+    face = get_face()
+    crop = frame_analysis.get_face_crop(face, IMG_W, IMG_H, 0.5)
+    moved = get_face(shift=(150, 0))
+    # Frame 0: full frame, frame 1: found in the crop, frame 2: lost in the crop and found in the full frame
+    analyzer = get_analyzer([face, moved], [to_crop(face, crop), face], present=[True, False])
+    image = np.zeros((IMG_H, IMG_W, 3), dtype=np.uint8)
+
+    first = analyzer.find_landmarks(image)
+    assert analyzer.crop == crop
+    second = analyzer.find_landmarks(image)
+    third = analyzer.find_landmarks(image)
+
+    np.testing.assert_allclose(first, face, atol=1e-6)
+    np.testing.assert_allclose(second, face, atol=1e-6)
+    np.testing.assert_allclose(third, moved, atol=1e-6)
+    assert analyzer.provider.shapes == [(IMG_H, IMG_W)] * 2
+    assert analyzer.roi_provider.shapes == [(crop[3] - crop[1], crop[2] - crop[0])] * 2
+    assert analyzer.crop == frame_analysis.get_face_crop(moved, IMG_W, IMG_H, 0.5)
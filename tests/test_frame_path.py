@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+from roadsense_ai.capture import capture
+from roadsense_ai.frame_analysis import frame_analysis
+from roadsense_ai.landmark_provider import landmark_provider
+from roadsense_ai.pipeline import pipeline
+
+from . import synthetic
+
+
+class StubCapture:
+    """cv2.VideoCapture over a short list of frames, failing one read at the end like a file does"""
+    def __init__(self, frames):
+        self.frames = frames
+        self.position = 0
+
+    def read(self, image=None):
+        if self.position == len(self.frames):
+            return False, None
+        frame = self.frames[self.position]
+        self.position += 1
+        if image is None or image.shape != frame.shape:
+            return True, frame.copy()
+        np.copyto(image, frame)
+        return True, image
+
+    def set(self, prop, value):
+        assert prop == cv2.CAP_PROP_POS_FRAMES
+        self.position = int(value)
+
+
+def get_frame_path(img_w=1280, img_h=720, clip_frames=40):
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (img_h, img_w, 3), dtype=np.uint8) for _ in range(clip_frames)]
+    landmarks, _ = synthetic.synthetic_head_poses(60, img_w, img_h)
+    provider = landmark_provider.ReplayProvider(landmarks, loop=True)
+    detection_pipeline = pipeline.DetectionPipeline(frame_analysis.FrameAnalyzer(provider))
+    frame_buffer = capture.LatestFrameBuffer(pool_consumers=1)
+    display_buffer = capture.LatestFrameBuffer(pool_consumers=1)
+    detection_pipeline.overlay_pool = display_buffer.pool
+    return StubCapture(frames), frame_buffer, display_buffer, detection_pipeline
+
+
+def test_pooled_frame_path_allocates_no_frames():
+    cap, frame_buffer, display_buffer, detection_pipeline = get_frame_path()
+    synthetic.run_frame_path(cap, frame_buffer, display_buffer, detection_pipeline, 20)
+    misses = frame_buffer.pool.misses, display_buffer.pool.misses
+
+    # Loops over the 40-frame clip twice
+    peak, growth = synthetic.run_frame_path(cap, frame_buffer, display_buffer, detection_pipeline, 100)
+    frame_size = 1280 * 720 * 3
+    assert peak < frame_size / 8
+    assert growth < frame_size / 8
+    assert (frame_buffer.pool.misses, display_buffer.pool.misses) == misses
+
+
+def test_allocating_frame_path_is_measured():
+    cap, _, _, detection_pipeline = get_frame_path()
+    frame_buffer, display_buffer = capture.LatestFrameBuffer(), capture.LatestFrameBuffer()
+    detection_pipeline.overlay_pool = None
+    synthetic.run_frame_path(cap, frame_buffer, display_buffer, detection_pipeline, 5)
+    peak, _ = synthetic.run_frame_path(cap, frame_buffer, display_buffer, detection_pipeline, 5)
+    assert peak >= 1280 * 720 * 3
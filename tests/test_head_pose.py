@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+
+from roadsense_ai.frame_analysis import frame_analysis
+from roadsense_ai.head_pose_estimation import head_pose_estimation
+
+from . import synthetic
+
+
+def test_euler_angles_match_rq_decomposition():
+    rng = np.random.default_rng(0)
+    rot_vecs = np.concatenate((rng.normal(0, 0.6, (500, 3)), np.zeros((1, 3)), rng.normal(0, 1e-9, (5, 3))))
+    angles = head_pose_estimation.get_euler_angles(rot_vecs)
+    expected = np.array([cv2.RQDecomp3x3(cv2.Rodrigues(rot_vec)[0])[0] for rot_vec in rot_vecs])
+    np.testing.assert_allclose(angles, expected, atol=1e-6)
+
+
+def test_euler_angles_of_known_rotations():
+    rot_vecs = np.array([cv2.Rodrigues(synthetic.rotation_matrix(x, y))[0].ravel()
+                         for x, y in ((0, 0), (20, 0), (0, -35), (-12, 40))])
+    angles = head_pose_estimation.get_euler_angles(rot_vecs)
+    np.testing.assert_allclose(angles[:, :2], [(0, 0), (20, 0), (0, -35), (-12, 40)], atol=1e-6)
+
+
+def test_batch_matches_per_frame_pose():
+    img_w, img_h = 1280, 720
+    landmarks, truth = synthetic.synthetic_head_poses(200, img_w, img_h)
+    present = np.ones(len(landmarks), dtype=bool)
+    present[50:60] = False
+    head_pose_detector = head_pose_estimation.HeadPoseEstimator()
+    pitch, yaw = head_pose_detector.measure_batch(landmarks, present, [(img_w, img_h)] * len(landmarks))
+
+    assert np.isnan(pitch[50:60]).all() and np.isnan(yaw[50:60]).all()
+    for frame in np.flatnonzero(present):
+        face_2d = head_pose_estimation.get_image_points(landmarks[frame], head_pose_detector.target_idxs, img_w, img_h)
+        x, y = head_pose_detector.solve_pose(face_2d, img_w, img_h)
+        assert abs(pitch[frame] - x) < 1e-6 and abs(yaw[frame] - y) < 1e-6
+    np.testing.assert_allclose(np.column_stack((pitch, yaw))[present], truth[present], atol=1.0)
+
+
+def test_positive_angles_are_up_and_right():
+    head_pose_detector = head_pose_estimation.HeadPoseEstimator()
+    x, y = head_pose_estimation.to_head_angles(-20.0, 0.0)
+    assert head_pose_detector.get_direction(x, y)[0] == "Up"
+    x, y = head_pose_estimation.to_head_angles(0.0, -20.0)
+    assert head_pose_detector.get_direction(x, y)[0] == "Right"
+
+
+def test_callibration_without_a_face_keeps_the_forward_direction():
+    head_pose_detector = head_pose_estimation.HeadPoseEstimator()
+    head_pose_detector.forward_x, head_pose_detector.forward_y = 2.0, -3.0
+    head_pose_detector.callibrate(frame_analysis.FrameAnalysis(None, None, 0.0, image_size=(640, 480)))
+    assert (head_pose_detector.forward_x, head_pose_detector.forward_y) == (2.0, -3.0)
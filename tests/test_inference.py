@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+import pytest
+
+from roadsense_ai.frame_analysis import frame_analysis
+from roadsense_ai.inference import inference
+from roadsense_ai.pipeline import pipeline
+
+from . import synthetic
+
+
+def get_frames(count):
+    rng = np.random.default_rng(0)
+    img_w, img_h = synthetic.DRIVE_SIZE
+    return [rng.integers(0, 256, (img_h, img_w, 3), dtype=np.uint8) for _ in range(count)]
+
+def get_local_pipeline():
+    return pipeline.DetectionPipeline(frame_analysis.FrameAnalyzer(synthetic.get_drive_provider()))
+
+def assert_same_frames(worker, frames, start=0):
+    """The worker's measurements and flipped frames equal the in-process pipeline's"""
+    detection_pipeline = pipeline.DetectionPipeline(None)
+    local_pipeline = get_local_pipeline()
+    for index, frame in enumerate(frames):
+        timestamp = (start + index) / 30.0
+        analysis, measurement = worker.analyze(frame, timestamp, detection_pipeline)
+        local_analysis, local_measurement = local_pipeline.analyze_frame(frame, timestamp)
+        assert measurement.to_tuple() == local_measurement.to_tuple()
+        np.testing.assert_array_equal(analysis.image, cv2.flip(frame, 1))
+        assert detection_pipeline.head_pose_detector.face_box == local_pipeline.head_pose_detector.face_box
+
+
+def test_worker_matches_in_process_pipeline():
+    worker = inference.InferenceWorker(get_provider=synthetic.get_drive_provider)
+    worker.start(*synthetic.DRIVE_SIZE)
+    try:
+        assert_same_frames(worker, get_frames(40))
+        # A new frame size maps a new ring in the same process
+        process = worker.process
+        small = [frame[:120, :160].copy() for frame in get_frames(2)]
+        worker.analyze(small[0], 0.0, pipeline.DetectionPipeline(None))
+        assert worker.ring.shape == small[0].shape and worker.process is process
+    finally:
+        worker.close()
+    assert worker.process is None and worker.ring is None
+
+
+def test_restart_recovers_a_killed_worker():
+    worker = inference.InferenceWorker(get_provider=synthetic.get_drive_provider)
+    frames = get_frames(10)
+    worker.start(*synthetic.DRIVE_SIZE)
+    try:
+        assert_same_frames(worker, frames[:3])
+        worker.process.kill()
+        worker.process.join()
+        with pytest.raises((EOFError, BrokenPipeError, ConnectionResetError)):
+            worker.analyze(frames[3], 0.1, pipeline.DetectionPipeline(None))
+
+        worker.restart()
+        assert worker.process.is_alive()
+        # The new worker has its own provider, starting from the first recorded frame
+        assert_same_frames(worker, frames)
+    finally:
+        worker.close()
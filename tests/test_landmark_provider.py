@@ -0,0 +1,153 @@
+import types
+
+import numpy as np
+import pytest
+from mediapipe.tasks.python import vision
+
+from roadsense_ai.frame_analysis import frame_analysis
+from roadsense_ai.landmark_provider import landmark_provider
+from roadsense_ai.replay import cache
+
+from . import synthetic
+
+
+IMAGE = np.zeros((48, 64, 3), dtype=np.uint8)
+
+
+def get_result(frame):
+    """A FaceLandmarker result with three landmarks telling which frame it came from"""
+    points = [types.SimpleNamespace(x=frame / 10, y=0.5, z=0.0) for _ in range(3)]
+    return types.SimpleNamespace(face_landmarks=[points])
+
+
+class FakeFaceLandmarker:
+    """Stands in for the Tasks model, live stream results arrive once the next image is queued"""
+    def __init__(self, options):
+        self.options = options
+        self.timestamps = []
+        self.closed = False
+
+    def detect_for_video(self, image, timestamp_ms):
+        self.timestamps.append(timestamp_ms)
+        return get_result(len(self.timestamps) - 1)
+
+    def detect_async(self, image, timestamp_ms):
+        if self.timestamps:
+            self.options.result_callback(get_result(len(self.timestamps) - 1), image, self.timestamps[-1])
+        self.timestamps.append(timestamp_ms)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_landmarker(monkeypatch):
+    monkeypatch.setattr(vision.FaceLandmarker, "create_from_options", FakeFaceLandmarker)
+
+
+def test_face_mesh_without_a_model_path():
+    provider = landmark_provider.get_landmark_provider(static_image_mode=True)
+    assert isinstance(provider, landmark_provider.FaceMeshProvider)
+    assert provider.synchronous and provider.settings["static_image_mode"]
+    provider.close()
+
+
+def test_face_landmarker_video(fake_landmarker):
+    provider = landmark_provider.get_landmark_provider("face_landmarker.task")
+    assert isinstance(provider, landmark_provider.FaceLandmarkerProvider)
+    options = provider.face_landmarker.options
+    assert options.running_mode == vision.RunningMode.VIDEO and options.result_callback is None
+    assert provider.synchronous
+
+    # Every image gets its own landmarks before detect() returns
+    for frame in range(3):
+        landmarks = provider.detect(IMAGE, frame / 30)
+        assert landmarks.dtype == np.float32 and landmarks.shape == (3, 3)
+        assert landmarks[0, 0] == pytest.approx(frame / 10)
+    assert provider.face_landmarker.timestamps == [0, 33, 66]
+
+
+def test_face_landmarker_live_stream(fake_landmarker):
+    provider = landmark_provider.get_landmark_provider("face_landmarker.task", "live_stream")
+    options = provider.face_landmarker.options
+    assert options.running_mode == vision.RunningMode.LIVE_STREAM and options.result_callback == provider.on_result
+    assert not provider.synchronous
+
+    # Nothing has finished for the first image, then each result lags its image by one frame
+    assert provider.detect(IMAGE, 0.0) is None
+    for frame in range(1, 4):
+        assert provider.detect(IMAGE, frame / 30)[0, 0] == pytest.approx((frame - 1) / 10)
+    assert provider.result_timestamp == pytest.approx(2 / 30, abs=1e-3)
+
+    clone = provider.clone()
+    assert clone.running_mode == "live_stream" and not clone.synchronous
+    assert clone.settings == provider.settings and clone.face_landmarker is not provider.face_landmarker
+    provider.close()
+    assert provider.face_landmarker.closed and not clone.face_landmarker.closed
+
+    # A late result cannot be mapped back from a face crop
+    with pytest.raises(ValueError, match="roi"):
+        frame_analysis.FrameAnalyzer(clone, roi=True)
+
+
+def test_unknown_running_mode_is_refused():
+    with pytest.raises(ValueError, match="running_mode"):
+        landmark_provider.get_landmark_provider("face_landmarker.task", "image")
+
+
+def test_timestamps_never_go_backwards(fake_landmarker):
+    provider = landmark_provider.FaceLandmarkerProvider("face_landmarker.task")
+    # Frames less than a millisecond apart, a repeated and an earlier timestamp are each moved past the last one
+    for timestamp in (1.0, 1.0004, 1.0004, 0.5, 2.0):
+        provider.detect(IMAGE, timestamp)
+    assert provider.face_landmarker.timestamps == [1000, 1001, 1002, 1003, 2000]
+    provider.detect(IMAGE)
+    assert provider.face_landmarker.timestamps[-1] > 2000
+
+
+def test_replay_hands_out_frames_in_order():
+    landmarks = np.stack([synthetic.synthetic_landmarks(seed) for seed in range(4)]).astype(np.float16)
+    present = np.array([True, False, True, True])
+    provider = landmark_provider.ReplayProvider(landmarks, present)
+    assert len(provider) == 4
+
+    # Timestamps are ignored, each call takes the next frame
+    results = [provider.detect(IMAGE, 10.0) for _ in range(5)]
+    assert results[1] is None and results[4] is None
+    for frame in (0, 2, 3):
+        assert results[frame].dtype == np.float32
+        np.testing.assert_array_equal(results[frame], landmarks[frame].astype(np.float32))
+    assert provider.index == 4
+
+    # The returned array is a copy, changing it leaves the recording alone
+    provider.index = 0
+    provider.detect(IMAGE)[:] = 0
+    np.testing.assert_array_equal(provider.landmarks[0], landmarks[0])
+
+
+def test_replay_loops():
+    landmarks = np.stack([synthetic.synthetic_landmarks(seed) for seed in range(2)])
+    provider = landmark_provider.ReplayProvider(landmarks, loop=True)
+    results = [provider.detect(IMAGE) for _ in range(5)]
+    for frame, result in enumerate(results):
+        np.testing.assert_array_equal(result, landmarks[frame % 2])
+    assert provider.index == 1
+
+
+def test_replay_from_cache(tmp_path):
+    landmarks, present = synthetic.get_drive()
+    frames = range(95, 105)
+    writer = cache.LandmarkCacheWriter(str(tmp_path / "entry"))
+    for frame in frames:
+        writer.write(frame_analysis.FrameAnalysis(None, landmarks[frame] if present[frame] else None, frame / 30.0,
+                                                  image_size=synthetic.DRIVE_SIZE))
+    writer.close()
+
+    provider = landmark_provider.ReplayProvider.from_cache(cache.open_cache(str(tmp_path / "entry")))
+    assert len(provider) == len(frames)
+    for frame in frames:
+        result = provider.detect(IMAGE)
+        if present[frame]:
+            np.testing.assert_array_equal(result, landmarks[frame])
+        else:
+            assert result is None
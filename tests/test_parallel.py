@@ -0,0 +1,25 @@
+from roadsense_ai.landmark_provider import landmark_provider
+from roadsense_ai.replay import parallel, replay
+
+from . import synthetic
+
+
+def test_sharded_timeline_matches_serial(tmp_path):
+    video = synthetic.write_video(tmp_path / "drive.avi")
+    serial, sharded = tmp_path / "serial.jsonl", tmp_path / "sharded.jsonl"
+    provider = landmark_provider.ReplayProvider(*synthetic.get_drive())
+    replay.write_timeline(replay.measure_frames(video, static_image_mode=True, provider=provider), serial)
+    # Segment boundaries fall inside the eye closure and the face loss
+    measurements = parallel.measure_frames_parallel(video, workers=2, segment_seconds=1.0,
+                                                    get_provider=synthetic.get_segment_provider)
+    replay.write_timeline(measurements, sharded)
+
+    timeline = synthetic.read_timeline(serial)
+    assert timeline == synthetic.read_timeline(sharded)
+    assert len(timeline.splitlines()) == synthetic.DRIVE_FRAMES
+    assert ("drowsiness_detect", "start") in synthetic.get_events(timeline)
+
+
+def test_segments_cover_the_source():
+    assert parallel.get_segments(100, 30) == [(0, 30), (30, 60), (60, 90), (90, None)]
+    assert parallel.get_segments(0, 30) == [(0, None)]
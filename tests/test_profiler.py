@@ -0,0 +1,79 @@
+import threading
+import time
+
+import numpy as np
+
+from roadsense_ai.frame_analysis import frame_analysis
+from roadsense_ai.landmark_provider import landmark_provider
+from roadsense_ai.pipeline import pipeline
+from roadsense_ai.profiler import profiler
+
+from . import synthetic
+
+
+def test_report_while_stages_are_added():
+    stage_profiler = profiler.StageProfiler(capacity=16)
+    stage_profiler.record("frame", time.perf_counter_ns())
+    stop = threading.Event()
+
+    def add_stages():
+        index = 0
+        while not stop.is_set():
+            stage_profiler.record(f"stage_{index}", time.perf_counter_ns())
+            index += 1
+            if index % 100 == 0:
+                stage_profiler.reset()
+
+    thread = threading.Thread(target=add_stages)
+    thread.start()
+    try:
+        for _ in range(200):
+            stage_profiler.report()
+            stage_profiler.fps()
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_stats():
+    stage_profiler = profiler.StageProfiler()
+    for index in range(11):
+        stage_profiler.record("frame", index * 100_000_000, index * 100_000_000 + 2_000_000)
+    stats = stage_profiler.stats("frame")
+    assert stats["count"] == 11
+    assert stats["p50_ms"] == 2.0
+    assert abs(stats["fps"] - 10.0) < 1e-9
+
+
+def test_threads_adding_the_same_stages():
+    stage_profiler = profiler.StageProfiler(capacity=4096)
+    threads = 8
+    barrier = threading.Barrier(threads)
+
+    def record():
+        barrier.wait()
+        for index in range(500):
+            stage_profiler.record(f"stage_{index % 50}", 0, 1)
+
+    workers = [threading.Thread(target=record) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    # Every sample lands in the one buffer of its stage
+    assert len(stage_profiler.stages) == 50
+    assert all(buffer.count == threads * 10 for buffer in stage_profiler.stages.values())
+    assert stage_profiler.stats("stage_0")["count"] == threads * 10
+
+
+def test_overlay_stages():
+    stage_profiler = profiler.StageProfiler()
+    provider = landmark_provider.ReplayProvider(*synthetic.get_drive())
+    detection_pipeline = pipeline.DetectionPipeline(frame_analysis.FrameAnalyzer(provider, stage_profiler), stage_profiler)
+    image = np.zeros((synthetic.DRIVE_SIZE[1], synthetic.DRIVE_SIZE[0], 3), dtype=np.uint8)
+    for index in range(3):
+        detection_pipeline.process_frame(image, index / 30.0, annotate=True)
+    detection_pipeline.process_frame(image, 0.1, annotate=False)
+    stages = stage_profiler.stages
+    assert stages["overlay"].count == stages["cvtcolor"].count == 3
+    assert stages["inference"].count == 4
@@ -0,0 +1,116 @@
+from roadsense_ai.frame_analysis import frame_analysis
+from roadsense_ai.landmark_provider import landmark_provider
+from roadsense_ai.pipeline import pipeline
+from roadsense_ai.qos import qos
+from roadsense_ai.tracking import tracking
+
+
+BUDGET = 0.03
+WINDOW = 5
+
+
+class FakeFaceMesh(landmark_provider.FaceMeshProvider):
+    """FaceMeshProvider settings and variants without loading the model"""
+    def __init__(self, refine_landmarks=True, **settings):
+        self.settings = dict(settings, refine_landmarks=refine_landmarks)
+        self.closed = False
+
+    def detect(self, image, timestamp=None):
+        return None
+
+    def clone(self, **settings):
+        return FakeFaceMesh(**{**self.settings, **settings})
+
+    def close(self):
+        self.closed = True
+
+
+class CpuLoad:
+    def __init__(self, load):
+        self.load = load
+
+    def __call__(self):
+        return self.load
+
+
+def get_governor(cpu_load=None):
+    detection_pipeline = pipeline.DetectionPipeline(frame_analysis.FrameAnalyzer(FakeFaceMesh()))
+    governor = qos.QosGovernor(detection_pipeline, BUDGET, window=WINDOW, cpu_load=cpu_load or CpuLoad(0.1))
+    # Every level can switch models right away
+    governor.loader.join()
+    return governor
+
+def observe(governor, latency, frames=WINDOW):
+    for _ in range(frames):
+        governor.observe(latency)
+
+
+def test_steps_down_while_over_budget():
+    governor = get_governor()
+    provider = governor.frame_analyzer.provider
+    observe(governor, BUDGET * 1.5)
+    assert governor.level.name == "overlay_half"
+    observe(governor, BUDGET * 1.5, WINDOW - 1)
+    # Only frames run at the new level count
+    assert governor.level.name == "overlay_half"
+    observe(governor, BUDGET * 1.5, 1)
+    assert governor.level.name == "input_640"
+    assert governor.frame_analyzer.max_input_size == 640
+
+    observe(governor, BUDGET * 1.5, 2 * WINDOW)
+    assert governor.level.name == "keyframes_3"
+    assert isinstance(governor.pipeline.frame_analyzer, tracking.KeyframeAnalyzer)
+    assert governor.pipeline.frame_analyzer.keyframe_interval == 3
+
+    observe(governor, BUDGET * 1.5, 2 * WINDOW)
+    # The cheapest level is as far as it goes
+    assert governor.level.name == "no_refine" and governor.index == len(qos.LEVELS) - 1
+    assert governor.frame_analyzer.provider is not provider
+    assert governor.frame_analyzer.provider.settings["refine_landmarks"] is False
+    assert [governor.render_overlay() for governor.frame_count in range(8)] == [True, False, False, False] * 2
+
+
+def test_steps_up_with_headroom_and_idle_cpus():
+    cpu_load = CpuLoad(0.95)
+    governor = get_governor(cpu_load)
+    observe(governor, BUDGET * 1.5, 3 * WINDOW)
+    assert governor.level.name == "input_480"
+
+    # Under budget but without headroom
+    observe(governor, BUDGET * 0.8, 3 * WINDOW)
+    assert governor.level.name == "input_480"
+    # Headroom, but other processes keep the CPUs busy
+    observe(governor, BUDGET * 0.3, 3 * WINDOW)
+    assert governor.level.name == "input_480"
+
+    cpu_load.load = 0.5
+    observe(governor, BUDGET * 0.3)
+    assert governor.level.name == "input_640"
+    cpu_load.load = None
+    observe(governor, BUDGET * 0.3, 3 * WINDOW)
+    assert governor.index == 0
+    assert governor.frame_analyzer.max_input_size is None
+    assert governor.pipeline.frame_analyzer is governor.frame_analyzer
+
+
+def test_configured_settings_are_only_made_cheaper():
+    detection_pipeline = pipeline.DetectionPipeline(frame_analysis.FrameAnalyzer(FakeFaceMesh(), max_input_size=320))
+    keyframe_analyzer = tracking.use_keyframes(detection_pipeline, keyframe_interval=5)
+    governor = qos.QosGovernor(detection_pipeline, BUDGET, window=WINDOW, cpu_load=CpuLoad(None))
+    observe(governor, BUDGET * 1.5, 4 * WINDOW)
+    assert governor.level.name == "keyframes_3"
+    assert governor.frame_analyzer.max_input_size == 320
+    assert detection_pipeline.frame_analyzer is keyframe_analyzer and keyframe_analyzer.keyframe_interval == 5
+    governor.close()
+
+
+def test_close_restores_the_configured_models():
+    governor = get_governor()
+    provider = governor.frame_analyzer.provider
+    observe(governor, BUDGET * 1.5, len(qos.LEVELS) * WINDOW)
+    variant = governor.frame_analyzer.provider
+    assert variant is not provider
+
+    governor.close()
+    assert governor.frame_analyzer.provider is provider
+    assert variant.closed and not provider.closed
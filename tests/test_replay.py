@@ -0,0 +1,19 @@
+from roadsense_ai.landmark_provider import landmark_provider
+from roadsense_ai.replay import replay
+
+from . import synthetic
+
+
+def test_timeline_is_deterministic(tmp_path):
+    video = synthetic.write_video(tmp_path / "drive.avi")
+    timelines = []
+    for run in range(2):
+        output = tmp_path / f"timeline{run}.jsonl"
+        provider = landmark_provider.ReplayProvider(*synthetic.get_drive())
+        summary = replay.write_timeline(replay.measure_frames(video, provider=provider), output, callibrate=True)
+        assert summary["frames"] == synthetic.DRIVE_FRAMES
+        timelines.append(synthetic.read_timeline(output))
+
+    assert timelines[0] == timelines[1]
+    assert {("drowsiness_detect", "start"), ("drowsiness_detect", "end"),
+            ("head_pose_detect", "start"), ("driver_not_visible", "start")} <= synthetic.get_events(timelines[0])
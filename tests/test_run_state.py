@@ -0,0 +1,79 @@
+import threading
+import time
+
+from roadsense_ai.run_state import run_state
+
+
+def wait_in_thread(wait, timeout=5.0):
+    """Run a RunState wait on another thread, returns the thread and a list that gets (result, seconds)"""
+    result = []
+
+    def waiter():
+        begin = time.monotonic()
+        value = wait(timeout)
+        result.append((value, time.monotonic() - begin))
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    return thread, result
+
+
+def test_wait_for_tracking_blocks_until_tracking_starts():
+    state = run_state.RunState()
+    thread, result = wait_in_thread(state.wait_for_tracking)
+    time.sleep(0.05)
+    assert thread.is_alive()
+
+    # Pausing or stopping does not start tracking
+    state.pause()
+    state.stop()
+    time.sleep(0.05)
+    assert thread.is_alive()
+
+    state.start()
+    thread.join(1)
+    assert result and result[0][0] is True
+    assert state.wait_for_tracking(0) is True
+
+
+def test_wait_for_tracking_returns_on_shutdown():
+    state = run_state.RunState()
+    state.start()
+    state.pause()
+    thread, result = wait_in_thread(state.wait_for_tracking)
+    time.sleep(0.05)
+    begin = time.monotonic()
+    state.shutdown()
+    thread.join(1)
+    assert result and result[0][0] is False and time.monotonic() - begin < 0.5
+
+    # Shutdown is final
+    state.start()
+    assert state.is_shutdown and not state.tracking
+    assert state.wait_for_tracking(0) is False
+
+
+def test_wait_for_tracking_times_out():
+    state = run_state.RunState()
+    begin = time.monotonic()
+    assert state.wait_for_tracking(0.05) is False
+    assert 0.04 < time.monotonic() - begin < 1.0
+
+
+def test_webcam_is_only_off_while_paused():
+    state = run_state.RunState()
+    assert state.webcam and state.wait_for_webcam(0) is True
+    state.pause()
+    assert not state.webcam
+    thread, result = wait_in_thread(state.wait_for_webcam)
+    time.sleep(0.05)
+    assert thread.is_alive()
+    state.resume()
+    thread.join(1)
+    assert result and result[0][0] is True and state.tracking
+
+    state.pause()
+    thread, result = wait_in_thread(state.wait_for_webcam)
+    state.shutdown()
+    thread.join(1)
+    assert result and result[0][0] is False
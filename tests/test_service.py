@@ -0,0 +1,69 @@
+import pytest
+
+from roadsense_ai.pipeline import pipeline
+from roadsense_ai.replay import replay
+from roadsense_ai.service import service
+
+
+RESULTS = [
+    pipeline.FrameResult(0.0, 0.31, 2.5, -4.0, "Forward", False, False, False),
+    pipeline.FrameResult(0.033, 0.12, 3.0, -21.5, "Right", True, True, False, perclos=0.2),
+    pipeline.FrameResult(0.067, None, None, None, None, True, False, True, fatigued=True, perclos=0.25),
+    pipeline.FrameResult(0.1, 0.3, -12.0, 1.0, "Down", False, False, False, perclos=0.0),
+]
+
+
+def assert_frame(message, result):
+    expected = result.to_dict()
+    assert message["type"] == "frame"
+    assert message["timestamp"] == expected["timestamp"]
+    assert message["direction"] == expected["direction"]
+    assert message["alerts"] == expected["alerts"]
+    # The measurements are sent as float32
+    for name in "ear", "pitch", "yaw", "perclos":
+        assert message[name] == (None if expected[name] is None else pytest.approx(expected[name], rel=1e-6)), name
+
+
+def test_frame_round_trip():
+    frame = service.MESSAGES[service.FRAME]
+    for result in RESULTS:
+        data = service.encode_frame(result)
+        assert len(data) == frame.size
+        fields = frame.unpack(data)
+        assert_frame(service.decode(fields[0], fields[1:]), result)
+
+
+def test_event_round_trip():
+    event = service.MESSAGES[service.EVENT]
+    data = service.encode_events(1.5, ["drowsiness_detect", "head_pose_detect"],
+                                 ["head_pose_detect", "sleep_reminder_detect"])
+    messages = [service.decode(fields[0], fields[1:]) for fields in event.iter_unpack(data)]
+    assert messages == [
+        {"type": "event", "timestamp": 1.5, "alert": "sleep_reminder_detect", "state": "start"},
+        {"type": "event", "timestamp": 1.5, "alert": "drowsiness_detect", "state": "end"},
+    ]
+
+
+def test_subscriber_receives_published_results(tmp_path):
+    path = str(tmp_path / "events.sock")
+    publisher = service.EventPublisher(path)
+    publisher.start()
+    subscriber = service.EventSubscriber(path, timeout=5.0)
+    try:
+        assert subscriber.version == service.VERSION
+        for result in RESULTS:
+            publisher.publish_result(result)
+        publisher.stop()
+        messages = list(subscriber)
+    finally:
+        subscriber.close()
+
+    previous_alerts = []
+    for result in RESULTS:
+        assert_frame(messages.pop(0), result)
+        for event in replay.get_events(previous_alerts, result.alerts):
+            assert messages.pop(0) == {"type": "event", "timestamp": result.timestamp, "alert": event["type"],
+                                       "state": event["state"]}
+        previous_alerts = result.alerts
+    assert not messages
+    assert publisher.counts["frames"] == len(RESULTS)
@@ -0,0 +1,39 @@
+import numpy as np
+
+from roadsense_ai.sweep import sweep
+
+from . import synthetic
+
+
+SETTINGS = [
+    {"ear_thresh": 0.24, "drowsiness_wait_time": 0.9, "head_pose_offset": 10, "head_pose_wait_time": 0.7},
+    {"ear_thresh": 0.2, "drowsiness_wait_time": 0.3, "head_pose_offset": 5, "head_pose_wait_time": 0.3},
+    {"ear_thresh": 0.3, "drowsiness_wait_time": 2.0, "head_pose_offset": 14, "head_pose_wait_time": 1.5},
+]
+FORWARD = (1.0, -2.0)
+
+
+def get_sweep():
+    timestamps, ear, pitch, yaw = synthetic.synthetic_session(minutes=3.0)
+    return sweep.ThresholdSweep(timestamps, ear, pitch, yaw, FORWARD), (timestamps, ear, pitch, yaw)
+
+
+def test_timeline_matches_detection_pipeline():
+    threshold_sweep, session = get_sweep()
+    for settings in SETTINGS:
+        timeline = threshold_sweep.timeline(*settings.values())
+        drowsy, head_pose = synthetic.run_pipeline(*session, FORWARD, settings)
+        assert drowsy.any() and head_pose.any()
+        np.testing.assert_array_equal(timeline[sweep.DROWSINESS], drowsy)
+        np.testing.assert_array_equal(timeline[sweep.HEAD_POSE], head_pose)
+
+
+def test_grid_counts_match_timelines():
+    threshold_sweep, _ = get_sweep()
+    grid = [[settings[name] for settings in SETTINGS] for name in SETTINGS[0]]
+    columns = threshold_sweep.run(*grid)
+    for index in range(len(columns["f1"])):
+        settings = [columns[name][index] for name in SETTINGS[0]]
+        starts = [event["type"] for event in threshold_sweep.events(*settings) if event["state"] == "start"]
+        assert columns["drowsiness_alerts"][index] == starts.count(sweep.DROWSINESS)
+        assert columns["head_pose_alerts"][index] == starts.count(sweep.HEAD_POSE)
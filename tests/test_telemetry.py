@@ -0,0 +1,138 @@
+import sqlite3
+
+import pytest
+
+from roadsense_ai.pipeline import pipeline
+from roadsense_ai.telemetry import telemetry
+
+from . import synthetic
+
+
+def get_results(minutes):
+    timestamps, ear, pitch, yaw = synthetic.synthetic_session(minutes)
+    # A stretch with no frames at all, longer than MAX_FRAME_GAP
+    timestamps[len(timestamps) // 2:] += 5.0
+    detection_pipeline = pipeline.DetectionPipeline(None)
+    return [detection_pipeline.update(measurement)
+            for measurement in synthetic.get_measurements(timestamps, ear, pitch, yaw)]
+
+def get_expected(results):
+    """The trip summary computed frame by frame: each frame lasts until the next one, except across gaps"""
+    times = dict.fromkeys(("visible_time", "drowsy_time", "head_pose_time", "not_visible_time", "fatigued_time"), 0.0)
+    for result, following in zip(results, results[1:]):
+        gap = following.timestamp - result.timestamp
+        duration = gap if gap <= telemetry.MAX_FRAME_GAP else 0.0
+        for name, active in (("visible_time", result.ear is not None), ("drowsy_time", result.drowsy),
+                             ("head_pose_time", result.head_pose), ("not_visible_time", result.driver_not_visible),
+                             ("fatigued_time", result.fatigued)):
+            times[name] += duration * bool(active)
+    alerts = {}
+    for result, previous in zip(results, [None] + results):
+        for alert in result.alerts:
+            if previous is None or alert not in previous.alerts:
+                alerts[alert] = alerts.get(alert, 0) + 1
+    ear = [result.ear for result in results if result.ear is not None]
+    perclos = [result.perclos for result in results if result.perclos is not None]
+    return {"frames": len(results), "duration": results[-1].timestamp - results[0].timestamp, **times,
+            "mean_ear": sum(ear) / len(ear), "max_perclos": max(perclos) if perclos else None, "alerts": alerts}
+
+
+def test_trip_summary_matches_frames(tmp_path):
+    results = get_results(minutes=2.0)
+    path = str(tmp_path / "telemetry.db")
+    recorder = telemetry.TelemetryRecorder(telemetry.SqliteTelemetryWriter(path), driver="test", batch_size=256)
+    recorder.start()
+    for result in results:
+        recorder.record(result)
+    recorder.stop(timeout=10.0)
+    assert recorder.counts["written"] == len(results)
+
+    database = telemetry.TelemetryDatabase(path)
+    try:
+        trips = database.trips()
+        assert len(trips) == 1 and trips[0]["driver"] == "test" and trips[0]["ended"] is not None
+        summary = database.summary(trips[0]["id"])
+    finally:
+        database.close()
+
+    expected = get_expected(results)
+    assert expected["alerts"] and expected["not_visible_time"] > 0.0
+    assert summary["alerts"] == expected.pop("alerts")
+    for name, value in expected.items():
+        assert summary[name] == pytest.approx(value, abs=1e-6), name
+
+
+def test_events_are_recorded_with_the_frames(tmp_path):
+    path = str(tmp_path / "telemetry.db")
+    recorder = telemetry.TelemetryRecorder(telemetry.SqliteTelemetryWriter(path))
+    recorder.start()
+    for index, drowsy in enumerate((False, True, True, False, True)):
+        recorder.record(pipeline.FrameResult(index * 0.1, 0.1 if drowsy else 0.3, 0.0, 0.0, "Forward", drowsy,
+                                             False, False))
+    recorder.stop(timeout=10.0)
+
+    database = telemetry.TelemetryDatabase(path)
+    try:
+        assert database.alert_counts(database.trips()[0]["id"]) == {"drowsiness_detect": 2}
+        states = [row[0] for row in database.connection.execute("SELECT state FROM events ORDER BY rowid")]
+    finally:
+        database.close()
+    assert states == ["start", "end", "start"]
+
+
+class FailingWriter:
+    """Telemetry writer whose writes fail like a full disk, until failures runs out"""
+    def __init__(self, failures):
+        self.failures = failures
+        self.batches = []
+
+    def begin_trip(self, started, driver=None):
+        return 1
+
+    def write(self, trip_id, frames, events):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database or disk is full")
+        self.batches.append((frames, events))
+
+    def end_trip(self, trip_id, ended):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_failed_batches_do_not_stop_the_writer():
+    writer = FailingWriter(failures=2)
+    recorder = telemetry.TelemetryRecorder(writer, batch_size=2, flush_interval=10.0)
+    recorder.start()
+    for batch in range(3):
+        for index in range(2):
+            recorder.record(pipeline.FrameResult(batch + index * 0.1, 0.3, 0.0, 0.0, "Forward", False, False, False))
+        # Full batches are written one at a time, the first two fail
+        while recorder.counts["errors"] + recorder.counts["batches"] <= batch:
+            recorder.thread.join(0.001)
+    recorder.stop(timeout=10.0)
+    assert not recorder.thread.is_alive()
+    assert recorder.counts["errors"] == 2
+    assert recorder.counts["written"] == sum(len(frames) for frames, _ in writer.batches) == 2
+
+
+def test_events_are_capped_while_the_writer_is_stuck():
+    recorder = telemetry.TelemetryRecorder(FailingWriter(failures=0), max_queue=4)
+    # Not started, so nothing takes the queues
+    for index in range(20):
+        recorder.record(pipeline.FrameResult(index * 0.1, 0.3, 0.0, 0.0, "Forward", index % 2 == 1, False, False))
+    assert len(recorder.events) == 4 and len(recorder.frames) == 4
+    assert recorder.counts["dropped_events"] == 15
+    assert recorder.counts["dropped"] == 16
+
+
+def test_jsonl_trips_started_together_get_their_own_files(tmp_path):
+    writer = telemetry.JsonlTelemetryWriter(str(tmp_path))
+    trip_ids = []
+    for _ in range(3):
+        trip_ids.append(writer.begin_trip(1700000000.25))
+        writer.end_trip(trip_ids[-1], 1700000001.0)
+    assert len(set(trip_ids)) == 3
+    assert len(list(tmp_path.iterdir())) == 3
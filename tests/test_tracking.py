@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+
+from roadsense_ai.frame_analysis import frame_analysis
+from roadsense_ai.landmark_provider import landmark_provider
+from roadsense_ai.pipeline import pipeline
+from roadsense_ai.tracking import tracking
+
+from . import synthetic
+
+
+IMG_W, IMG_H = 640, 480
+SHIFT = 2
+
+
+class MovingFaceProvider(landmark_provider.LandmarkProvider):
+    """Landmarks of a face moving SHIFT pixels to the right per frame, the test sets the frame"""
+    def __init__(self, landmarks):
+        self.landmarks = landmarks
+        self.frame = 0
+        self.calls = []
+
+    def detect(self, image, timestamp=None):
+        self.calls.append(self.frame)
+        return get_truth(self.landmarks, self.frame)
+
+
+def get_truth(landmarks, frame):
+    moved = landmarks.copy()
+    moved[:, 0] += frame * SHIFT / IMG_W
+    return moved
+
+def get_frames(count):
+    """Camera frames of a textured scene panning so that it moves SHIFT pixels right per frame once flipped"""
+    rng = np.random.default_rng(0)
+    scene = cv2.GaussianBlur(rng.integers(0, 256, (IMG_H, IMG_W + count * SHIFT), dtype=np.uint8), (5, 5), 0)
+    scene = cv2.cvtColor(scene, cv2.COLOR_GRAY2BGR)
+    start = count * SHIFT
+    return [cv2.flip(scene[:, start - frame * SHIFT:start - frame * SHIFT + IMG_W], 1) for frame in range(count)]
+
+def get_face(ear=0.35):
+    landmarks, _ = synthetic.synthetic_head_poses(1, IMG_W, IMG_H, noise_px=0.0)
+    synthetic.set_eyes(landmarks, np.array([ear]), IMG_W, IMG_H)
+    return landmarks[0]
+
+
+def test_tracked_landmarks_follow_the_image():
+    face = get_face()
+    provider = MovingFaceProvider(face)
+    detection_pipeline = pipeline.DetectionPipeline(frame_analysis.FrameAnalyzer(provider))
+    analyzer = tracking.use_keyframes(detection_pipeline, keyframe_interval=4)
+
+    keyframes = []
+    for frame, image in enumerate(get_frames(12)):
+        provider.frame = frame
+        analysis = analyzer.analyze(image, frame / 30.0)
+        keyframes.append(analysis.keyframe)
+        truth = get_truth(face, frame)
+        error = np.abs((analysis.landmarks[:, :2] - truth[:, :2]) * (IMG_W, IMG_H))
+        assert error.max() < 0.25, frame
+        np.testing.assert_array_equal(analysis.landmarks[:, 2], face[:, 2])
+
+    assert keyframes == [True, False, False, False] * 3
+    assert provider.calls == [0, 4, 8]
+    assert analyzer.keyframe_ratio == 0.25
+
+
+def test_keyframes_are_forced_near_the_thresholds():
+    face = get_face()
+    provider = MovingFaceProvider(face)
+    detection_pipeline = pipeline.DetectionPipeline(frame_analysis.FrameAnalyzer(provider))
+    tracking.use_keyframes(detection_pipeline, keyframe_interval=4)
+    drowsiness_detector = detection_pipeline.drowsiness_detector
+
+    keyframes = []
+    # The EAR of the open eyes is close to the threshold on frame 1 only
+    for frame, (image, ear_thresh) in enumerate(zip(get_frames(5), (0.24, 0.33, 0.24, 0.24, 0.24))):
+        provider.frame = frame
+        drowsiness_detector.EAR_THRESH = ear_thresh
+        analysis, measurement = detection_pipeline.analyze_frame(image, frame / 30.0)
+        keyframes.append(analysis.keyframe)
+        assert abs(measurement.ear - 0.35) < 0.03
+
+    # Frame 1 is tracked and then refined, frame 2 escalated straight to a keyframe
+    assert keyframes == [True, True, True, False, False]
+    assert provider.calls == [0, 1, 2]
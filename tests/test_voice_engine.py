@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+import wave
+
+from roadsense_ai.voice_engine import voice_engine
+
+
+def write_wav(path, frames=800):
+    with wave.open(path, "wb") as clip:
+        clip.setnchannels(1)
+        clip.setsampwidth(2)
+        clip.setframerate(16000)
+        clip.writeframes(b"\0\0" * frames)
+
+
+class RenderingVoiceEngine(voice_engine.RecordingVoiceEngine):
+    """Records live speech and renders silent clips, or empty ones when broken"""
+    def __init__(self, rate=220, broken=False):
+        super().__init__()
+        self.rate = rate
+        self.broken = broken
+        self.rendered = []
+
+    def get_settings(self):
+        return "test-voice", self.rate
+
+    def render(self, phrases):
+        self.rendered.append(sorted(phrases))
+        for path in phrases.values():
+            write_wav(path, 0 if self.broken else 800)
+
+
+class FakePlayer:
+    """Each clip plays for `duration` seconds unless stopped, start() can be held open by a gate"""
+    def __init__(self, duration=0.0, gate=None):
+        self.duration = duration
+        self.gate = gate
+        self.clips = []
+        self.started = threading.Event()
+        self.stopped = threading.Event()
+
+    def start(self, clip):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.stopped.clear()
+        self.clips.append(clip)
+        self.started.set()
+
+    def wait(self):
+        self.stopped.wait(self.duration)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def speak_in_thread(engine, audio):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(engine.speak(audio)))
+    thread.start()
+    return thread, result
+
+
+def test_clips_are_rendered_once_and_cached(tmp_path):
+    phrases = ["Wake up", "Look forward"]
+    backend = RenderingVoiceEngine()
+    engine = voice_engine.ClipVoiceEngine(backend, FakePlayer(), str(tmp_path))
+    assert engine.preload(phrases) == 0
+    assert engine.misses == 2 and backend.rendered == [sorted(phrases)]
+    assert set(engine.clips) == set(phrases)
+
+    # Another run finds them on disk
+    backend = RenderingVoiceEngine()
+    engine = voice_engine.ClipVoiceEngine(backend, FakePlayer(), str(tmp_path))
+    assert engine.preload(phrases) == 2
+    assert engine.misses == 0 and backend.rendered == []
+
+    # A different rate sounds different, so it has clips of its own
+    backend = RenderingVoiceEngine(rate=180)
+    engine = voice_engine.ClipVoiceEngine(backend, FakePlayer(), str(tmp_path))
+    assert engine.preload(phrases) == 0
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_missing_phrase_is_synthesized_on_first_use(tmp_path):
+    backend = RenderingVoiceEngine()
+    player = FakePlayer()
+    engine = voice_engine.ClipVoiceEngine(backend, player, str(tmp_path))
+    started = []
+    assert engine.speak("Take a break", on_start=lambda: started.append(True)) is False
+    assert engine.speak("Take a break") is False
+    assert backend.rendered == [["Take a break"]] and engine.misses == 1
+    assert len(player.clips) == 2 and player.clips[0] == engine.clips["Take a break"]
+    assert started == [True] and backend.spoken == []
+
+
+def test_failed_render_is_said_live(tmp_path):
+    backend = RenderingVoiceEngine(broken=True)
+    player = FakePlayer()
+    engine = voice_engine.ClipVoiceEngine(backend, player, str(tmp_path))
+    assert engine.speak("Take a break") is False
+    assert [audio for _, audio in backend.spoken] == ["Take a break"] and player.clips == []
+
+
+def test_stop_cuts_playback_short(tmp_path):
+    backend = RenderingVoiceEngine()
+    player = FakePlayer(duration=5.0)
+    engine = voice_engine.ClipVoiceEngine(backend, player, str(tmp_path))
+    engine.preload(["Wake up"])
+    thread, result = speak_in_thread(engine, "Wake up")
+    assert player.started.wait(5)
+    begin = time.monotonic()
+    engine.stop()
+    thread.join(5)
+    assert result == [True] and time.monotonic() - begin < 1.0
+    assert backend.stopped.is_set()
+
+    # Stopped until reset, then it plays again
+    assert engine.speak("Wake up") is True and len(player.clips) == 1
+    engine.reset()
+    player.duration = 0.0
+    assert engine.speak("Wake up") is False and len(player.clips) == 2
+
+
+def test_stop_while_playback_is_starting(tmp_path):
+    gate = threading.Event()
+    player = FakePlayer(duration=5.0, gate=gate)
+    engine = voice_engine.ClipVoiceEngine(RenderingVoiceEngine(), player, str(tmp_path))
+    engine.preload(["Wake up"])
+    thread, result = speak_in_thread(engine, "Wake up")
+    # speak() passed its stopped check and is starting the clip
+    while not engine.lock.locked():
+        time.sleep(0.001)
+    stopper = threading.Thread(target=engine.stop)
+    stopper.start()
+    time.sleep(0.05)
+    assert stopper.is_alive()
+
+    begin = time.monotonic()
+    gate.set()
+    stopper.join(5)
+    thread.join(5)
+    # The stop waited for the clip to start and then ended it
+    assert result == [True] and len(player.clips) == 1 and time.monotonic() - begin < 1.0
+
+
+def test_null_and_recording_engines():
+    started = []
+    assert voice_engine.NullVoiceEngine().speak("Wake up", lambda: started.append(True)) is False
+    assert started == [True]
+
+    backend = voice_engine.RecordingVoiceEngine(duration=5.0)
+    thread, result = speak_in_thread(backend, "Wake up")
+    while not backend.spoken:
+        time.sleep(0.001)
+    backend.stop()
+    thread.join(5)
+    assert result == [True] and backend.interrupted == ["Wake up"]
+    assert backend.speak("Look forward") is True
+    backend.reset()
+    backend.duration = 0.0
+    assert backend.speak("Look forward") is False
+    assert [audio for _, audio in backend.spoken] == ["Wake up", "Look forward"]